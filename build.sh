@@ -1,3 +1,4 @@
 set -ex
 export PATH=/usr/conda/bin:"$PATH"
+export PYTHONPATH="$(pwd):$PYTHONPATH"
 python scripts/tadej_build.py
@@ -2,13 +2,18 @@ import numpy as np
 import pandas as pd
 import gc
 
+from src.data import read_table
+from src.feature_matrix import save_features
+from src.periods import LAST_MONTH, month_code, month_codes, month_end_str
+
 
 def make_features():
-    
+    last_month = month_code(LAST_MONTH)
+
     #######################
     # Make transaction features
     column_names = ['client_id', 'tran_amt_rur', 'mcc_cd']
-    transaction = pd.read_csv('data/trxn.csv', usecols=column_names)
+    transaction = read_table('data/trxn.csv', columns=column_names)
     transaction_ft = transaction[column_names]
     del transaction
     gc.collect()
@@ -24,10 +29,14 @@ def make_features():
     #######################
     # Make balance features
 
-    balances = pd.read_csv("data/balance.csv")
+    balances = read_table(
+        "data/balance.csv",
+        columns=["client_id", "month_end_dt", "avg_bal_sum_rur", "max_bal_sum_rur", "min_bal_sum_rur"],
+    )
+    balances["month"] = month_codes(balances.pop("month_end_dt"))
 
     # Sum up across all accounts
-    account_sums = balances.groupby(["client_id", "month_end_dt"])[
+    account_sums = balances.groupby(["client_id", "month"])[
         ["avg_bal_sum_rur", "max_bal_sum_rur", "min_bal_sum_rur"]
     ].sum()
     del balances
@@ -41,22 +50,22 @@ def make_features():
 
     # Get the average amount in the last month
     last_month_avg = account_sums.iloc[
-        account_sums.index.get_level_values("month_end_dt") == "2019-08-31"
+        account_sums.index.get_level_values("month") == last_month
     ]
     last_month_avg = last_month_avg["avg_bal_sum_rur"]
-    last_month_avg.index = last_month_avg.index.droplevel("month_end_dt")
+    last_month_avg.index = last_month_avg.index.droplevel("month")
 
     # Get differences from the average in the last month
     account_sums["diff_last_month"] = account_sums["avg_bal_sum_rur"] - last_month_avg
     diffs = (
         account_sums["diff_last_month"]
         .reset_index()
-        .query('month_end_dt != "2019-08-31"')
+        .query("month != @last_month")
     )
-    diffs = diffs.pivot(index="client_id", columns="month_end_dt")
+    diffs = diffs.pivot(index="client_id", columns="month")
 
     # Put together all balance features
-    diffs.columns = [f"balance_diff_{c[1]}" for c in diffs.columns]
+    diffs.columns = [f"balance_diff_{month_end_str(c[1])}" for c in diffs.columns]
     balance_ft = diffs
     balance_ft["avg_range"] = avg_range
     balance_ft["last_month_avg"] = last_month_avg
@@ -66,10 +75,11 @@ def make_features():
     #######################
     # Make aum features
 
-    aum = pd.read_csv('data/aum.csv')
+    aum = read_table('data/aum.csv', columns=['client_id', 'month_end_dt', 'balance_rur_amt'])
+    aum['month'] = month_codes(aum.pop('month_end_dt'))
 
     # Sum up across all accounts
-    aum_sums = aum.groupby(['client_id', 'month_end_dt'])[['balance_rur_amt']].sum()
+    aum_sums = aum.groupby(['client_id', 'month'])[['balance_rur_amt']].sum()
     del aum
     gc.collect()
 
@@ -77,17 +87,17 @@ def make_features():
     aum_std = aum_sums.std(level='client_id', skipna=True)
 
     # Get the average amount in the last month
-    last_month_aum = aum_sums.iloc[aum_sums.index.get_level_values('month_end_dt') == '2019-08-31']
+    last_month_aum = aum_sums.iloc[aum_sums.index.get_level_values('month') == last_month]
     last_month_aum = last_month_aum['balance_rur_amt']
-    last_month_aum.index = last_month_aum.index.droplevel('month_end_dt')
+    last_month_aum.index = last_month_aum.index.droplevel('month')
 
     # Get differences from the average in the last month
     aum_sums['diff_last_month'] = aum_sums['balance_rur_amt'] - last_month_aum
-    diffs = aum_sums['diff_last_month'].reset_index().query('month_end_dt != "2019-08-31"')
-    diffs = diffs.pivot(index='client_id', columns='month_end_dt')
+    diffs = aum_sums['diff_last_month'].reset_index().query('month != @last_month')
+    diffs = diffs.pivot(index='client_id', columns='month')
 
     # Put together all balance features
-    diffs.columns = [f'aum_diff_{c[1]}' for c in diffs.columns]
+    diffs.columns = [f'aum_diff_{month_end_str(c[1])}' for c in diffs.columns]
     aum_ft = diffs
     aum_ft['aum_std'] = aum_std
     aum_ft['aum_last_month'] = last_month_aum
@@ -97,7 +107,10 @@ def make_features():
     #######################
     # Make client features
 
-    client = pd.read_csv("data/client.csv")
+    client = read_table(
+        "data/client.csv",
+        columns=["client_id", "gender", "age", "region", "city", "education"],
+    )
 
     # Take out citizenship and job_type, they are useless
     client_ft = client.set_index("client_id")[
@@ -119,8 +132,8 @@ def make_features():
     client_ft["city"] = client_ft["city"].astype("str")
     client_ft["region"] = client_ft["region"].astype("str")
 
-    client_ft[["gender", "education"]] = client_ft[["gender", "education"]].fillna(
-        "nan"
+    client_ft[["gender", "education"]] = (
+        client_ft[["gender", "education"]].astype("object").fillna("nan")
     )
     del region_counts, top_regions, city_counts, top_cities
     gc.collect()
@@ -134,7 +147,7 @@ def make_features():
         transaction_ft
     ], axis=1)
     full_data[['mcc_cd', 'tran_amt_rur']] = full_data[['mcc_cd', 'tran_amt_rur']].fillna('nan')
-    full_data.to_pickle('final_version.pickle')
+    save_features(full_data, 'final_version.features')
 
 
 if __name__ == "__main__":
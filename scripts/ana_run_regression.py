@@ -1,9 +1,12 @@
-import numpy as np
-import pandas as pd
-from catboost import CatBoostRegressor, Pool
+from src.feature_matrix import FeatureMatrix
+from src.inference import predict_to_csv
+from src.profiling import stage
 
 
 def predict():
+    # catboost takes a while to import, it is only loaded when predicting
+    from catboost import CatBoostRegressor
+
     CAT_FEATURES = ['gender', 'region', 'city', 'education', 'mcc_cd']
 
     try:
@@ -11,12 +14,10 @@ def predict():
     except:
         model = CatBoostRegressor().load_model('ana_model.cbm', 'cbm')
     
-    data = pd.read_pickle('final_version.pickle')
-    data_pool = Pool(data = data, cat_features=CAT_FEATURES)
-
-    target = (model.predict(data_pool) > 0).astype(int)
-    submission = pd.DataFrame({'client_id': data.index, 'target': target})
-    submission.to_csv('submission.csv', index=False)
+    with stage('load'):
+        data = FeatureMatrix('final_version.features')
+    with stage('predict'):
+        predict_to_csv(model, data, CAT_FEATURES, 'submission.csv', threshold=0)
 
 if __name__ == "__main__":
     predict()
\ No newline at end of file
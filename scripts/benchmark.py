@@ -0,0 +1,154 @@
+"""Time and memory-profile every extractor and make_features on synthetic data of growing size.
+
+    PYTHONPATH=. python scripts/benchmark.py --scales 1,4,16 --out benchmark.json
+    PYTHONPATH=. python scripts/benchmark.py --compare benchmark.json
+
+Data for scale k has k times the clients of scale 1 and is generated with src.synthetic
+into bench_data/x<k> on first use. Every measurement runs in a fresh process, so peaks do
+not carry over. With --compare, the results are checked against an earlier run and the
+script fails if anything got slower or bigger than the tolerance allows.
+"""
+import argparse
+import inspect
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import time
+
+import pandas as pd
+
+from src import features
+from src.data import memory_report
+from src.profiling import rss_mb
+from src.synthetic import generate
+from scripts.tadej_build import make_features
+
+TABLES = ["balance", "aum", "trxn", "payments", "com", "client", "funnel", "deals", "dict_mcc"]
+
+
+def extractor_classes() -> dict:
+    """All *FtExtractor classes of src.features with the table they read by default."""
+    classes = {}
+    for name, cls in inspect.getmembers(features, inspect.isclass):
+        if name.endswith("FtExtractor") and cls.__module__ == features.__name__:
+            default_fn = inspect.signature(cls).parameters["fn"].default
+            classes[name] = (cls, os.path.splitext(os.path.basename(default_fn))[0])
+    return classes
+
+
+def _measure(target: str, data_dir: str, queue):
+    """Run one target in this (fresh) process and report its time and memory.
+
+    Memory is the peak resident set (ru_maxrss). tracemalloc would also count NumPy buffers,
+    but slows pandas down enough to distort the timings.
+    """
+    base_rss = rss_mb()
+    start = time.perf_counter()
+
+    if target == "make_features":
+        make_features(data_dir, out_fn=os.path.join(data_dir, "final_version.features"))
+        n_out = None
+    else:
+        cls, table = extractor_classes()[target]
+        n_out = len(cls(os.path.join(data_dir, f"{table}.csv")).load_transform())
+
+    seconds = time.perf_counter() - start
+    queue.put({
+        "seconds": seconds,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "peak_rss_delta_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 - base_rss,
+        "output_rows": n_out,
+    })
+
+
+def measure(target: str, data_dir: str) -> dict:
+    ctx = multiprocessing.get_context("fork")
+    queue = ctx.Queue()
+    proc = ctx.Process(target=_measure, args=(target, data_dir, queue))
+    proc.start()
+    proc.join()
+    if proc.exitcode != 0:
+        return {"error": f"exit code {proc.exitcode}"}
+    return queue.get()
+
+
+def run(scales: list, clients: int, trxn_per_client: float, months: int, data_root: str) -> list:
+    results = []
+    targets = list(extractor_classes()) + ["make_features"]
+    for scale in scales:
+        data_dir = os.path.join(data_root, f"x{scale}")
+        if not os.path.exists(os.path.join(data_dir, "funnel.csv")):
+            print(f"Generating {data_dir}")
+            generate(data_dir, clients * scale, trxn_per_client, months)
+
+        # Converting the tables to the columnar cache is a one-off cost, keep it out of the timings
+        tables = memory_report([os.path.join(data_dir, f"{t}.csv") for t in TABLES])
+
+        for target in targets:
+            res = measure(target, data_dir)
+            res.update({"scale": scale, "clients": clients * scale, "target": target})
+            if target != "make_features":
+                res["input_mb"] = float(tables.loc[extractor_classes()[target][1], "compact_mb"])
+            results.append(res)
+            print(f"x{scale:<3} {target:<26} {res.get('seconds', float('nan')):7.2f} s "
+                  f"{res.get('peak_rss_delta_mb', float('nan')):8.1f} MB" + (f"  {res['error']}" if "error" in res else ""))
+    return results
+
+
+def compare(results: list, previous: list, tolerance: float) -> bool:
+    """Print the change against an earlier run, return False if anything regressed."""
+    old = pd.DataFrame(previous).set_index(["scale", "target"])
+    new = pd.DataFrame(results).set_index(["scale", "target"])
+    joined = new[["seconds", "peak_rss_delta_mb"]].join(
+        old[["seconds", "peak_rss_delta_mb"]], rsuffix="_old", how="inner")
+    joined["time_ratio"] = joined["seconds"] / joined["seconds_old"]
+    joined["mem_ratio"] = joined["peak_rss_delta_mb"].clip(lower=1) / joined["peak_rss_delta_mb_old"].clip(lower=1)
+    print(joined[["time_ratio", "mem_ratio"]].to_string(float_format="%.2f"))
+
+    regressed = joined[(joined["time_ratio"] > tolerance) | (joined["mem_ratio"] > tolerance)]
+    if len(regressed):
+        print(f"\nRegressions over {tolerance:.2f}x:\n{regressed.index.tolist()}")
+    return len(regressed) == 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the extractors on synthetic data")
+    parser.add_argument("--scales", default="1,4,16", help="Comma separated multiples of --clients")
+    parser.add_argument("--clients", type=int, default=10_000, help="Clients at scale 1")
+    parser.add_argument("--trxn-per-client", type=float, default=50)
+    parser.add_argument("--months", type=int, default=12)
+    parser.add_argument("--data-root", default="bench_data")
+    parser.add_argument("--out", default="benchmark.json")
+    parser.add_argument("--compare", help="Earlier results to compare against")
+    parser.add_argument("--tolerance", type=float, default=1.25, help="Allowed slowdown / memory growth")
+    args = parser.parse_args()
+
+    scales = [int(s) for s in args.scales.split(",")]
+    results = run(scales, args.clients, args.trxn_per_client, args.months, args.data_root)
+
+    errors = [f"x{res['scale']} {res['target']}: {res['error']}" for res in results if "error" in res]
+    if errors:
+        print("\nFailed:\n" + "\n".join(errors))
+
+    ok = not errors
+    if args.compare:
+        with open(args.compare) as f:
+            ok = compare(results, json.load(f)["results"], args.tolerance) and ok
+
+    with open(args.out, "w") as f:
+        json.dump({
+            "created": time.time(),
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "cpus": os.cpu_count(),
+            "results": results,
+        }, f, indent=2)
+
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
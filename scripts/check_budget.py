@@ -0,0 +1,181 @@
+"""Run the build and run entry points under the judge's limits and report per-stage usage.
+
+    PYTHONPATH=. python scripts/check_budget.py                      # build.sh, then run.sh
+    PYTHONPATH=. python scripts/check_budget.py --mem-mb 1024 build.sh
+
+Each entry point runs pinned to one CPU, with a wall-clock timeout and a memory cap. The
+resident memory of the whole process tree is sampled continuously; going over the cap kills
+the tree, like the container's OOM killer would. Stages recorded with src.profiling.stage
+are reported with their time, peak memory and rows read per second.
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import pandas as pd
+
+from src.profiling import STAGE_LOG_ENV, rss_mb
+
+# Limits of the judge's container
+CPUS = 1
+MEM_MB = 2048
+TIMEOUT_S = 15 * 60
+
+SAMPLE_INTERVAL_S = 0.05
+
+
+def _children(pid: int) -> list:
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [int(c) for c in f.read().split()]
+    except FileNotFoundError:
+        return []
+
+
+def tree_rss_mb(pid: int) -> float:
+    """Resident memory of a process and all its descendants."""
+    total, stack = 0.0, [pid]
+    while stack:
+        p = stack.pop()
+        total += rss_mb(p)
+        stack.extend(_children(p))
+    return total
+
+
+def _limit(cpus: int, address_space_mb: float):
+    def preexec():
+        allowed = sorted(os.sched_getaffinity(0))
+        os.sched_setaffinity(0, allowed[:cpus])
+        if address_space_mb:
+            limit = int(address_space_mb * 2**20)
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+        # Own process group, so that the whole tree can be killed
+        os.setpgrp()
+
+    return preexec
+
+
+def run_limited(cmd: list, cpus: int, mem_mb: float, timeout_s: float, address_space_mb: float, stage_log: str):
+    """Run a command under the limits and sample its memory.
+
+    Returns:
+        (result, samples): Return code, wall time, peak memory and the reason it was stopped
+            (if it was), and (time, rss_mb) memory samples
+    """
+    env = dict(os.environ, **{STAGE_LOG_ENV: stage_log})
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [os.getcwd(), env.get("PYTHONPATH")]))
+
+    start = time.time()
+    proc = subprocess.Popen(cmd, env=env, preexec_fn=_limit(cpus, address_space_mb))
+    samples, stopped = [], []
+
+    def sample():
+        while proc.poll() is None:
+            now, rss = time.time(), tree_rss_mb(proc.pid)
+            samples.append((now, rss))
+            if rss > mem_mb and not stopped:
+                stopped.append(f"memory over {mem_mb:.0f} MB")
+                os.killpg(proc.pid, 9)
+            elif now - start > timeout_s and not stopped:
+                stopped.append(f"timeout after {timeout_s:.0f} s")
+                os.killpg(proc.pid, 9)
+            time.sleep(SAMPLE_INTERVAL_S)
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    returncode = proc.wait()
+    sampler.join()
+
+    result = {
+        "cmd": " ".join(cmd),
+        "returncode": returncode,
+        "seconds": time.time() - start,
+        "peak_rss_mb": max((rss for _, rss in samples), default=0.0),
+        "stopped": stopped[0] if stopped else None,
+    }
+    return result, samples
+
+
+def stage_report(stage_log: str, samples: list) -> pd.DataFrame:
+    """Attribute the memory samples to the stages that were open at the time."""
+    events = []
+    if os.path.exists(stage_log):
+        with open(stage_log) as f:
+            events = [json.loads(line) for line in f]
+
+    rows = []
+    for ev in events:
+        if ev["event"] != "end":
+            continue
+        in_stage = [rss for t, rss in samples if ev["start"] <= t <= ev["end"]]
+        rows.append({
+            "stage": ev["name"],
+            "seconds": ev["seconds"],
+            "peak_rss_mb": max(in_stage, default=ev["rss_mb"]),
+            "rows": ev["rows"],
+            "rows_per_s": ev["rows"] / ev["seconds"] if ev["seconds"] > 0 else 0.0,
+        })
+    columns = ["stage", "seconds", "peak_rss_mb", "rows", "rows_per_s"]
+    return pd.DataFrame(rows, columns=columns)
+
+
+def stats_events(stage_log: str) -> list:
+    """Statistics recorded with src.profiling.log_stats, e.g. the read time hidden by prefetching."""
+    if not os.path.exists(stage_log):
+        return []
+    with open(stage_log) as f:
+        return [ev for ev in map(json.loads, f) if ev["event"] == "stats"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that the build and run fit the judge's limits")
+    parser.add_argument("entry_points", nargs="*", default=["build.sh", "run.sh"],
+                        help="Shell scripts to run one after another")
+    parser.add_argument("--cpus", type=int, default=CPUS)
+    parser.add_argument("--mem-mb", type=float, default=MEM_MB, help="Resident memory cap of the process tree")
+    parser.add_argument("--timeout", type=float, default=TIMEOUT_S, help="Wall-clock limit of each entry point")
+    parser.add_argument("--address-space-mb", type=float, default=0,
+                        help="Also set RLIMIT_AS, off by default since it counts virtual memory")
+    parser.add_argument("--report", default="budget_report.json", help="Where to write the JSON report")
+    args = parser.parse_args()
+
+    report, ok = [], True
+    for entry_point in args.entry_points:
+        with tempfile.NamedTemporaryFile(suffix=".jsonl", delete=False) as f:
+            stage_log = f.name
+        try:
+            result, samples = run_limited(["bash", entry_point], args.cpus, args.mem_mb,
+                                          args.timeout, args.address_space_mb, stage_log)
+            stages = stage_report(stage_log, samples)
+            stats = stats_events(stage_log)
+        finally:
+            os.remove(stage_log)
+
+        print(f"\n{entry_point}: {result['seconds']:.1f} s, peak {result['peak_rss_mb']:.0f} MB, "
+              f"exit code {result['returncode']}" + (f", stopped: {result['stopped']}" if result["stopped"] else ""))
+        if len(stages):
+            print(stages.to_string(index=False, float_format="%.1f"))
+        for ev in stats:
+            if ev["name"] == "prefetch" and ev["tables"]:
+                print(f"prefetch: {ev['hidden_s']:.1f} s of {ev['read_s']:.1f} s reading hidden behind "
+                      f"computation, {ev['wait_s']:.1f} s waited for {ev['tables']} tables")
+
+        ok = ok and result["returncode"] == 0
+        report.append({**result, "stages": stages.to_dict(orient="records"), "stats": stats})
+
+    with open(args.report, "w") as f:
+        json.dump({"limits": {"cpus": args.cpus, "mem_mb": args.mem_mb, "timeout_s": args.timeout},
+                   "entry_points": report}, f, indent=2)
+
+    print("\nWithin budget" if ok else "\nOVER BUDGET or failed")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
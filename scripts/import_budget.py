@@ -0,0 +1,95 @@
+"""Report the import time of the entry points and check it against a budget.
+
+    PYTHONPATH=. python scripts/import_budget.py                  # all entry points
+    PYTHONPATH=. python scripts/import_budget.py src.features --top 30
+
+Every module is imported in a fresh interpreter with python -X importtime, the fastest of
+--runs attempts counts. The report lists the modules with the highest cumulative import
+time (the module and everything it imported first). The check fails if the import of an
+entry point takes longer than its budget, or if it loads a module that should only be
+imported on first use (catboost, matplotlib, ...).
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+# Entry points and their import time budget in milliseconds. Most of it is numpy and pandas
+BUDGET_MS = {
+    "scripts.tadej_build": 1500,
+    "scripts.tadej_run": 1200,
+    "scripts.tadej_run_regression": 1200,
+    "scripts.ana_build": 1200,
+    "scripts.ana_run_regression": 1200,
+    "src.features": 1500,
+    "src.pipeline": 1500,
+    "src.plot_utils": 1200,
+}
+
+# Loaded on first use only, never when an entry point is imported
+LAZY_MODULES = ["catboost", "matplotlib", "sklearn", "scipy.stats"]
+
+
+def import_times(module: str) -> dict:
+    """Cumulative import time in milliseconds of every module loaded by importing module."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, env=dict(os.environ, PYTHONDONTWRITEBYTECODE="1"),
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(cumulative) / 1000
+    return times
+
+
+def measure(module: str, runs: int) -> dict:
+    best = None
+    for _ in range(runs):
+        times = import_times(module)
+        if best is None or times[module] < best[module]:
+            best = times
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the import time of the entry points")
+    parser.add_argument("modules", nargs="*", default=list(BUDGET_MS), help="Modules to import")
+    parser.add_argument("--runs", type=int, default=3, help="Imports per module, the fastest counts")
+    parser.add_argument("--top", type=int, default=10, help="Slowest modules to list per entry point")
+    parser.add_argument("--budget-ms", type=float, help="Budget of every module, instead of BUDGET_MS")
+    parser.add_argument("--report", help="Where to write the JSON report")
+    args = parser.parse_args()
+
+    ok = True
+    report = {}
+    for module in args.modules:
+        times = measure(module, args.runs)
+        total = times[module]
+        budget = args.budget_ms or BUDGET_MS.get(module)
+        eager = [m for m in LAZY_MODULES if m in times]
+        within = (budget is None or total <= budget) and not eager
+        ok &= within
+
+        print(f"{module}: {total:.0f} ms" + (f" (budget {budget:.0f} ms)" if budget else "")
+              + ("" if within else "  FAIL"))
+        for name, ms in sorted(times.items(), key=lambda t: -t[1])[1:args.top + 1]:
+            print(f"    {ms:8.1f} ms  {name}")
+        if eager:
+            print(f"    loaded at import time: {', '.join(eager)}")
+        report[module] = {"total_ms": total, "budget_ms": budget, "eager": eager, "modules": times}
+
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=1)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
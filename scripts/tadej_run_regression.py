@@ -1,9 +1,12 @@
-import numpy as np
-import pandas as pd
-from catboost import CatBoostRegressor, Pool
+from src.feature_matrix import FeatureMatrix
+from src.inference import predict_to_csv
+from src.profiling import stage
 
 
 def predict():
+    # catboost takes a while to import, it is only loaded when predicting
+    from catboost import CatBoostRegressor
+
     CAT_FEATURES = ['gender', 'region', 'city', 'education', 'mcc_cd', 'feature_1']
 
     try:
@@ -11,13 +14,12 @@ def predict():
     except:
         model = CatBoostRegressor().load_model('tadej_model.cbm', 'cbm')
     
-    data = pd.read_pickle('final_version.pickle')
-    data_pool = Pool(data = data, cat_features=CAT_FEATURES)
+    with stage('load'):
+        data = FeatureMatrix('final_version.features')
 
     THRESHOLD = -2.1
-    target = (model.predict(data_pool) > THRESHOLD).astype(int)
-    submission = pd.DataFrame({'client_id': data.index, 'target': target})
-    submission.to_csv('submission.csv', index=False)
+    with stage('predict'):
+        predict_to_csv(model, data, CAT_FEATURES, 'submission.csv', threshold=THRESHOLD)
 
 if __name__ == "__main__":
     predict()
\ No newline at end of file
@@ -0,0 +1,238 @@
+import operator
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .data import read_table
+from .periods import LAST_MONTH, month_code, month_codes
+
+
+# Aggregations that can be computed per (client, row subset) and combined afterwards,
+# everything else (median, nunique, ...) needs its own pass over the rows of a spec
+DECOMPOSABLE = ('sum', 'count', 'mean', 'min', 'max', 'std')
+
+OPS = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+    'in': lambda col, values: col.isin(values),
+}
+
+
+def get_column_nms(cols: pd.core.indexes.multi.MultiIndex,
+                   prefix='',
+                   suffix=''):
+    nms = ['_'.join(col) for col in cols]
+    if prefix and prefix != '':
+        nms = ['_'.join([prefix, nm]) for nm in nms]
+    if suffix and suffix != '':
+        nms = ['_'.join([nm, suffix]) for nm in nms]
+    return nms
+
+
+class AggSpec:
+    """A block of aggregated features: table, row filters, time window, group key and aggregations.
+
+        AggSpec('data/com.csv', {'agr_flg': ['sum', 'mean']}, prefix='cash_loan',
+                filters=[('prod', '==', 'Cash Loan')])
+
+    describes the columns cash_loan_agr_flg_sum and cash_loan_agr_flg_mean, named like
+    get_column_nms names a groupby(...).agg(...) result.
+    """
+
+    def __init__(self,
+                 table: str,
+                 aggs: Dict[str, List[str]],
+                 prefix: str = '',
+                 filters: Sequence[Tuple[str, str, object]] = (),
+                 window: Optional[Tuple[str, int]] = None,
+                 key: str = 'client_id',
+                 last_month: str = LAST_MONTH):
+        """
+        Args:
+            table: Path to the input table
+            aggs: Aggregations of every column, like the argument of DataFrame.agg
+            prefix: Prefix of the column names
+            filters: Only rows where all (column, op, value) conditions hold, op one of OPS
+            window: (date column, n) to only aggregate rows of the last n months up to last_month
+            key: Column to group by
+            last_month: End of the time window
+        """
+        self.table = table
+        self.aggs = aggs
+        self.prefix = prefix
+        self.filters = [tuple(f) for f in filters]
+        self.window = window
+        self.key = key
+        self.last_month = last_month
+
+    def conditions(self) -> list:
+        """Hashable descriptions of the row conditions, shared conditions are evaluated once."""
+        conds = [('filter',) + f for f in self.filters]
+        if self.window is not None:
+            conds.append(('window', self.window[0], self.window[1], self.last_month))
+        return conds
+
+    def column_name(self, col: str, agg: str) -> str:
+        return get_column_nms([(col, agg)], prefix=self.prefix)[0]
+
+    def columns(self) -> List[str]:
+        cols = [self.key] + list(self.aggs)
+        cols += [c[1] for c in self.conditions()]
+        return list(OrderedDict.fromkeys(cols))
+
+
+def _condition_mask(df: pd.DataFrame, cond: tuple) -> np.ndarray:
+    if cond[0] == 'filter':
+        _, col, op, value = cond
+        return np.asarray(OPS[op](df[col], value), dtype=bool)
+
+    _, col, n_months, last_month = cond
+    months = month_codes(df[col])
+    last = month_code(last_month)
+    return (months > last - n_months) & (months <= last)
+
+
+class TablePlan:
+    """All specs of one table, computed from a single read of the table.
+
+    Every distinct row condition becomes a bit, rows with the same bits form an atom. The
+    decomposable aggregations of all specs come out of one groupby by (key, atom), each
+    spec then combines the atoms whose rows it covers. A filtered variant of a block is
+    an extra group key instead of an extra pass. Only holistic aggregations such as the
+    median get a pass per spec.
+    """
+
+    def __init__(self, table: str, specs: List[AggSpec]):
+        self.table = table
+        self.specs = specs
+        self.conditions = list(OrderedDict.fromkeys(c for s in specs for c in s.conditions()))
+        if len(self.conditions) > 62:
+            raise ValueError(f'Too many distinct row conditions for {table}')
+
+    def passes(self) -> int:
+        """Number of groupby passes over the rows."""
+        keys = {s.key for s in self.specs if any(a in DECOMPOSABLE for aggs in s.aggs.values() for a in aggs)}
+        holistic = sum(any(a not in DECOMPOSABLE for aggs in s.aggs.values() for a in aggs) for s in self.specs)
+        return len(keys) + holistic
+
+    def explain(self) -> str:
+        return (f'{self.table}: 1 read, {self.passes()} groupby passes for {len(self.specs)} specs, '
+                f'{len(self.conditions)} row conditions')
+
+    def run(self) -> List[pd.DataFrame]:
+        columns = list(OrderedDict.fromkeys(c for s in self.specs for c in s.columns()))
+        df = read_table(self.table, columns=columns)
+
+        atom = np.zeros(len(df), dtype='int64')
+        for bit, cond in enumerate(self.conditions):
+            atom |= _condition_mask(df, cond).astype('int64') << bit
+
+        partials = {}
+        for key in OrderedDict.fromkeys(s.key for s in self.specs):
+            partials[key] = self._partial(df, key, atom)
+
+        return [self._run_spec(df, atom, spec, partials[spec.key]) for spec in self.specs]
+
+    def _partial(self, df: pd.DataFrame, key: str, atom: np.ndarray) -> Optional[pd.DataFrame]:
+        """Decomposable statistics per (key, atom), from one groupby."""
+        cols = list(OrderedDict.fromkeys(col for s in self.specs if s.key == key
+                                         for col, aggs in s.aggs.items() if set(aggs) & set(DECOMPOSABLE)))
+        if not cols:
+            return None
+
+        frame = pd.DataFrame({key: df[key].to_numpy(), '_atom': atom})
+        for col in cols:
+            values = df[col].to_numpy()
+            # Sums of compact integer columns would overflow (pandas sums them as int64 too),
+            # float32 sums are not precise enough for the std from sums of squares
+            if values.dtype.kind in 'iub':
+                values = values.astype('int64')
+            elif values.dtype.kind == 'f':
+                values = values.astype('float64')
+            frame[col] = values
+            frame[f'{col}__sq'] = values.astype('float64') ** 2
+
+        stats = {col: ['sum', 'count', 'min', 'max'] for col in cols}
+        stats.update({f'{col}__sq': ['sum'] for col in cols})
+        grouped = frame.groupby([key, '_atom'], sort=True)
+        partial = grouped.agg(stats)
+        partial[('_rows', 'size')] = grouped.size()
+        return partial
+
+    def _run_spec(self, df: pd.DataFrame, atom: np.ndarray, spec: AggSpec, partial: Optional[pd.DataFrame]):
+        bits = sum(1 << self.conditions.index(c) for c in spec.conditions())
+
+        combined = None
+        if partial is not None:
+            atoms = partial.index.get_level_values('_atom').to_numpy()
+            part = partial[(atoms & bits) == bits]
+            combined = part.groupby(level=spec.key).agg(
+                {c: 'min' if c[1] == 'min' else 'max' if c[1] == 'max' else 'sum' for c in part.columns})
+            combined = combined[combined[('_rows', 'size')] > 0]
+
+        holistic_rows = None
+        out = {}
+        for col, aggs in spec.aggs.items():
+            for agg in aggs:
+                if agg in DECOMPOSABLE:
+                    out[(col, agg)] = self._combine(combined, col, agg)
+                else:
+                    if holistic_rows is None:
+                        holistic_rows = df[(atom & bits) == bits]
+                    out[(col, agg)] = holistic_rows.groupby(spec.key)[col].agg(agg)
+
+        ft = pd.DataFrame(out)
+        ft.columns = get_column_nms(pd.MultiIndex.from_tuples(out), prefix=spec.prefix)
+        ft.index.name = spec.key
+        return ft
+
+    @staticmethod
+    def _combine(combined: pd.DataFrame, col: str, agg: str) -> pd.Series:
+        total, count = combined[(col, 'sum')], combined[(col, 'count')]
+        if agg in ('sum', 'count', 'min', 'max'):
+            return combined[(col, agg)]
+        if agg == 'mean':
+            return total / count.where(count > 0)
+        # std with ddof=1, from the sums of values and of squares
+        sumsq = combined[(f'{col}__sq', 'sum')]
+        var = (sumsq - total.astype('float64') ** 2 / count.where(count > 0)) / (count - 1).where(count > 1)
+        return np.sqrt(var.clip(lower=0))
+
+
+def prune_specs(specs: List[AggSpec], columns) -> List[AggSpec]:
+    """Keep only the aggregations that produce one of the columns, specs left without any are dropped."""
+    columns = set(columns)
+    pruned = []
+    for spec in specs:
+        aggs = {}
+        for col, col_aggs in spec.aggs.items():
+            keep = [agg for agg in col_aggs if spec.column_name(col, agg) in columns]
+            if keep:
+                aggs[col] = keep
+        if aggs:
+            pruned.append(AggSpec(spec.table, aggs, spec.prefix, spec.filters, spec.window, spec.key,
+                                  spec.last_month))
+    return pruned
+
+
+def plan(specs: List[AggSpec]) -> List[TablePlan]:
+    """Group specs by table, every table is read once."""
+    tables = OrderedDict()
+    for spec in specs:
+        tables.setdefault(spec.table, []).append(spec)
+    return [TablePlan(table, table_specs) for table, table_specs in tables.items()]
+
+
+def run_specs(specs: List[AggSpec]) -> List[pd.DataFrame]:
+    """Compute the feature blocks of all specs, in the order of the specs."""
+    results = {}
+    for table_plan in plan(specs):
+        for spec, ft in zip(table_plan.specs, table_plan.run()):
+            results[id(spec)] = ft
+    return [results[id(spec)] for spec in specs]
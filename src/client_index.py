@@ -0,0 +1,106 @@
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+
+from .data import read_table
+from .spill import SpillStore
+
+
+class ClientIndex:
+    """Registry of all clients, mapping client_id to a contiguous int32 row position.
+
+    Built once from funnel.csv (one row per client), feature blocks are then placed into
+    rows by position instead of aligning their indexes.
+    """
+
+    def __init__(self, client_ids: np.ndarray):
+        #: Sorted unique client ids, the row order of assembled features
+        self.client_ids = np.unique(np.asarray(client_ids, dtype='int64'))
+
+    @classmethod
+    def from_file(cls, fn: str = 'data/funnel.csv'):
+        return cls(read_table(fn, columns=['client_id'])['client_id'].to_numpy())
+
+    def __len__(self) -> int:
+        return len(self.client_ids)
+
+    def positions(self, client_ids: np.ndarray) -> np.ndarray:
+        """Row positions of client ids, -1 for clients that are not registered."""
+        client_ids = np.asarray(client_ids, dtype='int64')
+        pos = np.searchsorted(self.client_ids, client_ids)
+        found = pos < len(self.client_ids)
+        found[found] = self.client_ids[pos[found]] == client_ids[found]
+        return np.where(found, pos, -1).astype('int32')
+
+    def assemble(self, blocks: List[pd.DataFrame], spill: Optional[SpillStore] = None) -> pd.DataFrame:
+        """Write client_id indexed feature blocks into one frame with a row per registered client.
+
+        Float columns go into a single preallocated column-major float32 matrix, which becomes
+        the frame's float block without a copy. Other columns get their own arrays. Clients
+        missing from a block get NaN, rows of unregistered clients are dropped. The blocks are
+        removed from the list as they are written, so they can be freed one by one.
+
+        Args:
+            blocks: Feature blocks, columns must be unique across blocks
+            spill: Spill store, the matrix is memory-mapped from disk if allocating it would
+                go over the store's high-water mark
+
+        Returns:
+            features: client_id indexed frame with the columns of all blocks, in block order
+        """
+        n_rows = len(self)
+        columns = [col for block in blocks for col in block.columns]
+        is_float = [block[col].dtype.kind == 'f' for block in blocks for col in block.columns]
+
+        # Column-major, each float column is a contiguous row of the matrix
+        shape = (sum(is_float), n_rows)
+        if spill is None:
+            matrix = np.full(shape, np.nan, dtype='float32')
+        else:
+            matrix = spill.array(shape, 'float32', np.nan)
+        others = {}
+
+        i_float = 0
+        while blocks:
+            block = blocks.pop(0)
+            pos = self.positions(block.index.to_numpy())
+            keep = pos >= 0
+            pos = pos[keep]
+            complete = len(np.unique(pos)) == n_rows
+
+            for col in block.columns:
+                values = block[col]
+                if values.dtype.kind == 'f':
+                    matrix[i_float, pos] = values.to_numpy()[keep]
+                    i_float += 1
+                else:
+                    others[col] = _place(values, keep, pos, n_rows, complete)
+            del block
+
+        index = pd.Index(self.client_ids, name='client_id')
+        float_cols = [col for col, f in zip(columns, is_float) if f]
+        features = pd.DataFrame(matrix.T, index=index, columns=float_cols, copy=False)
+        for loc, col in enumerate(columns):
+            if col in others:
+                features.insert(loc, col, others.pop(col))
+        return features
+
+
+def _place(values: pd.Series, keep: np.ndarray, pos: np.ndarray, n_rows: int, complete: bool):
+    """Scatter a non float column into row positions, like a reindex but without alignment."""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        codes = np.full(n_rows, -1, dtype=values.cat.codes.dtype)
+        codes[pos] = values.cat.codes.to_numpy()[keep]
+        return pd.Categorical.from_codes(codes, dtype=values.dtype)
+
+    values = values.to_numpy()[keep]
+    if complete:
+        out = np.empty(n_rows, dtype=values.dtype)
+    elif values.dtype.kind in 'iub':
+        # Like pandas, integers with missing rows become floats
+        out = np.full(n_rows, np.nan)
+    else:
+        out = np.full(n_rows, np.nan, dtype=object)
+    out[pos] = values
+    return out
@@ -0,0 +1,458 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from typing import Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from .profiling import count_rows
+from .schema import apply_schema, table_name
+from .utils import SPLIT_NAMES, hash_split
+
+
+# Converted tables are stored here, set TABLE_CACHE_DIR to an empty string to disable caching
+CACHE_DIR = os.environ.get('TABLE_CACHE_DIR', '.table_cache')
+
+# Rows parsed at a time when converting a CSV to the cache
+CONVERT_ROWS = 1_000_000
+
+# Set by src.prefetch.Prefetcher while it reads tables ahead of the extractors
+_prefetcher = None
+
+
+def fingerprint(fn: str) -> str:
+    """Cheap fingerprint of a source file, changes whenever the file is replaced or modified.
+
+    Args:
+        fn: Path to the file
+
+    Returns:
+        fp: Hex digest of the absolute path, size and modification time
+    """
+    st = os.stat(fn)
+    key = f'{os.path.abspath(fn)}|{st.st_size}|{st.st_mtime_ns}'
+    return hashlib.sha1(key.encode()).hexdigest()[:16]
+
+
+def _table_stem(fn: str) -> str:
+    return os.path.splitext(os.path.basename(fn))[0]
+
+
+def _table_dir(fn: str, cache_dir: str) -> str:
+    return os.path.join(cache_dir, f'{_table_stem(fn)}-{fingerprint(fn)}')
+
+
+def _read_csv(fn: str, **kwargs) -> pd.DataFrame:
+    return apply_schema(pd.read_csv(fn, **kwargs), table_name(fn))
+
+
+def _save_column(path: str, values: pd.Series) -> str:
+    """Store a whole column as path.npy, or as path.codes.npy plus path.categories.npy."""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        codes, categories = values.cat.codes.to_numpy(), values.cat.categories
+        kind = 'category'
+    elif values.dtype == object:
+        codes, categories = pd.factorize(values)
+        codes = codes.astype('int32')
+        kind = 'factor'
+    else:
+        np.save(f'{path}.npy', values.to_numpy())
+        return 'numeric'
+
+    if categories.dtype == object:
+        categories = np.asarray(categories, dtype='str')
+    np.save(f'{path}.codes.npy', codes)
+    np.save(f'{path}.categories.npy', np.asarray(categories))
+    return kind
+
+
+def _save_part(path: str, values: pd.Series) -> dict:
+    """Store the values of a column in one chunk, see _join_parts."""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        part = {'kind': 'category', 'values': list(values.cat.categories)}
+        codes = values.cat.codes.to_numpy()
+    elif values.dtype == object:
+        codes, uniques = pd.factorize(values)
+        part = {'kind': 'factor', 'values': list(uniques)}
+    else:
+        codes = values.to_numpy()
+        part = {'kind': 'numeric', 'dtype': codes.dtype}
+        if codes.dtype.kind in 'iu' and len(codes):
+            part['max_abs'] = int(np.abs(codes.astype('int64')).max())
+    np.save(f'{path}.npy', codes)
+    part['path'] = f'{path}.npy'
+    return part
+
+
+def _numeric_dtype(parts: List[dict]) -> np.dtype:
+    """dtype of a numeric column parsed and narrowed in chunks, as if it was done at once.
+
+    Integer chunks next to float32 chunks stay float32 while they are exact in float32,
+    see narrow_column.
+    """
+    dtypes = [p['dtype'] for p in parts]
+    if all(dt == dtypes[0] for dt in dtypes):
+        return dtypes[0]
+    floats = [dt for dt in dtypes if dt.kind == 'f']
+    if not floats:
+        return np.result_type(*dtypes)
+    max_abs = max((p.get('max_abs', 0) for p in parts), default=0)
+    if all(dt == np.float32 for dt in floats) and max_abs < 2 ** 24:
+        return np.dtype('float32')
+    return np.dtype('float64')
+
+
+def _join_parts(path: str, parts: List[dict], n_rows: int) -> Optional[str]:
+    """Join the chunk parts of a column into the files of _save_column.
+
+    Codes are translated to codes into the values of all chunks: in order of appearance
+    for factors, sorted like astype('category') sorts them for categories.
+
+    Returns:
+        kind: Kind of the column, None if the chunks were parsed to different kinds
+    """
+    kinds = {p['kind'] for p in parts}
+    if len(kinds) != 1:
+        return None
+    kind = kinds.pop()
+
+    if kind == 'numeric':
+        out = np.lib.format.open_memmap(f'{path}.npy', mode='w+', dtype=_numeric_dtype(parts), shape=(n_rows,))
+        start = 0
+        for p in parts:
+            values = np.load(p['path'])
+            out[start:start + len(values)] = values
+            start += len(values)
+        out.flush()
+        del out
+        return kind
+
+    # Code of every value in the whole column, and the codes of each chunk's values
+    codes_of = {}
+    for p in parts:
+        p['map'] = np.array([codes_of.setdefault(v, len(codes_of)) for v in p['values']], dtype='int64')
+    categories = pd.Index(list(codes_of))
+    if kind == 'category':
+        try:
+            order = np.argsort(categories.to_numpy(), kind='stable')
+        except TypeError:
+            return None
+        rank = np.empty(len(order), dtype='int64')
+        rank[order] = np.arange(len(order))
+        categories = categories[order]
+        for p in parts:
+            p['map'] = rank[p['map']]
+
+    if kind == 'factor' or len(categories) >= 2 ** 15:
+        code_dtype = 'int32'
+    else:
+        code_dtype = 'int16' if len(categories) >= 2 ** 7 else 'int8'
+    out = np.lib.format.open_memmap(f'{path}.codes.npy', mode='w+', dtype=code_dtype, shape=(n_rows,))
+    start = 0
+    for p in parts:
+        codes = np.load(p['path'])
+        # Code -1 (missing) picks the -1 appended to the map
+        out[start:start + len(codes)] = np.append(p['map'], -1).take(codes)
+        start += len(codes)
+    out.flush()
+    del out
+
+    if categories.dtype == object:
+        categories = np.asarray(categories, dtype='str')
+    np.save(f'{path}.categories.npy', np.asarray(categories))
+    return kind
+
+
+def _convert(fn: str, table_dir: str, cache_dir: str, chunksize: int = CONVERT_ROWS):
+    """Parse the CSV and store every column as its own .npy file.
+
+    Columns are cast to the compact dtypes of the table's schema, categorical columns are
+    stored as codes plus an array of categories. Other string columns are dictionary encoded
+    the same way, but served back as plain strings.
+
+    The CSV is parsed chunksize rows at a time, like iter_table streams it, and every chunk
+    is written out before the next one is parsed. A column whose chunks were parsed to
+    different kinds (e.g. numbers in one, text in another) is parsed once more on its own.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=cache_dir, prefix='.tmp-')
+    table = table_name(fn)
+
+    columns, parts = None, None
+    bytes_default, bytes_compact = None, None
+    n_rows = 0
+    for k, chunk in enumerate(pd.read_csv(fn, chunksize=chunksize)):
+        default = chunk.memory_usage(index=False, deep=True)
+        chunk = apply_schema(chunk, table)
+        compact = chunk.memory_usage(index=False, deep=True)
+        if columns is None:
+            columns, parts = list(chunk.columns), [[] for _ in chunk.columns]
+            bytes_default, bytes_compact = default, compact
+        else:
+            bytes_default, bytes_compact = bytes_default + default, bytes_compact + compact
+        for i, col in enumerate(columns):
+            parts[i].append(_save_part(os.path.join(tmp_dir, f'c{i}.part{k}'), chunk[col]))
+        n_rows += len(chunk)
+
+    if columns is None:
+        # No rows
+        df = apply_schema(pd.read_csv(fn), table)
+        columns, parts = list(df.columns), [[_save_part(os.path.join(tmp_dir, f'c{i}.part0'), df[col])]
+                                            for i, col in enumerate(df.columns)]
+        bytes_default = bytes_compact = df.memory_usage(index=False, deep=True)
+
+    meta = {'source': os.path.abspath(fn), 'n_rows': n_rows, 'columns': []}
+    for i, col in enumerate(columns):
+        path = os.path.join(tmp_dir, f'c{i}')
+        kind = _join_parts(path, parts[i], n_rows)
+        if kind is None:
+            kind = _save_column(path, apply_schema(pd.read_csv(fn, usecols=[col]), table)[col])
+        for p in parts[i]:
+            os.remove(p['path'])
+
+        meta['columns'].append({
+            'name': col,
+            'file': f'c{i}',
+            'kind': kind,
+            'bytes_default': int(bytes_default[col]),
+            'bytes_compact': int(bytes_compact[col]),
+        })
+
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+
+    _drop_older_versions(fn, table_dir, cache_dir)
+    try:
+        os.rename(tmp_dir, table_dir)
+    except OSError:
+        # Another process converted the same table in the meantime
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def _drop_older_versions(fn: str, table_dir: str, cache_dir: str):
+    """Remove conversions of older versions of the same file, not of files with the same name elsewhere."""
+    source = os.path.abspath(fn)
+    stem = _table_stem(fn)
+    for old in os.listdir(cache_dir):
+        old_dir = os.path.join(cache_dir, old)
+        if not old.startswith(f'{stem}-') or old_dir == table_dir:
+            continue
+        try:
+            with open(os.path.join(old_dir, 'meta.json')) as f:
+                old_source = json.load(f)['source']
+        except (OSError, ValueError, KeyError):
+            continue
+        if old_source == source:
+            shutil.rmtree(old_dir, ignore_errors=True)
+
+
+def _cached_table_dir(fn: str, cache_dir: Optional[str]) -> Optional[str]:
+    """Return the directory of the converted table, converting it first if needed.
+
+    Returns None if caching is disabled or the cache directory is not writable.
+    """
+    if not cache_dir:
+        return None
+
+    table_dir = _table_dir(fn, cache_dir)
+    if not os.path.exists(os.path.join(table_dir, 'meta.json')):
+        try:
+            _convert(fn, table_dir, cache_dir)
+        except OSError:
+            return None
+    return table_dir
+
+
+def _read_meta(table_dir: str, columns: Optional[List[str]]) -> dict:
+    with open(os.path.join(table_dir, 'meta.json')) as f:
+        meta = json.load(f)
+
+    if columns is not None:
+        missing = set(columns) - {c['name'] for c in meta['columns']}
+        if missing:
+            raise ValueError(f'Columns {sorted(missing)} not found in {meta["source"]}')
+        meta['columns'] = [c for c in meta['columns'] if c['name'] in columns]
+    return meta
+
+
+def _load_column(table_dir: str, col: dict, rows: slice = slice(None)) -> np.ndarray:
+    path = os.path.join(table_dir, col['file'])
+    if col['kind'] == 'numeric':
+        return np.array(np.load(f'{path}.npy', mmap_mode='r')[rows])
+
+    codes = np.load(f'{path}.codes.npy', mmap_mode='r')[rows]
+    if col['kind'] == 'category':
+        return pd.Categorical.from_codes(codes, np.load(f'{path}.categories.npy'))
+
+    categories = np.load(f'{path}.categories.npy').astype(object)
+    values = categories.take(codes)
+    values[codes == -1] = np.nan
+    return values
+
+
+def read_table(fn: str,
+               columns: Optional[List[str]] = None,
+               cache_dir: Optional[str] = CACHE_DIR) -> pd.DataFrame:
+    """Read an input table, serving it from the columnar cache when possible.
+
+    The first read of a file converts it to per-column .npy files keyed by the file's
+    fingerprint, later reads only load the requested columns. Columns have the compact
+    dtypes from the table's schema in src.schema.
+    While a Prefetcher (src.prefetch) runs, tables it has read ahead are taken from it.
+
+    Args:
+        fn: Path to the CSV file
+        columns: Columns to read, all columns if None. Returned in file order, like usecols
+        cache_dir: Cache directory, caching is disabled if empty or None
+
+    Returns:
+        df: The table
+    """
+    df = None
+    if _prefetcher is not None:
+        df = _prefetcher.take(fn, columns, cache_dir)
+    if df is None:
+        df = _load_table(fn, columns, cache_dir)
+
+    count_rows(len(df))
+    return df
+
+
+def _load_table(fn: str, columns: Optional[List[str]], cache_dir: Optional[str]) -> pd.DataFrame:
+    table_dir = _cached_table_dir(fn, cache_dir)
+    if table_dir is None:
+        return _read_csv(fn, usecols=columns)
+    meta = _read_meta(table_dir, columns)
+    return pd.DataFrame({c['name']: _load_column(table_dir, c) for c in meta['columns']})
+
+
+def table_mb(fn: str, columns: Optional[List[str]] = None, cache_dir: Optional[str] = CACHE_DIR) -> float:
+    """Estimated memory of read_table(fn, columns) in MB.
+
+    The compact size recorded at conversion if the table is in the cache, else the size
+    of the CSV file, which is usually larger.
+    """
+    table_dir = _table_dir(fn, cache_dir) if cache_dir else None
+    if table_dir is None or not os.path.exists(os.path.join(table_dir, 'meta.json')):
+        return os.path.getsize(fn) / 2**20
+    meta = _read_meta(table_dir, columns)
+    return sum(c['bytes_compact'] for c in meta['columns']) / 2**20
+
+
+def iter_table(fn: str,
+               columns: List[str],
+               chunksize: int,
+               dtype: Optional[dict] = None,
+               cache_dir: Optional[str] = CACHE_DIR) -> Iterator[pd.DataFrame]:
+    """Iterate over an input table in chunks of rows.
+
+    Reads row slices of an already converted table, otherwise streams the CSV directly -
+    converting would mean loading the whole file, which is what chunking is avoiding.
+
+    Args:
+        fn: Path to the CSV file
+        columns: Columns to read
+        chunksize: Number of rows per chunk
+        dtype: Optional dtypes to cast columns to
+        cache_dir: Cache directory, caching is disabled if empty or None
+
+    Yields:
+        chunk: The next chunk of rows
+    """
+    table_dir = _table_dir(fn, cache_dir) if cache_dir else None
+    if table_dir is None or not os.path.exists(os.path.join(table_dir, 'meta.json')):
+        for chunk in pd.read_csv(fn, usecols=columns, dtype=dtype, chunksize=chunksize):
+            count_rows(len(chunk))
+            yield apply_schema(chunk, table_name(fn))
+        return
+
+    meta = _read_meta(table_dir, columns)
+    for start in range(0, meta['n_rows'], chunksize):
+        rows = slice(start, start + chunksize)
+        chunk = pd.DataFrame({c['name']: _load_column(table_dir, c, rows) for c in meta['columns']})
+        if dtype:
+            chunk = chunk.astype(dtype)
+        count_rows(len(chunk))
+        yield chunk
+
+
+def split_table(fn: str,
+                out_dir: str,
+                split=(0.8, 0.1, 0.1),
+                key: str = 'client_id',
+                chunksize: int = 1_000_000,
+                seed: int = 0) -> dict:
+    """Split a raw table into train/val/test tables by a hash of the client id, chunk by chunk.
+
+    Rows go to out_dir/<part>/<file name>, so every part is a data directory like data/ and
+    features can be built for one part only. Every table is split the same way, see
+    src.utils.hash_split. Tables without the key column, e.g. dict_mcc.csv, are copied.
+
+    Args:
+        fn: Path to the CSV file
+        out_dir: Directory of the parts
+        split: Shares of (train, val, test)
+        key: Client id column
+        chunksize: Number of rows per chunk
+        seed: Seed of the hash
+
+    Returns:
+        n_rows: Number of rows written to every part
+    """
+    paths = {}
+    for part in SPLIT_NAMES:
+        os.makedirs(os.path.join(out_dir, part), exist_ok=True)
+        paths[part] = os.path.join(out_dir, part, os.path.basename(fn))
+
+    header = pd.read_csv(fn, nrows=0).columns
+    if key not in header:
+        for path in paths.values():
+            shutil.copyfile(fn, path)
+        return {part: None for part in SPLIT_NAMES}
+
+    n_rows = {part: 0 for part in SPLIT_NAMES}
+    # Raw values are passed through as text, the parts are read like the original table
+    for i, chunk in enumerate(pd.read_csv(fn, dtype=str, keep_default_na=False, chunksize=chunksize)):
+        count_rows(len(chunk))
+        part_of_row = hash_split(pd.to_numeric(chunk[key]).to_numpy(), split, seed)
+        for p, part in enumerate(SPLIT_NAMES):
+            rows = chunk[part_of_row == p]
+            rows.to_csv(paths[part], mode='w' if i == 0 else 'a', header=i == 0, index=False)
+            n_rows[part] += len(rows)
+    return n_rows
+
+
+def memory_report(fns: List[str], cache_dir: Optional[str] = CACHE_DIR) -> pd.DataFrame:
+    """Report how much memory the compact schema dtypes save for every table.
+
+    Args:
+        fns: Paths to the CSV files
+        cache_dir: Cache directory, the sizes are recorded when a table is converted
+
+    Returns:
+        report: Default and compact in-memory size of every table in MB
+    """
+    rows = []
+    for fn in fns:
+        table_dir = _cached_table_dir(fn, cache_dir)
+        if table_dir is None:
+            df = pd.read_csv(fn, low_memory=False)
+            default_bytes = df.memory_usage(index=False, deep=True).sum()
+            compact_bytes = apply_schema(df, table_name(fn)).memory_usage(index=False, deep=True).sum()
+        else:
+            meta = _read_meta(table_dir, None)
+            default_bytes = sum(c['bytes_default'] for c in meta['columns'])
+            compact_bytes = sum(c['bytes_compact'] for c in meta['columns'])
+        rows.append({
+            'table': table_name(fn),
+            'default_mb': default_bytes / 2**20,
+            'compact_mb': compact_bytes / 2**20,
+        })
+
+    report = pd.DataFrame(rows).set_index('table')
+    report['saved_mb'] = report['default_mb'] - report['compact_mb']
+    report['saved_share'] = report['saved_mb'] / report['default_mb']
+    return report
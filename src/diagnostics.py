@@ -0,0 +1,128 @@
+"""Binned statistics, correlation and slope of every feature against a target such as profit.
+
+Every feature takes one np.digitize and three np.bincount calls over its non missing rows,
+plus a few sums for the regression line, so a report over all columns of the feature
+matrix is a matter of seconds. Plotting is optional and only imports matplotlib when used.
+
+    report, stats = feature_report(train.drop(columns=LABEL_COLS), calculate_profit(train))
+    report.head(20)
+    plot_features(stats, report.index[:5])
+"""
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .utils import calculate_profit
+
+
+# The columns calculate_profit reads and the targets derived from them, they are not features
+LABEL_COLS = ['sale_flg', 'sale_amount', 'contacts', 'profit', 'profitable', 'log_profit']
+
+
+def binned_stats(x: np.ndarray, y: np.ndarray, n_bins: int = 101) -> Optional[dict]:
+    """Mean, std and count of y in equal width bins of x, and the least squares line of y on x.
+
+    The bins are those of scipy.stats.binned_statistic(x, y, bins=n_bins), the std is the
+    population std like there. Rows where x or y is NaN are ignored.
+
+    Returns:
+        stats: Bin edges and centers, per bin mean, std and count of y, and n, x mean and
+            std, slope, intercept, correlation rho and its t statistic (rho * sqrt(n)). None
+            if there are fewer than two rows or x is constant
+    """
+    x = np.asarray(x, dtype='float64')
+    y = np.asarray(y, dtype='float64')
+    valid = ~(np.isnan(x) | np.isnan(y))
+    if not valid.all():
+        x, y = x[valid], y[valid]
+    n = len(x)
+    if n < 2:
+        return None
+    lo, hi = x.min(), x.max()
+    if lo == hi:
+        return None
+
+    # Centered values keep the sums of squares precise
+    x_mean, y_mean = x.mean(), y.mean()
+    dx, dy = x - x_mean, y - y_mean
+
+    edges = np.linspace(lo, hi, n_bins + 1)
+    bins = np.digitize(x, edges[1:-1])
+    count = np.bincount(bins, minlength=n_bins)
+    sum_y = np.bincount(bins, weights=dy, minlength=n_bins)
+    sum_yy = np.bincount(bins, weights=dy * dy, minlength=n_bins)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = sum_y / count
+        std = np.sqrt(np.maximum(sum_yy / count - mean ** 2, 0))
+
+    sxx, syy, sxy = dx @ dx, dy @ dy, dx @ dy
+    slope = sxy / sxx
+    rho = sxy / np.sqrt(sxx * syy) if syy > 0 else np.nan
+    return {
+        'edges': edges,
+        'centers': 0.5 * (edges[1:] + edges[:-1]),
+        'mean': mean + y_mean,
+        'std': std,
+        'count': count,
+        'n': n,
+        'x_mean': x_mean,
+        'x_std': np.sqrt(sxx / n),
+        'slope': slope,
+        'intercept': y_mean - slope * x_mean,
+        'rho': rho,
+        't_stat': rho * np.sqrt(n),
+    }
+
+
+def feature_report(features: pd.DataFrame, target, n_bins: int = 101) -> Tuple[pd.DataFrame, Dict[str, dict]]:
+    """binned_stats of every numeric feature against the target, ranked by |rho|.
+
+    Args:
+        features: Feature matrix, non numeric columns are skipped
+        target: Target aligned with the rows of features, e.g. calculate_profit(df)
+        n_bins: Number of bins
+
+    Returns:
+        (report, stats): One row per feature with n, rho, t_stat, slope, intercept, x_mean,
+            x_std and the spread of the binned means (max - min over bins with at least 1%
+            of the rows), and the full binned_stats of every feature for plotting
+    """
+    y = np.asarray(target, dtype='float64')
+    rows, stats = [], {}
+    for col in features.columns:
+        if features[col].dtype.kind not in 'biuf':
+            continue
+        s = binned_stats(features[col].to_numpy(dtype='float64', na_value=np.nan), y, n_bins)
+        if s is None:
+            continue
+        stats[col] = s
+        populated = s['count'] >= max(0.01 * s['n'], 1)
+        rows.append({
+            'feature': col,
+            **{k: s[k] for k in ['n', 'rho', 't_stat', 'slope', 'intercept', 'x_mean', 'x_std']},
+            'binned_spread': np.ptp(s['mean'][populated]) if populated.any() else np.nan,
+        })
+
+    report = pd.DataFrame(rows, columns=['feature', 'n', 'rho', 't_stat', 'slope', 'intercept', 'x_mean',
+                                         'x_std', 'binned_spread']).set_index('feature')
+    order = report['rho'].abs().sort_values(ascending=False, na_position='last').index
+    return report.loc[order], stats
+
+
+def profit_report(df: pd.DataFrame, feature_cols: Optional[Iterable[str]] = None,
+                  n_bins: int = 101) -> Tuple[pd.DataFrame, Dict[str, dict]]:
+    """feature_report against the profit of every row (see calculate_profit).
+
+    Without feature_cols, every column but LABEL_COLS is reported.
+    """
+    features = df[list(feature_cols)] if feature_cols is not None else df.drop(columns=LABEL_COLS, errors='ignore')
+    return feature_report(features, calculate_profit(df), n_bins)
+
+
+def plot_features(stats: Dict[str, dict], features: Iterable[str], **kwargs):
+    """Plot the binned means of some features, one figure each (see plot_utils.plot_binned_stats)."""
+    from .plot_utils import plot_binned_stats
+
+    for col in features:
+        plot_binned_stats(stats[col], title=col, **kwargs)
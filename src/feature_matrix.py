@@ -0,0 +1,166 @@
+"""File format of the feature matrix passed from the build to the run step.
+
+A directory with
+
+    header.json      column order, kinds and vocabularies, index name, number of rows
+    client_ids.npy   client id of every row
+    floats.npy       numeric columns, one row-major float32 [n_rows, n_numeric] array
+    codes.npy        other columns as int32 [n_rows, n_other] codes into their vocabulary
+
+The run step opens it with FeatureMatrix, which memory-maps the arrays. Row blocks are
+frames whose numeric columns are views of the mapped file, only the blocks being scored
+are read, and nothing is deserialised.
+"""
+import json
+import os
+import shutil
+from typing import Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+
+
+FEATURES_FN = 'final_version.features'
+
+# Rows converted at a time when writing
+WRITE_ROWS = 65_536
+
+VERSION = 1
+
+# Integers up to this are exact in float32
+FLOAT32_EXACT_INT = 2**24
+
+
+def save_features(features: pd.DataFrame, path: str = FEATURES_FN, write_rows: int = WRITE_ROWS):
+    """Write a feature matrix in the memory-mapped format.
+
+    Numeric columns (floats, ints and bools) are stored as float32, categorical and object
+    columns as codes into the list of their distinct values, missing values as -1.
+    Int and bool columns are read back with their dtype, float columns as float32.
+    The directory is replaced atomically.
+
+    Args:
+        features: Feature matrix, indexed by client_id
+        path: Output directory
+        write_rows: Rows converted at a time, bounds the memory of the conversion
+    """
+    n_rows = len(features)
+    numeric = [col for col in features.columns if features[col].dtype.kind in 'biuf']
+    others = [col for col in features.columns if col not in set(numeric)]
+    for col in numeric:
+        if features[col].dtype.kind in 'iu' and len(features) and features[col].abs().max() > FLOAT32_EXACT_INT:
+            raise ValueError(f'Column {col} has integers float32 does not hold exactly, '
+                             f'store it as a categorical or object column')
+
+    tmp = f'{path}.tmp{os.getpid()}'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    np.save(os.path.join(tmp, 'client_ids.npy'), features.index.to_numpy())
+
+    floats = np.lib.format.open_memmap(os.path.join(tmp, 'floats.npy'), mode='w+', dtype='float32',
+                                       shape=(n_rows, len(numeric)))
+    for start in range(0, n_rows, write_rows):
+        block = features.iloc[start:start + write_rows]
+        floats[start:start + write_rows] = block[numeric].to_numpy(dtype='float32', na_value=np.nan)
+    floats.flush()
+    del floats
+
+    codes = np.lib.format.open_memmap(os.path.join(tmp, 'codes.npy'), mode='w+', dtype='int32',
+                                      shape=(n_rows, len(others)))
+    vocab = {}
+    for j, col in enumerate(others):
+        values = features[col]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            col_codes, uniques = values.cat.codes.to_numpy(), values.cat.categories
+        else:
+            col_codes, uniques = pd.factorize(values)
+        codes[:, j] = col_codes
+        vocab[col] = np.asarray(uniques, dtype=object).tolist()
+    codes.flush()
+    del codes
+
+    header = {
+        'version': VERSION,
+        'n_rows': n_rows,
+        'index_name': features.index.name,
+        'columns': [{'name': col, 'kind': 'float' if col in numeric else 'code', 'dtype': str(features[col].dtype),
+                     'pos': numeric.index(col) if col in numeric else others.index(col),
+                     'categorical': isinstance(features[col].dtype, pd.CategoricalDtype)}
+                    for col in features.columns],
+        'vocab': vocab,
+    }
+    with open(os.path.join(tmp, 'header.json'), 'w') as f:
+        json.dump(header, f, default=str)
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp, path)
+
+
+class FeatureMatrix:
+    """A feature matrix file opened for reading, see save_features.
+
+        data = FeatureMatrix('final_version.features')
+        for block in data.iter_blocks(50_000):
+            ...
+
+    Row blocks have the columns of the saved frame in their order. Float columns are
+    float32 views of the mapped file, the other columns are converted for the block only.
+    """
+
+    def __init__(self, path: str = FEATURES_FN):
+        with open(os.path.join(path, 'header.json')) as f:
+            self._header = json.load(f)
+        if self._header['version'] != VERSION:
+            raise ValueError(f'{path} has format version {self._header["version"]}, expected {VERSION}')
+
+        self.client_ids = np.load(os.path.join(path, 'client_ids.npy'), mmap_mode='r')
+        self._floats = np.load(os.path.join(path, 'floats.npy'), mmap_mode='r')
+        self._codes = np.load(os.path.join(path, 'codes.npy'), mmap_mode='r')
+        self._vocab = {col: np.array(values + [np.nan], dtype=object)
+                       for col, values in self._header['vocab'].items()}
+
+    @property
+    def columns(self) -> List[str]:
+        return [col['name'] for col in self._header['columns']]
+
+    def __len__(self) -> int:
+        return self._header['n_rows']
+
+    def rows(self, start: int = 0, stop: Optional[int] = None) -> pd.DataFrame:
+        """Rows [start, stop) as a client_id indexed frame."""
+        stop = len(self) if stop is None else min(stop, len(self))
+        return self._frame(slice(start, stop))
+
+    def take(self, positions) -> pd.DataFrame:
+        """Rows at the given positions, e.g. a validation fold. Only those rows are read."""
+        return self._frame(np.asarray(positions, dtype='int64'))
+
+    def _frame(self, rows) -> pd.DataFrame:
+        index = pd.Index(self.client_ids[rows], name=self._header['index_name'])
+        float_cols = [col['name'] for col in self._header['columns'] if col['kind'] == 'float']
+        # A slice of the memmap is a view, positions copy only the rows taken
+        frame = pd.DataFrame(self._floats[rows], index=index, columns=float_cols, copy=False)
+
+        for loc, col in enumerate(self._header['columns']):
+            if col['kind'] == 'float':
+                if np.dtype(col.get('dtype', 'float32')).kind in 'biu':
+                    frame[col['name']] = frame[col['name']].astype(col['dtype'])
+                continue
+            codes = self._codes[rows, col['pos']]
+            vocab = self._vocab[col['name']]
+            if col['categorical']:
+                values = pd.Categorical.from_codes(codes, categories=vocab[:-1])
+            else:
+                # Code -1 (missing) picks the NaN at the end of the vocabulary
+                values = vocab.take(codes)
+            frame.insert(loc, col['name'], values)
+        return frame
+
+    def iter_blocks(self, batch_rows: int) -> Iterator[pd.DataFrame]:
+        for start in range(0, len(self), batch_rows):
+            yield self.rows(start, start + batch_rows)
+
+    def to_frame(self) -> pd.DataFrame:
+        """The whole matrix in memory, e.g. for a notebook."""
+        return self.rows()
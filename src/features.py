@@ -1,56 +1,59 @@
 import gc
+import os
 import numpy as np
 import pandas as pd
 
-from pandas.tseries.offsets import MonthEnd
+from .aggspec import AggSpec, get_column_nms, prune_specs, run_specs
+from .data import iter_table, read_table
+from .intervals import ClientIntervals
+from .periods import LAST_MONTH, MISSING_DAY, day_numbers, month_code, month_codes, month_end_day
+from .spend import MISSING_MCC, ClientMccMatrix
+from .tensor import ClientMonthTensor, nan_mean, nan_std
 
 
-def get_column_nms(cols: pd.core.indexes.multi.MultiIndex,
-                   prefix='',
-                   suffix=''):
-    nms = ['_'.join(col) for col in cols]
-    if prefix and prefix != '':
-        nms = ['_'.join([prefix, nm]) for nm in nms]
-    if suffix and suffix != '':
-        nms = ['_'.join([nm, suffix]) for nm in nms]
-    return nms
+def _uses_any(extractor, columns) -> bool:
+    """Whether any of the columns is needed, all are unless src.pruning.BuildPlan pruned the extractor."""
+    needed = getattr(extractor, '_needed', None)
+    return needed is None or any(col in needed for col in columns)
 
 
 class CampaignFtExtractor:
     def __init__(self, fn='train_data/com.csv'):
         self._fn = fn
+        # Set by src.pruning.BuildPlan, only these columns are aggregated
+        self._needed = None
+
+    def specs(self):
+        aggs = {
+            'agr_flg': ['sum', 'mean'],
+            'dumaet':  ['sum', 'mean'],
+            'otkaz':   ['sum', 'mean'],
+            'count_comm': ['sum', 'mean', 'median'],
+        }
+        return [
+            AggSpec(self._fn, aggs),
+            AggSpec(self._fn, aggs, prefix='cash_loan', filters=[('prod', '==', 'Cash Loan')]),
+        ]
 
     def load_transform(self):
-        campaign = pd.read_csv(self._fn)
-
-        out = []
-
-        for mask, subset_nm in [
-            (np.full(campaign.shape[0], True), ''),
-            (campaign['prod'] == 'Cash Loan', 'cash_loan')
-        ]:
-
-            ft = campaign[mask].groupby('client_id').agg({
-                'agr_flg': ['sum', 'mean'],
-                'dumaet':  ['sum', 'mean'],
-                'otkaz':   ['sum', 'mean'],
-                'count_comm': ['sum', 'mean', 'median'],
-            })
-            # rename columns
-            ft.columns = get_column_nms(ft.columns, prefix=subset_nm)
-            out.append(ft)
-
-        del campaign
+        specs = self.specs()
+        if self._needed is not None:
+            specs = prune_specs(specs, self._needed)
+
+        # Both blocks come out of one groupby, only the medians need a pass each
+        out = run_specs(specs)
         gc.collect()
         return pd.concat(out, axis=1)
 
 
 class ClientFtExtractor():
+    INPUT_COLUMNS = ['client_id', 'gender', 'age', 'region', 'city', 'education']
+
     def __init__(self, fn='train_data/client.csv'):
         self._fn = fn
 
     def load_transform(self):
-        client = pd.read_csv(self._fn)
+        client = read_table(self._fn, columns=self.INPUT_COLUMNS)
 
         # Take out citizenship and job_type, they are useless
         client_ft = client.set_index('client_id')[['gender', 'age', 'region', 'city', 'education']]
@@ -68,7 +71,7 @@ class ClientFtExtractor():
         client_ft['city'] = client_ft['city'].astype('str')
         client_ft['region'] = client_ft['region'].astype('str')
 
-        client_ft[['gender', 'education']] = client_ft[['gender', 'education']].fillna('nan')
+        client_ft[['gender', 'education']] = client_ft[['gender', 'education']].astype('object').fillna('nan')
 
         del client
         gc.collect()
@@ -76,90 +79,214 @@ class ClientFtExtractor():
 
 
 class BalanceFtExtractor:
-    def __init__(self, fn='train_data/balance.csv'):
+    INPUT_COLUMNS = ['client_id', 'month_end_dt', 'avg_bal_sum_rur', 'max_bal_sum_rur', 'min_bal_sum_rur']
+
+    def __init__(self, fn='train_data/balance.csv', last_month=LAST_MONTH):
         self._fn = fn
+        self._last_month = last_month
 
     def load_transform(self):
-        balances = pd.read_csv(self._fn)
+        balances = read_table(self._fn, columns=self.INPUT_COLUMNS)
+        balances['month'] = month_codes(balances.pop('month_end_dt'))
+        last_month = month_code(self._last_month)
 
         # Sum up across all accounts
-        account_sums = balances.groupby(['client_id', 'month_end_dt'])[['avg_bal_sum_rur', 'max_bal_sum_rur', 'min_bal_sum_rur']].sum()
+        account_sums = ClientMonthTensor.from_frame(balances, ['avg_bal_sum_rur', 'max_bal_sum_rur', 'min_bal_sum_rur'])
+        del balances
+        gc.collect()
 
         # Get average range (max - min) for all clients
-        account_sums['range'] = account_sums['max_bal_sum_rur'] - account_sums['min_bal_sum_rur']
-        avg_range = account_sums['range'].mean(level='client_id', skipna=True)
+        avg_range = nan_mean(account_sums['max_bal_sum_rur'] - account_sums['min_bal_sum_rur'])
 
         # Get the average amount in the last month
-        last_month_avg = account_sums.iloc[account_sums.index.get_level_values('month_end_dt') == '2019-08-31']
-        last_month_avg = last_month_avg['avg_bal_sum_rur']
-        last_month_avg.index = last_month_avg.index.droplevel('month_end_dt')
+        last_month_avg = account_sums.month(account_sums['avg_bal_sum_rur'], last_month)
 
         # Get differences from the average in the last month
-        account_sums['diff_last_month'] = account_sums['avg_bal_sum_rur'] - last_month_avg
-        diffs = account_sums['diff_last_month'].reset_index().query('month_end_dt != "2019-08-31"')
-        diffs = diffs.pivot(index='client_id', columns='month_end_dt')
+        diffs = account_sums['avg_bal_sum_rur'] - last_month_avg[:, None]
 
         # Put together all balance features
-        diffs.columns = [f'balance_diff_{c[1]}' for c in diffs.columns]
-        balance_ft = diffs
-        balance_ft['avg_range'] = avg_range
-        balance_ft['avg_last_balance'] = last_month_avg
-        del balances
-        gc.collect()
+        balance_ft = account_sums.frame({
+            **account_sums.monthly_columns(diffs, 'balance_diff_', exclude=(last_month,)),
+            'avg_range': avg_range,
+            'avg_last_balance': last_month_avg,
+        })
         return balance_ft
 
 
-
-
 class AUMFtExtractor:
-    def __init__(self, fn='train_data/aum.csv'):
+    INPUT_COLUMNS = ['client_id', 'month_end_dt', 'balance_rur_amt']
+
+    def __init__(self, fn='train_data/aum.csv', last_month=LAST_MONTH):
         self._fn = fn
+        self._last_month = last_month
 
     def load_transform(self):
-        aum = pd.read_csv(self._fn)
+        aum = read_table(self._fn, columns=self.INPUT_COLUMNS)
+        aum['month'] = month_codes(aum.pop('month_end_dt'))
+        last_month = month_code(self._last_month)
 
         # Sum up across all accounts
-        aum_sums = aum.groupby(['client_id', 'month_end_dt'])[['balance_rur_amt']].sum()
+        aum_sums = ClientMonthTensor.from_frame(aum, ['balance_rur_amt'])
+        del aum
+        gc.collect()
 
         # Get STD for last few months for client
-        aum_std = aum_sums.std(level='client_id', skipna=True)
+        aum_std = nan_std(aum_sums['balance_rur_amt'])
 
         # Get the average amount in the last month
-        last_month_aum = aum_sums.iloc[aum_sums.index.get_level_values('month_end_dt') == '2019-08-31']
-        last_month_aum = last_month_aum['balance_rur_amt']
-        last_month_aum.index = last_month_aum.index.droplevel('month_end_dt')
+        last_month_aum = aum_sums.month(aum_sums['balance_rur_amt'], last_month)
 
         # Get differences from the average in the last month
-        aum_sums['diff_last_month'] = aum_sums['balance_rur_amt'] - last_month_aum
-        diffs = aum_sums['diff_last_month'].reset_index().query('month_end_dt != "2019-08-31"')
-        diffs = diffs.pivot(index='client_id', columns='month_end_dt')
+        diffs = aum_sums['balance_rur_amt'] - last_month_aum[:, None]
 
         # Put together all balance features
-        diffs.columns = [f'aum_diff_{c[1]}' for c in diffs.columns]
-        aum_ft = diffs
-        aum_ft['aum_std'] = aum_std
-        aum_ft['aum_last_month'] = last_month_aum
+        aum_ft = aum_sums.frame({
+            **aum_sums.monthly_columns(diffs, 'aum_diff_', exclude=(last_month,)),
+            'aum_std': aum_std,
+            'aum_last_month': last_month_aum,
+        })
+        return aum_ft
+
+
+class BalanceWindowFtExtractor:
+    """Balance features comparing the last month to m3/m6/m12 quarter averages."""
+
+    VALUE_COLS = ['avg_bal_sum_rur', 'max_bal_sum_rur', 'min_bal_sum_rur']
+    INPUT_COLUMNS = ['client_id', 'month_end_dt'] + VALUE_COLS
+    # Columns computed from the quarter averages
+    WINDOW_COLUMNS = ['balance_m3', 'balance_diff_m3', 'balance_diff_m6', 'balance_diff_m3_m6', 'balance_diff_m3_m12',
+                      'balance_diff_m3_rel', 'balance_diff_m6_rel', 'balance_diff_m3_m6_rel', 'balance_diff_m3_m12_rel']
+
+    def __init__(self, fn='train_data/balance.csv', last_month=LAST_MONTH):
+        self._fn = fn
+        self._last_month = last_month
+        # Set by src.pruning.BuildPlan, the quarter averages are skipped if none of their columns is needed
+        self._needed = None
+
+    def load_transform(self):
+        balances = read_table(self._fn, columns=self.INPUT_COLUMNS)
+        balances['month'] = month_codes(balances.pop('month_end_dt'))
+
+        # Sum up across all accounts by month
+        account_sums = ClientMonthTensor.from_frame(balances, self.VALUE_COLS, last_month=month_code(self._last_month))
+        del balances
+        gc.collect()
+        return self.transform(account_sums)
+
+    def transform(self, account_sums):
+        """Features from monthly account sums, a ClientMonthTensor or an incremental MonthlyState."""
+        last_month = month_code(self._last_month)
 
+        # Get average range (max - min) for all clients
+        avg_range = account_sums.mean_difference('max_bal_sum_rur', 'min_bal_sum_rur')
+
+        # Get the average amount in the last month
+        balance_last = account_sums.last('avg_bal_sum_rur', last_month)
+        all_avg = account_sums.mean('avg_bal_sum_rur')
+
+        # Get mean avg by quarters (of the account rows, not of the monthly sums)
+        if _uses_any(self, self.WINDOW_COLUMNS):
+            m3, m6, m12 = account_sums.windows('avg_bal_sum_rur', last_month, row_means=True)
+        else:
+            m3 = m6 = m12 = np.full(len(account_sums.clients), np.nan)
+
+        balance_ft = account_sums.frame({
+            'balance_range': avg_range,
+            'balance_last_avg': balance_last,
+            'balance_m3': m3,
+            'balance_all_avg': all_avg,
+            'balance_rel_range': avg_range / all_avg,
+            'balance_diff_m3': balance_last - m3,
+            'balance_diff_m6': balance_last - m6,
+            'balance_diff_m3_m6': m3 - m6,
+            'balance_diff_m3_m12': m3 - m12,
+            'balance_diff_m3_rel': (balance_last - m3) / m3,
+            'balance_diff_m6_rel': (balance_last - m6) / m3,
+            'balance_diff_m3_m6_rel': (m3 - m6) / m3,
+            'balance_diff_m3_m12_rel': (m3 - m12) / m3,
+        })
+        return balance_ft
+
+
+class AUMWindowFtExtractor:
+    """AUM features comparing the last month to m3/m6/m12 quarter averages."""
+
+    VALUE_COLS = ['balance_rur_amt']
+    INPUT_COLUMNS = ['client_id', 'month_end_dt'] + VALUE_COLS
+    # Columns computed from the quarter averages
+    WINDOW_COLUMNS = ['aum_m3', 'aum_diff_m3', 'aum_diff_m6', 'aum_diff_m3_m6', 'aum_diff_m3_m12',
+                      'aum_diff_m3_rel', 'aum_diff_m6_rel', 'aum_diff_m3_m6_rel', 'aum_diff_m3_m12_rel']
+
+    def __init__(self, fn='train_data/aum.csv', last_month=LAST_MONTH):
+        self._fn = fn
+        self._last_month = last_month
+        # Set by src.pruning.BuildPlan, the quarter averages are skipped if none of their columns is needed
+        self._needed = None
+
+    def load_transform(self):
+        aum = read_table(self._fn, columns=self.INPUT_COLUMNS)
+        aum['month'] = month_codes(aum.pop('month_end_dt'))
+
+        # Sum up across all accounts for each month
+        aum_sums = ClientMonthTensor.from_frame(aum, self.VALUE_COLS, last_month=month_code(self._last_month))
         del aum
         gc.collect()
+        return self.transform(aum_sums)
+
+    def transform(self, aum_sums):
+        """Features from monthly AUM sums, a ClientMonthTensor or an incremental MonthlyState."""
+        last_month = month_code(self._last_month)
+
+        # Get mean and STD for last few months for client
+        aum_std = aum_sums.std('balance_rur_amt')
+        aum_mean = aum_sums.mean('balance_rur_amt')
+
+        # Get the average amount in the last month
+        aum_last = aum_sums.last('balance_rur_amt', last_month)
+
+        # Get quarter averages
+        if _uses_any(self, self.WINDOW_COLUMNS):
+            m3, m6, m12 = aum_sums.windows('balance_rur_amt', last_month)
+        else:
+            m3 = m6 = m12 = np.full(len(aum_sums.clients), np.nan)
+
+        aum_ft = aum_sums.frame({
+            'aum_std': aum_std,
+            'aum_last': aum_last,
+            'aum_m3': m3,
+            'aum_all_avg': aum_mean,
+            'aum_volatility': aum_std / aum_mean,
+            'aum_diff_m3': aum_last - m3,
+            'aum_diff_m6': aum_last - m6,
+            'aum_diff_m3_m6': m3 - m6,
+            'aum_diff_m3_m12': m3 - m12,
+            'aum_diff_m3_rel': (aum_last - m3) / m3,
+            'aum_diff_m6_rel': (aum_last - m6) / m3,
+            'aum_diff_m3_m6_rel': (m3 - m6) / m3,
+            'aum_diff_m3_m12_rel': (m3 - m12) / m3,
+        })
         return aum_ft
 
 
 class TrxnFtExtractor:
-    def __init__(self, fn='train_data/trxn.csv'):
+    # Approximate memory needed per parsed trxn.csv row, including the groupby temporaries
+    ROW_BYTES = 256
+
+    # Read whole only without a memory budget, else streamed
+    INPUT_COLUMNS = ['client_id', 'tran_amt_rur', 'mcc_cd']
+
+    def __init__(self, fn='train_data/trxn.csv', mem_budget_mb=None):
+        """If mem_budget_mb is set, trxn.csv is streamed in chunks sized to the budget
+        instead of being loaded whole."""
         self._fn = fn
+        self._mem_budget_mb = mem_budget_mb
 
     def load_transform(self):
-        column_names = ['client_id', 'tran_amt_rur', 'mcc_cd', 'tran_time']
-        transaction = pd.read_csv(self._fn,
-                                  usecols=column_names)
-
-        transaction_ft = transaction[column_names]
-        del transaction
-        gc.collect()
-        transaction_ft['mcc_cd'] = transaction_ft['mcc_cd'].astype('str')
+        if self._mem_budget_mb is None:
+            temp_trs = self._load_sums()
+        else:
+            temp_trs = self._load_sums_chunked()
 
-        temp_trs = transaction_ft.groupby(['client_id', 'mcc_cd']).sum().reset_index()
         transaction_ft = temp_trs.loc[temp_trs.groupby('client_id').tran_amt_rur.idxmax()]
         transaction_ft = transaction_ft.set_index('client_id')
         transaction_ft['tran_amt_rur'] = transaction_ft['tran_amt_rur'].fillna('nan')
@@ -167,44 +294,292 @@ class TrxnFtExtractor:
         gc.collect()
         return transaction_ft
 
+    def _load_sums(self):
+        column_names = self.INPUT_COLUMNS
+        transaction = read_table(self._fn, columns=column_names)
+
+        transaction_ft = transaction[column_names]
+        del transaction
+        gc.collect()
+        transaction_ft['mcc_cd'] = transaction_ft['mcc_cd'].astype('str')
+
+        return transaction_ft.groupby(['client_id', 'mcc_cd']).sum().reset_index()
+
+    def _load_sums_chunked(self):
+        # Half of the budget goes to the chunk being parsed, half to the partial sums
+        # waiting to be folded into the running per (client, mcc) totals
+        budget_rows = max(int(self._mem_budget_mb * 2**20 / self.ROW_BYTES / 2), 1)
+
+        # mcc_cd is kept as raw text while streaming, the type pandas would infer for the
+        # whole column is only known once every chunk has been seen
+        reader = iter_table(self._fn,
+                            columns=['client_id', 'tran_amt_rur', 'mcc_cd'],
+                            chunksize=budget_rows,
+                            dtype={'mcc_cd': 'str'})
+
+        running = None
+        parts, parts_rows = [], 0
+        for chunk in reader:
+            part = chunk.groupby(['client_id', 'mcc_cd'], dropna=False)['tran_amt_rur'].sum()
+            parts.append(part)
+            parts_rows += len(part)
+            del chunk
+            if parts_rows >= budget_rows:
+                running = self._fold(running, parts)
+                parts, parts_rows = [], 0
+        running = self._fold(running, parts)
+        gc.collect()
+
+        # Match the mcc_cd strings (and so the idxmax tie-breaking order) of the full load:
+        # pandas parses the column as int only if every code is an integer literal
+        temp_trs = running.reset_index()
+        del running
+        mcc_raw = temp_trs['mcc_cd']
+        if mcc_raw.notna().all() and mcc_raw.str.fullmatch(r'\s*-?\d+\s*').all():
+            temp_trs['mcc_cd'] = mcc_raw.astype('int64').astype('str')
+        else:
+            temp_trs['mcc_cd'] = mcc_raw.astype('float64').astype('str')
+        return temp_trs.groupby(['client_id', 'mcc_cd']).sum().reset_index()
+
+    @staticmethod
+    def from_matrix(matrix: ClientMccMatrix) -> pd.DataFrame:
+        """The same features from a client x MCC spend matrix, e.g. a running one (see src.incremental)."""
+        # MCC codes are formatted like the parsed column: as floats if any code is missing
+        mccs = matrix.mccs
+        if (mccs == MISSING_MCC).any():
+            names = np.where(mccs == MISSING_MCC, 'nan', mccs.astype('float64').astype('str'))
+        else:
+            names = mccs.astype('str')
+
+        # Highest spend of every client, ties go to the first code in string order like idxmax
+        spend = matrix.spend
+        rows = np.repeat(np.arange(spend.shape[0]), np.diff(spend.indptr))
+        name_rank = np.argsort(np.argsort(names, kind='stable'))
+        order = np.lexsort((name_rank[spend.indices], -spend.data, rows))
+        first = order[spend.indptr[:-1][np.diff(spend.indptr) > 0]]
+
+        return pd.DataFrame({
+            'mcc_cd': names[spend.indices[first]],
+            'tran_amt_rur': spend.data[first].astype('float32'),
+        }, index=pd.Index(matrix.clients[rows[first]], name='client_id'))
+
+    @staticmethod
+    def _fold(running, parts):
+        if running is not None:
+            parts = [running] + parts
+        if not parts:
+            return pd.Series([], name='tran_amt_rur', dtype='float64',
+                             index=pd.MultiIndex.from_arrays([[], []], names=['client_id', 'mcc_cd']))
+        return pd.concat(parts).groupby(level=['client_id', 'mcc_cd'], dropna=False).sum()
+
+
+class TrxnSpendFtExtractor:
+    """Spend distribution over MCC codes, from a sparse client x MCC matrix.
+
+    Features are totals, the top k codes and their shares, the shares of every MCC group
+    and subgroup of dict_mcc.csv, the entropy of the spend over codes and the share spent
+    abroad.
+    """
+    # Approximate memory needed per parsed trxn.csv row while building the matrix
+    ROW_BYTES = 128
+
+    def __init__(self, fn='train_data/trxn.csv', dict_fn=None, top_k=3, mem_budget_mb=None):
+        """dict_fn defaults to the dict_mcc.csv next to fn."""
+        self._fn = fn
+        self._dict_fn = dict_fn if dict_fn is not None else os.path.join(os.path.dirname(fn), 'dict_mcc.csv')
+        self._top_k = top_k
+        self._mem_budget_mb = mem_budget_mb
+
+    def load_matrix(self) -> ClientMccMatrix:
+        chunksize = None
+        if self._mem_budget_mb is not None:
+            chunksize = max(int(self._mem_budget_mb * 2**20 / self.ROW_BYTES), 1)
+        return ClientMccMatrix.from_table(self._fn, chunksize=chunksize)
+
+    def load_transform(self):
+        matrix = self.load_matrix()
+        mcc_dict = read_table(self._dict_fn, columns=['mcc_cd', 'brs_mcc_group', 'brs_mcc_subgroup'])
+        mcc_dict = mcc_dict.dropna(subset=['mcc_cd']).drop_duplicates('mcc_cd')
+
+        ft = {
+            'trxn_spend': matrix.total_spend,
+            'trxn_count': matrix.total_count,
+            'trxn_n_mcc': np.diff(matrix.spend.indptr),
+            'trxn_mcc_entropy': matrix.entropy(),
+            'trxn_abroad_share': matrix.abroad_share(),
+        }
+
+        top_mccs, top_shares = matrix.top_k(self._top_k)
+        for i in range(self._top_k):
+            ft[f'trxn_top{i + 1}_mcc'] = np.where(top_mccs[:, i] >= 0, top_mccs[:, i].astype('str'), 'nan')
+            ft[f'trxn_top{i + 1}_share'] = top_shares[:, i]
+
+        for level, prefix in [('brs_mcc_group', 'trxn_group_share_'), ('brs_mcc_subgroup', 'trxn_subgroup_share_')]:
+            labels = dict(zip(mcc_dict['mcc_cd'].astype('int64'), mcc_dict[level].astype('str')))
+            names, spend = matrix.rollup(labels)
+            shares = matrix.shares(spend).toarray()
+            for j, name in enumerate(names):
+                ft[f'{prefix}{name}'] = shares[:, j]
+
+        trxn_ft = pd.DataFrame(ft, index=pd.Index(matrix.clients, name='client_id'))
+        float_cols = trxn_ft.columns[trxn_ft.dtypes == 'float64']
+        trxn_ft[float_cols] = trxn_ft[float_cols].astype('float32')
+        return trxn_ft
+
 
 class PaymentFtExtractor:
+    INPUT_COLUMNS = ['client_id', 'day_dt', 'sum_rur', 'pmnts_name']
+
     def __init__(self, fn='train_data/payments.csv'):
         self._fn = fn
 
     def load_transform(self):
-        payments = pd.read_csv(self._fn)
+        payments = read_table(self._fn, columns=self.INPUT_COLUMNS)
+
+        # Get pensioneers
+        pensioneers = payments.query('pmnts_name == "Pension receipts"').client_id.unique()
+
+        # Get month codes for grouping, days at the end of a month count into the next one
+        payments['month'] = month_codes(payments['day_dt'], roll_month_end=True)
+        payments_months = ClientMonthTensor.from_frame(payments, ['sum_rur'])
+        del payments
+        gc.collect()
+
+        monthly = payments_months['sum_rur']
+        payments_mean = nan_mean(monthly)
+        # The std has always included the mean as one more value, keep it for existing models
+        payments_std = nan_std(np.column_stack([monthly, payments_mean]))
+
+        payments_ft = payments_months.frame({
+            **payments_months.monthly_columns(monthly, 'payments_', fmt='%Y_%m_%d'),
+            'payments_mean': payments_mean,
+            'payments_std': payments_std,
+            'is_pensioneer': np.isin(payments_months.clients, pensioneers),
+        })
+        return payments_ft
+
+
+class PaymentWindowFtExtractor:
+    """Payment volatility and last month features, plus the raw monthly payment sums."""
+
+    VALUE_COLS = ['sum_rur']
+    INPUT_COLUMNS = ['client_id', 'day_dt', 'sum_rur', 'pmnts_name']
+    # Columns besides the monthly sums
+    SUMMARY_COLUMNS = ['is_pensioneer', 'payments_std', 'payments_last', 'payments_all_avg', 'payments_volatility']
+
+    def __init__(self, fn='train_data/payments.csv', last_month=LAST_MONTH):
+        self._fn = fn
+        self._last_month = last_month
+        # Set by src.pruning.BuildPlan, the monthly sums are skipped if none of them is needed
+        self._needed = None
+
+    def _monthly_needed(self) -> bool:
+        return self._needed is None or any(col not in self.SUMMARY_COLUMNS for col in self._needed)
+
+    def load_transform(self):
+        payments = read_table(self._fn, columns=self.INPUT_COLUMNS)
 
         # Get pensioneers
         pensioneers = payments.query('pmnts_name == "Pension receipts"').client_id.unique()
-        pensioneers = pd.DataFrame({'is_pensioneer': 1}, index=pensioneers)
 
-        # Get date to first of month for grouping
-        payments['month'] = pd.to_datetime(payments['day_dt']).apply(lambda x: x + MonthEnd(1))
-        payments_months = payments.groupby(['client_id', 'month']).sum('sum_rur').reset_index()
+        # Days at the end of a month count into the next month
+        payments['month'] = month_codes(payments['day_dt'], roll_month_end=True)
+        payments_sums = ClientMonthTensor.from_frame(payments, self.VALUE_COLS, last_month=month_code(self._last_month),
+                                                     keep_history=self._monthly_needed())
         del payments
         gc.collect()
+        return self.transform(payments_sums, pensioneers)
+
+    def transform(self, payments_sums, pensioneers):
+        """Features from monthly payment sums, a ClientMonthTensor or an incremental MonthlyState.
+
+        Args:
+            payments_sums: Monthly sums of sum_rur
+            pensioneers: Client ids with a pension receipt
+        """
+        last_month = month_code(self._last_month)
+
+        # Get mean and STD for last few months for client
+        payments_std = payments_sums.std('sum_rur')
+        payments_mean = payments_sums.mean('sum_rur')
+
+        # Get payments last month
+        payments_last = payments_sums.last('sum_rur', last_month)
+
+        payments_ft = {
+            'is_pensioneer': np.isin(payments_sums.clients, pensioneers),
+            'payments_std': payments_std,
+            'payments_last': payments_last,
+            'payments_all_avg': payments_mean,
+            'payments_volatility': payments_std / payments_mean,
+        }
+        if self._monthly_needed():
+            payments_ft.update(payments_sums.columns_by_month('sum_rur', 'payments_'))
+        return payments_sums.frame(payments_ft)
 
-        payments_months = payments_months.pivot(index='client_id', columns='month')
-        payments_months.columns = [f'payments_{c[1].strftime("%Y_%m_%d")}' for c in payments_months.columns]
-        payments_months['payments_mean'] = payments_months.mean(axis=1)
-        payments_months['payments_std'] = payments_months.std(axis=1)
 
-        payments_ft = pd.concat([
-            payments_months,
-            pensioneers
-        ], axis=1).fillna({'is_pensioneer': 0})
-        del payments_months, pensioneers
+class DealsFtExtractor:
+    """Deals active at the end of the last month and of the months some time before it.
+
+    For every reference month: number of active deals, their total sum, sum-weighted
+    active and passive rates and days since the latest deal was opened and closed.
+    Columns of the last month have no suffix, those of earlier months _m<months back>.
+    """
+
+    INPUT_COLUMNS = ['client_id', 'agrmnt_start_dt', 'agrmnt_close_dt', 'agrmnt_rate_active',
+                     'agrmnt_rate_passive', 'agrmnt_sum_rur']
+
+    def __init__(self, fn='train_data/deals.csv', last_month=LAST_MONTH, months_back=(0, 3, 6, 12)):
+        self._fn = fn
+        self._last_month = last_month
+        self._months_back = tuple(months_back)
+
+    def load_transform(self):
+        deals = read_table(self._fn, columns=self.INPUT_COLUMNS)
+        starts = day_numbers(deals['agrmnt_start_dt'])
+        deals = deals[starts != MISSING_DAY]
+        starts = starts[starts != MISSING_DAY]
+
+        amount = deals['agrmnt_sum_rur'].fillna(0).to_numpy(dtype='float64')
+        weights = {'sum': amount}
+        for rate in ['agrmnt_rate_active', 'agrmnt_rate_passive']:
+            has_rate = deals[rate].notna().to_numpy()
+            weights[f'{rate}_weighted'] = np.where(has_rate, amount * deals[rate].fillna(0).to_numpy(), 0)
+            weights[f'{rate}_weight'] = np.where(has_rate, amount, 0)
+
+        intervals = ClientIntervals(deals['client_id'].to_numpy(), starts, day_numbers(deals['agrmnt_close_dt']), weights)
+        del deals
         gc.collect()
-        return payments_ft
+
+        ft = {}
+        for months_back in self._months_back:
+            day = month_end_day(month_code(self._last_month) - months_back)
+            suffix = f'_m{months_back}' if months_back else ''
+
+            n_active = intervals.n_active(day)
+            active = n_active > 0
+            ft[f'deals_active{suffix}'] = n_active
+            ft[f'deals_active_sum{suffix}'] = np.where(active, intervals.active_sum('sum', day), 0)
+            for rate, nm in [('agrmnt_rate_active', 'rate_active'), ('agrmnt_rate_passive', 'rate_passive')]:
+                weight = intervals.active_sum(f'{rate}_weight', day)
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    ft[f'deals_{nm}{suffix}'] = np.where(active & (weight > 0),
+                                                         intervals.active_sum(f'{rate}_weighted', day) / weight, np.nan)
+            ft[f'deals_days_since_open{suffix}'] = intervals.days_since_start(day)
+            ft[f'deals_days_since_close{suffix}'] = intervals.days_since_end(day)
+
+        deals_ft = pd.DataFrame(ft, index=pd.Index(intervals.clients, name='client_id'))
+        return deals_ft.astype('float32')
 
 
 class MysteryFtExtractor:
+    INPUT_COLUMNS = ['client_id'] + [f'feature_{i}' for i in range(1, 11)]
+
     def __init__(self, fn='train_data/funnel.csv'):
         self._fn = fn
 
     def load_transform(self):
-        mystery_feats = pd.read_csv(self._fn, usecols=['client_id'] + [f'feature_{i}' for i in range(1, 11)])
+        mystery_feats = read_table(self._fn, columns=self.INPUT_COLUMNS)
         mystery_feats = mystery_feats.set_index('client_id')
         mystery_feats['feature_1'] = mystery_feats['feature_1'].astype(str)
 
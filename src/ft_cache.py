@@ -0,0 +1,241 @@
+"""On-disk cache of extractor outputs, keyed by input file, extractor parameters and code.
+
+Inspect and purge it from the command line
+
+    python -m src.ft_cache list
+    python -m src.ft_cache purge --extractor BalanceFtExtractor
+    python -m src.ft_cache purge --max-mb 512
+"""
+import argparse
+import ast
+import functools
+import hashlib
+import inspect
+import json
+import os
+import sys
+import textwrap
+import time
+from typing import Dict, Optional, Tuple
+
+import pandas as pd
+
+from .data import fingerprint
+
+
+CACHE_DIR = os.environ.get('FEATURE_CACHE_DIR', '.feature_cache')
+
+# Least recently used entries are evicted once the cache grows over this size
+MAX_MB = 2048
+
+
+@functools.lru_cache(maxsize=None)
+def _referenced_names(source: str) -> frozenset:
+    """Names and attribute names used anywhere in a piece of source code."""
+    names = set()
+    for node in ast.walk(ast.parse(textwrap.dedent(source))):
+        if isinstance(node, ast.Name):
+            names.add(node.id)
+        elif isinstance(node, ast.Attribute):
+            names.add(node.attr)
+    return frozenset(names)
+
+
+@functools.lru_cache(maxsize=None)
+def _module_constants(source: str, package: str) -> Dict[str, tuple]:
+    """Module level assignments of a module's source, and the names it imports from the package.
+
+    Returns:
+        constants: name -> ('source', assignment source) or ('import', module, name)
+    """
+    constants = {}
+    for node in ast.parse(source).body:
+        if isinstance(node, (ast.Assign, ast.AnnAssign)):
+            targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+            for target in targets:
+                for name in ast.walk(target):
+                    if isinstance(name, ast.Name):
+                        constants[name.id] = ('source', ast.get_source_segment(source, node))
+        elif isinstance(node, ast.ImportFrom) and node.level == 1 and node.module:
+            for alias in node.names:
+                constants[alias.asname or alias.name] = ('import', f'{package}.{node.module}', alias.name)
+    return constants
+
+
+def _constant_source(module_name: str, name: str, package: str) -> Optional[Tuple[str, str]]:
+    """Defining module and assignment source of a module level constant, None if it is not one."""
+    constant = _module_constants(inspect.getsource(sys.modules[module_name]), package).get(name)
+    if constant is None:
+        return None
+    if constant[0] == 'import':
+        return _constant_source(constant[1], constant[2], package)
+    return module_name, constant[1]
+
+
+def _dependencies(name: str, source: str, module_name: str, package: str, seen: Dict[str, str]):
+    """Collect a piece of source and the package code it refers to by name.
+
+    Functions and classes are followed through the names their own source uses, constants
+    through the names of their assignment. Modules used as a whole (e.g. `from . import data`)
+    are included whole.
+    """
+    if name in seen:
+        return
+    seen[name] = source
+
+    module_globals = vars(sys.modules[module_name])
+    for ref in sorted(_referenced_names(source)):
+        value = module_globals.get(ref)
+        dep = inspect.getmodule(value) if value is not None else None
+        if inspect.ismodule(value) and value.__name__.startswith(package + '.'):
+            seen.setdefault(value.__name__, inspect.getsource(value))
+        elif (inspect.isclass(value) or inspect.isfunction(value)) and dep is not None \
+                and dep.__name__.startswith(package + '.'):
+            _dependencies(f'{dep.__name__}.{value.__qualname__}', inspect.getsource(value), dep.__name__,
+                          package, seen)
+        elif ref in module_globals:
+            constant = _constant_source(module_name, ref, package)
+            if constant is not None:
+                const_module, const_source = constant
+                _dependencies(f'{const_module}.{ref}', const_source, const_module, package, seen)
+
+
+def code_version(cls) -> str:
+    """Hash of the extractor's source code and of the package code it refers to.
+
+    Only the functions, classes and constants reachable by name from the extractor's source
+    are hashed, so editing an unrelated helper or another extractor keeps its entries.
+    """
+    seen = {}
+    _dependencies(f'{cls.__module__}.{cls.__qualname__}', inspect.getsource(cls), cls.__module__,
+                  cls.__module__.split('.')[0], seen)
+
+    h = hashlib.sha1()
+    for name in sorted(seen):
+        h.update(name.encode())
+        h.update(seen[name].encode())
+    return h.hexdigest()[:16]
+
+
+def cache_key(extractor) -> str:
+    """Key of an extractor's output: input file fingerprint, parameters and code version."""
+    cls = type(extractor)
+    params = repr(sorted(vars(extractor).items()))
+    key = '|'.join([cls.__qualname__, fingerprint(extractor._fn), params, code_version(cls)])
+    return hashlib.sha1(key.encode()).hexdigest()[:24]
+
+
+class FeatureCache:
+    def __init__(self, cache_dir: str = CACHE_DIR, max_mb: float = MAX_MB):
+        self._cache_dir = cache_dir
+        self._max_mb = max_mb
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self._cache_dir, f'{key}.pickle')
+
+    def get(self, extractor) -> Optional[pd.DataFrame]:
+        path = self._path(cache_key(extractor))
+        if not os.path.exists(path):
+            return None
+
+        # Mark as recently used for eviction
+        os.utime(path)
+        return pd.read_pickle(path)
+
+    def put(self, extractor, features: pd.DataFrame):
+        os.makedirs(self._cache_dir, exist_ok=True)
+        key = cache_key(extractor)
+
+        # Write to a temporary file first, so that a crash never leaves a partial entry
+        tmp_path = self._path(key) + f'.tmp{os.getpid()}'
+        features.to_pickle(tmp_path)
+        with open(os.path.join(self._cache_dir, f'{key}.json'), 'w') as f:
+            json.dump({
+                'extractor': type(extractor).__qualname__,
+                'fn': extractor._fn,
+                'params': repr(sorted(vars(extractor).items())),
+                'created': time.time(),
+            }, f)
+        os.replace(tmp_path, self._path(key))
+
+        self.evict(self._max_mb)
+
+    def load_transform(self, extractor) -> pd.DataFrame:
+        """Return the cached output of the extractor, running and caching it on a miss."""
+        features = self.get(extractor)
+        if features is None:
+            features = extractor.load_transform()
+            self.put(extractor, features)
+        return features
+
+    def entries(self) -> pd.DataFrame:
+        """List cache entries, most recently used first."""
+        rows = []
+        if os.path.isdir(self._cache_dir):
+            for fn in os.listdir(self._cache_dir):
+                if not fn.endswith('.pickle'):
+                    continue
+                key = fn[:-len('.pickle')]
+                path = self._path(key)
+                try:
+                    with open(os.path.join(self._cache_dir, f'{key}.json')) as f:
+                        meta = json.load(f)
+                except FileNotFoundError:
+                    meta = {}
+                rows.append({
+                    'key': key,
+                    'extractor': meta.get('extractor'),
+                    'fn': meta.get('fn'),
+                    'size_mb': os.path.getsize(path) / 2**20,
+                    'last_used': pd.Timestamp(os.path.getmtime(path), unit='s'),
+                })
+
+        columns = ['key', 'extractor', 'fn', 'size_mb', 'last_used']
+        return pd.DataFrame(rows, columns=columns).sort_values('last_used', ascending=False)
+
+    def remove(self, key: str):
+        for ext in ['pickle', 'json']:
+            try:
+                os.remove(os.path.join(self._cache_dir, f'{key}.{ext}'))
+            except FileNotFoundError:
+                pass
+
+    def evict(self, max_mb: float):
+        """Remove least recently used entries until the cache is at most max_mb large."""
+        entries = self.entries()
+        sizes = entries['size_mb'].cumsum()
+        for key in entries.loc[sizes > max_mb, 'key']:
+            self.remove(key)
+
+    def purge(self, extractor: Optional[str] = None):
+        """Remove all entries, or only those of one extractor class."""
+        entries = self.entries()
+        if extractor is not None:
+            entries = entries[entries['extractor'] == extractor]
+        for key in entries['key']:
+            self.remove(key)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Inspect and purge the extractor feature cache')
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('list', help='List cache entries, most recently used first')
+    purge = commands.add_parser('purge', help='Remove cache entries (all of them by default)')
+    purge.add_argument('--extractor', help='Only remove entries of this extractor class')
+    purge.add_argument('--max-mb', type=float, help='Only evict least recently used entries down to this size')
+    args = parser.parse_args()
+
+    cache = FeatureCache(args.cache_dir)
+    if args.command == 'list':
+        entries = cache.entries()
+        print(entries.to_string(index=False))
+        print(f'\n{len(entries)} entries, {entries["size_mb"].sum():.1f} MB')
+    elif args.max_mb is not None:
+        cache.evict(args.max_mb)
+    else:
+        cache.purge(args.extractor)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,305 @@
+"""Incremental monthly refresh of the balance, AUM, payments and transaction features.
+
+Instead of recomputing every feature from the full history when a new month of data
+arrives, IncrementalFeatures keeps running per client state and only ingests the new rows:
+
+    state = IncrementalFeatures.load('feature_state.pickle')
+    state.refresh('new_month_data')
+    blocks = state.blocks()
+    state.save('feature_state.pickle')
+
+The cost of a refresh scales with the new rows and the number of clients, not with the
+length of the history.
+"""
+import os
+import pickle
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .data import read_table
+from .features import AUMWindowFtExtractor, BalanceWindowFtExtractor, PaymentWindowFtExtractor, TrxnFtExtractor
+from .periods import MISSING_MONTH, month_codes, month_end_str, quarter_codes
+from .spend import ClientMccMatrix
+from .tensor import WINDOW_MONTHS, merge_moments, moments, nan_mean, window_means
+
+
+# Months kept in full detail, the months of the window features
+RING_MONTHS = WINDOW_MONTHS
+
+
+class MonthlyState:
+    """Running per client statistics of the monthly sums of value columns.
+
+    The last RING_MONTHS months are kept as [n_clients, RING_MONTHS] arrays of monthly sums,
+    row counts and value counts, which give the last month values and the quarter means.
+    Rows of any month in the ring can still be added. When a month drops out of the ring
+    its sums are folded into Welford aggregates (count, mean and sum of squared deviations
+    per client), which are merged with the ring months for the all-history mean and std.
+
+    It has the statistics methods of ClientMonthTensor that the window extractors use, so
+    their transform methods run on it unchanged. Like the tensor with a last_month, the
+    m12 window does not reach back before the ring.
+    """
+
+    def __init__(self, value_cols: List[str], ring_months: int = RING_MONTHS, keep_history: bool = False):
+        """
+        Args:
+            value_cols: Value columns to sum
+            ring_months: Number of months kept in full detail
+            keep_history: Keep the monthly sums of the months that dropped out of the
+                ring, for columns_by_month
+        """
+        self.value_cols = list(value_cols)
+        self.ring_months = ring_months
+        self.keep_history = keep_history
+
+        #: Sorted ids of all clients seen so far
+        self.clients = np.zeros(0, dtype='int64')
+        #: Month code of every ring column, the newest last, None until the first rows
+        self.months = None
+
+        self._observed = np.zeros(ring_months, dtype=bool)
+        self._counts = np.zeros((0, ring_months), dtype='int32')
+        self._sums = {col: np.zeros((0, ring_months)) for col in self.value_cols}
+        self._value_counts = {col: np.zeros((0, ring_months), dtype='int32') for col in self.value_cols}
+
+        # Welford aggregates of the months that dropped out of the ring
+        self._n = np.zeros(0, dtype='int32')
+        self._mean = {col: np.zeros(0) for col in self.value_cols}
+        self._m2 = {col: np.zeros(0) for col in self.value_cols}
+        self._history = {col: {} for col in self.value_cols}
+
+    def ingest(self, client_ids: np.ndarray, months: np.ndarray, values: Dict[str, np.ndarray]):
+        """Add rows, the ring moves forward to the newest of their months.
+
+        Args:
+            client_ids: Client id of every row
+            months: Month code of every row
+            values: Value columns, by name
+        """
+        months = np.asarray(months, dtype='int64')
+        rows_with_month = months != MISSING_MONTH
+        if not rows_with_month.all():
+            client_ids = np.asarray(client_ids)[rows_with_month]
+            months = months[rows_with_month]
+            values = {col: np.asarray(values[col])[rows_with_month] for col in self.value_cols}
+        if not len(months):
+            return
+        if months.max() - months.min() >= self.ring_months:
+            # A longer history than the ring, e.g. when building the state, goes month by month
+            for month in np.unique(months):
+                in_month = months == month
+                self.ingest(np.asarray(client_ids)[in_month], months[in_month],
+                            {col: np.asarray(values[col])[in_month] for col in self.value_cols})
+            return
+        self._add_clients(np.unique(client_ids))
+        self._advance(int(months.max()))
+        if months.min() < self.months[0]:
+            raise ValueError(f'Rows of {month_end_str(int(months.min()))} are older than the months kept, '
+                             'rebuild the state from the full history')
+
+        rows = np.searchsorted(self.clients, np.asarray(client_ids))
+        cells = rows * self.ring_months + (months - self.months[0])
+        n_cells = len(self.clients) * self.ring_months
+        shape = (len(self.clients), self.ring_months)
+
+        self._counts += np.bincount(cells, minlength=n_cells).reshape(shape).astype('int32')
+        self._observed |= self._counts.any(axis=0)
+        for col in self.value_cols:
+            v = np.asarray(values[col], dtype='float64')
+            notna = ~np.isnan(v)
+            self._sums[col] += np.bincount(cells, weights=np.where(notna, v, 0), minlength=n_cells).reshape(shape)
+            self._value_counts[col] += np.bincount(cells[notna], minlength=n_cells).reshape(shape).astype('int32')
+
+    def _add_clients(self, client_ids: np.ndarray):
+        clients = np.union1d(self.clients, client_ids)
+        if len(clients) == len(self.clients):
+            return
+        pos = np.searchsorted(clients, self.clients)
+
+        def grow(arr, fill=0):
+            out = np.full((len(clients),) + arr.shape[1:], fill, dtype=arr.dtype)
+            out[pos] = arr
+            return out
+
+        self._counts = grow(self._counts)
+        self._n = grow(self._n)
+        for col in self.value_cols:
+            self._sums[col] = grow(self._sums[col])
+            self._value_counts[col] = grow(self._value_counts[col])
+            self._mean[col] = grow(self._mean[col])
+            self._m2[col] = grow(self._m2[col])
+            self._history[col] = {m: grow(h, np.nan) for m, h in self._history[col].items()}
+        self.clients = clients
+
+    def _advance(self, newest: int):
+        """Move the ring forward so that its last month is newest, folding the months that drop out."""
+        if self.months is None:
+            self.months = np.arange(newest - self.ring_months + 1, newest + 1)
+            return
+        shift = min(newest - int(self.months[-1]), self.ring_months)
+        if shift <= 0:
+            return
+
+        for i in range(shift):
+            self._fold(i)
+
+        def roll(arr, fill=0):
+            arr = np.roll(arr, -shift, axis=-1)
+            arr[..., -shift:] = fill
+            return arr
+
+        self._observed = roll(self._observed, False)
+        self._counts = roll(self._counts)
+        for col in self.value_cols:
+            self._sums[col] = roll(self._sums[col])
+            self._value_counts[col] = roll(self._value_counts[col])
+        self.months = np.arange(newest - self.ring_months + 1, newest + 1)
+
+    def _fold(self, i: int):
+        """Welford update with the sums of ring column i, for the clients with rows in that month."""
+        has_rows = self._counts[:, i] > 0
+        n = self._n + has_rows
+        for col in self.value_cols:
+            x = self.month_sums(col)[:, i].astype('float64')
+            delta = np.where(has_rows, x - self._mean[col], 0)
+            mean = self._mean[col] + np.where(has_rows, delta / np.maximum(n, 1), 0)
+            self._m2[col] = self._m2[col] + np.where(has_rows, delta * (x - mean), 0)
+            self._mean[col] = mean
+            if self.keep_history and self._observed[i]:
+                self._history[col][int(self.months[i])] = self.month_sums(col)[:, i]
+        self._n = n
+
+    def month_sums(self, name: str) -> np.ndarray:
+        """Monthly sums of the ring months, float32 and NaN without rows like ClientMonthTensor."""
+        sums = self._sums[name].astype('float32')
+        sums[self._counts == 0] = np.nan
+        return sums
+
+    def _merged(self, name: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Welford aggregates of the folded months merged with the ring months."""
+        return merge_moments(self._n, self._mean[name], self._m2[name], *moments(self.month_sums(name)))
+
+    def mean(self, name: str) -> np.ndarray:
+        return self._merged(name)[1]
+
+    def std(self, name: str) -> np.ndarray:
+        n, _, m2 = self._merged(name)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(n > 1, np.sqrt(np.maximum(m2, 0) / (n - 1)), np.nan)
+
+    def mean_difference(self, name: str, other: str) -> np.ndarray:
+        # Both columns come from the same rows, so they have values in the same months
+        diff = self.month_sums(name) - self.month_sums(other)
+        n_r = (~np.isnan(diff)).sum(axis=1)
+        total = np.nansum(diff, axis=1, dtype='float64') + self._n * (self._mean[name] - self._mean[other])
+        n = self._n + n_r
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(n > 0, total / n, np.nan)
+
+    def last(self, name: str, month: int) -> np.ndarray:
+        i = month - self.months[0]
+        if 0 <= i < self.ring_months:
+            return self.month_sums(name)[:, i]
+        return np.full(len(self.clients), np.nan, dtype='float32')
+
+    def windows(self, name: str, last_month: int, row_means: bool = False) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        quarters = quarter_codes(self.months, last_month)
+        sums = self.month_sums(name)
+
+        # The ring ends at the newest month, one month earlier than the columns of the tensor,
+        # so its first month is quarter 0 and outside the m12 window
+        means = {}
+        for q in np.unique(quarters[self._observed & (quarters >= 1)]):
+            in_q = quarters == q
+            if not row_means:
+                means[q] = nan_mean(sums[:, in_q])
+                continue
+            count = self._value_counts[name][:, in_q].sum(axis=1)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                means[q] = np.where(count > 0, np.nan_to_num(sums[:, in_q]).sum(axis=1, dtype='float64') / count,
+                                    np.nan)
+        return window_means(means, len(self.clients))
+
+    def columns_by_month(self, name: str, prefix: str, fmt: str = '%Y-%m-%d') -> Dict[str, np.ndarray]:
+        columns = {f'{prefix}{month_end_str(m, fmt)}': h for m, h in sorted(self._history[name].items())}
+        sums = self.month_sums(name)
+        for i in np.flatnonzero(self._observed):
+            columns[f'{prefix}{month_end_str(int(self.months[i]), fmt)}'] = sums[:, i]
+        return columns
+
+    def frame(self, columns: Dict[str, np.ndarray]) -> pd.DataFrame:
+        index = pd.Index(self.clients, name='client_id')
+        return pd.DataFrame({nm: np.asarray(col, dtype='float32') for nm, col in columns.items()}, index=index)
+
+
+class IncrementalFeatures:
+    """Running state of the balance, AUM, payments and transaction features of the build.
+
+    The blocks are those of BalanceWindowFtExtractor, AUMWindowFtExtractor,
+    TrxnFtExtractor and PaymentWindowFtExtractor, computed by the same transform methods.
+    """
+
+    def __init__(self, ring_months: int = RING_MONTHS):
+        self.balance = MonthlyState(BalanceWindowFtExtractor.VALUE_COLS, ring_months)
+        self.aum = MonthlyState(AUMWindowFtExtractor.VALUE_COLS, ring_months)
+        self.payments = MonthlyState(PaymentWindowFtExtractor.VALUE_COLS, ring_months, keep_history=True)
+        self.pensioneers = np.zeros(0, dtype='int64')
+        self.trxn = None
+
+    def refresh(self, data_dir: str):
+        """Ingest balance.csv, aum.csv, payments.csv and trxn.csv of a directory.
+
+        Usually these only hold the rows of a new month. The first refresh can also be the
+        full history, to build the state.
+        """
+        balances = read_table(os.path.join(data_dir, 'balance.csv'),
+                              columns=['client_id', 'month_end_dt'] + BalanceWindowFtExtractor.VALUE_COLS)
+        self._ingest(self.balance, balances, month_codes(balances['month_end_dt']))
+        del balances
+
+        aum = read_table(os.path.join(data_dir, 'aum.csv'),
+                         columns=['client_id', 'month_end_dt'] + AUMWindowFtExtractor.VALUE_COLS)
+        self._ingest(self.aum, aum, month_codes(aum['month_end_dt']))
+        del aum
+
+        payments = read_table(os.path.join(data_dir, 'payments.csv'),
+                              columns=['client_id', 'day_dt', 'sum_rur', 'pmnts_name'])
+        pensioneers = payments.query('pmnts_name == "Pension receipts"').client_id.unique()
+        self.pensioneers = np.union1d(self.pensioneers, pensioneers)
+        # Days at the end of a month count into the next month
+        self._ingest(self.payments, payments, month_codes(payments['day_dt'], roll_month_end=True))
+        del payments
+
+        trxn = ClientMccMatrix.from_table(os.path.join(data_dir, 'trxn.csv'))
+        self.trxn = trxn if self.trxn is None else self.trxn.merge(trxn)
+
+    @staticmethod
+    def _ingest(state: MonthlyState, df: pd.DataFrame, months: np.ndarray):
+        state.ingest(df['client_id'].to_numpy(), months, {col: df[col].to_numpy() for col in state.value_cols})
+
+    def blocks(self, last_month: Optional[str] = None) -> List[pd.DataFrame]:
+        """Feature blocks in the order of the build: balance, AUM, transactions, payments.
+
+        Args:
+            last_month: Reference month, the newest month of the balances if None
+        """
+        if last_month is None:
+            last_month = month_end_str(int(self.balance.months[-1]))
+        return [
+            BalanceWindowFtExtractor(last_month=last_month).transform(self.balance),
+            AUMWindowFtExtractor(last_month=last_month).transform(self.aum),
+            TrxnFtExtractor.from_matrix(self.trxn),
+            PaymentWindowFtExtractor(last_month=last_month).transform(self.payments, self.pensioneers),
+        ]
+
+    def save(self, fn: str):
+        with open(fn, 'wb') as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, fn: str) -> 'IncrementalFeatures':
+        with open(fn, 'rb') as f:
+            return pickle.load(f)
@@ -0,0 +1,62 @@
+from typing import Iterator, List, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from .feature_matrix import FeatureMatrix
+
+
+# Rows scored at a time, bounds the memory of the Pool and of the predictions
+BATCH_ROWS = 50_000
+
+
+def iter_row_blocks(data: Union[pd.DataFrame, FeatureMatrix], batch_rows: int = BATCH_ROWS) -> Iterator[pd.DataFrame]:
+    """Yield consecutive row blocks of a feature matrix."""
+    if isinstance(data, FeatureMatrix):
+        yield from data.iter_blocks(batch_rows)
+        return
+    for start in range(0, len(data), batch_rows):
+        yield data.iloc[start:start + batch_rows]
+
+
+def predict_to_csv(model,
+                   data: Union[pd.DataFrame, FeatureMatrix],
+                   cat_features: List[str],
+                   fn: str = 'submission.csv',
+                   threshold: Optional[float] = None,
+                   batch_rows: int = BATCH_ROWS) -> int:
+    """Score a feature matrix block by block and write the submission as it goes.
+
+    Only one block's Pool and predictions are in memory at a time, so the memory of
+    scoring does not grow with the number of clients.
+
+    Args:
+        model: Fitted CatBoost model
+        data: client_id indexed feature matrix, or a FeatureMatrix file whose blocks are
+            read from disk as they are scored
+        cat_features: Categorical feature columns
+        fn: Submission file, written as client_id,target rows
+        threshold: If given, the target is 1 where the prediction is above it and 0 otherwise,
+            else the raw predictions are written
+        batch_rows: Rows per block
+
+    Returns:
+        n_rows: Number of rows written
+    """
+    # catboost takes a while to import, modules that only import this one don't pay for it
+    from catboost import Pool
+
+    n_rows = 0
+    with open(fn, 'w', newline='') as f:
+        for i, block in enumerate(iter_row_blocks(data, batch_rows)):
+            pred = model.predict(Pool(data=block, cat_features=cat_features))
+            if threshold is not None:
+                pred = (pred > threshold).astype(int)
+
+            submission = pd.DataFrame({'client_id': block.index, 'target': np.asarray(pred)})
+            submission.to_csv(f, header=i == 0, index=False)
+            n_rows += len(block)
+
+        if n_rows == 0:
+            f.write('client_id,target\n')
+    return n_rows
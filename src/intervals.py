@@ -0,0 +1,90 @@
+from typing import Dict
+
+import numpy as np
+
+from .periods import MISSING_DAY
+
+
+# Days are shifted by this much so that they pack into the low 32 bits of a key
+_DAY_OFFSET = 2**31
+
+
+class ClientIntervals:
+    """Per client [start, end) intervals, e.g. deals, queried at points in time.
+
+    Starts and ends are kept as two sorted arrays of (client, day) keys with prefix sums of
+    the interval weights. The number of intervals of a client active at day t is then the
+    number of starts up to t minus the number of ends up to t, two searchsorted calls, and
+    weighted sums work the same way with the prefix sums. Building is O(n log n), every
+    query O(clients * log n), instead of comparing every interval with every point in time.
+    """
+
+    def __init__(self, client_ids: np.ndarray, starts: np.ndarray, ends: np.ndarray,
+                 weights: Dict[str, np.ndarray]):
+        """
+        Args:
+            client_ids: Client of every interval
+            starts: Start day number (see src.periods.day_numbers) of every interval
+            ends: End day number, MISSING_DAY for intervals that are still open. Ends before
+                the start are moved to the start
+            weights: Values to sum over active intervals, by name. NaN counts as 0
+        """
+        self.clients, rows = np.unique(np.asarray(client_ids), return_inverse=True)
+        starts = np.asarray(starts, dtype='int64')
+        ends = np.asarray(ends, dtype='int64')
+        is_open = ends == MISSING_DAY
+        ends = np.maximum(ends, starts)
+
+        start_keys = self._keys(rows, starts)
+        start_order = np.argsort(start_keys, kind='stable')
+        self._start_keys = start_keys[start_order]
+
+        closed = np.flatnonzero(~is_open)
+        end_keys = self._keys(rows[closed], ends[closed])
+        end_order = np.argsort(end_keys, kind='stable')
+        self._end_keys = end_keys[end_order]
+
+        # Prefix sums with a leading 0, the sum over keys [i, j) is cum[j] - cum[i]
+        self._start_cums, self._end_cums = {}, {}
+        for name, w in weights.items():
+            w = np.nan_to_num(np.asarray(w, dtype='float64'))
+            self._start_cums[name] = np.concatenate([[0], np.cumsum(w[start_order])])
+            self._end_cums[name] = np.concatenate([[0], np.cumsum(w[closed][end_order])])
+
+    @staticmethod
+    def _keys(rows: np.ndarray, days) -> np.ndarray:
+        return (np.asarray(rows, dtype='int64') << 32) | (np.asarray(days, dtype='int64') + _DAY_OFFSET)
+
+    def _bounds(self, keys: np.ndarray, day: int):
+        """Positions of every client's first key and of its first key after day."""
+        rows = np.arange(len(self.clients))
+        first = np.searchsorted(keys, self._keys(rows, -_DAY_OFFSET), side='left')
+        upto = np.searchsorted(keys, self._keys(rows, day), side='right')
+        return first, upto
+
+    def n_active(self, day: int) -> np.ndarray:
+        """Number of intervals of every client that started on or before day and did not end by then."""
+        s_first, s_upto = self._bounds(self._start_keys, day)
+        e_first, e_upto = self._bounds(self._end_keys, day)
+        return (s_upto - s_first) - (e_upto - e_first)
+
+    def active_sum(self, name: str, day: int) -> np.ndarray:
+        """Sum of a weight over the intervals of every client active at day."""
+        s_first, s_upto = self._bounds(self._start_keys, day)
+        e_first, e_upto = self._bounds(self._end_keys, day)
+        starts, ends = self._start_cums[name], self._end_cums[name]
+        return (starts[s_upto] - starts[s_first]) - (ends[e_upto] - ends[e_first])
+
+    @staticmethod
+    def _days_since(keys: np.ndarray, first: np.ndarray, upto: np.ndarray, day: int) -> np.ndarray:
+        has_any = upto > first
+        last = (keys[np.maximum(upto - 1, 0)] & (2**32 - 1)) - _DAY_OFFSET
+        return np.where(has_any, day - last, np.nan)
+
+    def days_since_start(self, day: int) -> np.ndarray:
+        """Days since the latest start on or before day, NaN for clients without one."""
+        return self._days_since(self._start_keys, *self._bounds(self._start_keys, day), day)
+
+    def days_since_end(self, day: int) -> np.ndarray:
+        """Days since the latest end on or before day, NaN for clients without one."""
+        return self._days_since(self._end_keys, *self._bounds(self._end_keys, day), day)
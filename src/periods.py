@@ -0,0 +1,107 @@
+from typing import Union
+
+import numpy as np
+import pandas as pd
+
+
+# Last full month of the data, the reference month for quarters and last month features
+LAST_MONTH = '2019-08-31'
+
+# Month code of missing dates
+MISSING_MONTH = -1
+
+# Day number of missing dates
+MISSING_DAY = np.iinfo('int32').min
+
+
+def month_code(date: str) -> int:
+    """Month code of a single date, the number of months since year 0 (Jan 2019 -> 24228)."""
+    ts = pd.Timestamp(date)
+    return ts.year * 12 + ts.month - 1
+
+
+def month_codes(dates: pd.Series, roll_month_end: bool = False) -> np.ndarray:
+    """Convert a column of dates to int32 month codes.
+
+    Only the unique dates are parsed, so this is a hash (or, for categoricals, a take) over
+    the rows plus a vectorized parse of a few hundred distinct values.
+
+    Args:
+        dates: Dates as strings, categoricals or datetimes
+        roll_month_end: Move dates that fall on the last day of a month to the next month.
+            This is what adding MonthEnd(1) to a date does, the payments features rely on it
+
+    Returns:
+        codes: Month codes (see month_code), MISSING_MONTH where the date is missing
+    """
+    if isinstance(dates.dtype, pd.CategoricalDtype):
+        codes, uniques = dates.cat.codes.to_numpy(), dates.cat.categories
+    else:
+        codes, uniques = pd.factorize(dates)
+
+    uniques = pd.DatetimeIndex(pd.to_datetime(uniques))
+    months = uniques.year * 12 + uniques.month - 1
+    if roll_month_end:
+        months = months + uniques.is_month_end
+    months = np.append(np.asarray(months, dtype='int32'), np.int32(MISSING_MONTH))
+
+    # Code -1 (missing) picks the MISSING_MONTH appended at the end
+    return months.take(codes)
+
+
+def day_numbers(dates: pd.Series) -> np.ndarray:
+    """Convert a column of dates to int32 day numbers, days since 1970-01-01.
+
+    Like month_codes, only the unique dates are parsed.
+
+    Returns:
+        days: Day numbers, MISSING_DAY where the date is missing
+    """
+    if isinstance(dates.dtype, pd.CategoricalDtype):
+        codes, uniques = dates.cat.codes.to_numpy(), dates.cat.categories
+    else:
+        codes, uniques = pd.factorize(dates)
+
+    days = pd.DatetimeIndex(pd.to_datetime(uniques)).to_numpy().astype('datetime64[D]').astype('int64')
+    days = np.append(days.astype('int32'), np.int32(MISSING_DAY))
+    return days.take(codes)
+
+
+def month_end_day(month: int) -> int:
+    """Day number (see day_numbers) of the last day of a month code."""
+    month_start = np.datetime64(month - 1970 * 12 + 1, 'M')
+    return int(month_start.astype('datetime64[D]').astype('int64')) - 1
+
+
+def quarter_codes(months: np.ndarray, ref_month: Union[str, int] = LAST_MONTH, n_quarters: int = 4) -> np.ndarray:
+    """Map month codes to quarters counted back from a reference month.
+
+    The reference month and the two before it are quarter n_quarters, the three months
+    before those n_quarters - 1 and so on. Months after the reference month belong to the
+    last quarter.
+
+    Args:
+        months: Month codes
+        ref_month: Reference month, as a date or a month code
+        n_quarters: Number of the last quarter
+
+    Returns:
+        quarters: int32 quarter codes, can be 0 or negative for months more than
+            n_quarters * 3 months before the reference month
+    """
+    if isinstance(ref_month, str):
+        ref_month = month_code(ref_month)
+    quarters = n_quarters - (ref_month - months) // 3
+    return np.minimum(quarters, n_quarters).astype('int32')
+
+
+def month_end_str(months: Union[int, np.ndarray], fmt: str = '%Y-%m-%d') -> Union[str, np.ndarray]:
+    """Format month codes as the last day of the month, e.g. 24235 -> '2019-08-31'."""
+    scalar = np.ndim(months) == 0
+    months = np.atleast_1d(np.asarray(months, dtype='int64'))
+
+    # First day of the next month, minus one day
+    month_start = (months - 1970 * 12 + 1).astype('datetime64[M]')
+    month_end = month_start.astype('datetime64[D]') - np.timedelta64(1, 'D')
+    out = pd.DatetimeIndex(month_end).strftime(fmt).to_numpy()
+    return out[0] if scalar else out
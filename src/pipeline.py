@@ -0,0 +1,194 @@
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import List, Optional
+
+import pandas as pd
+
+from .client_index import ClientIndex
+from .ft_cache import FeatureCache
+from .prefetch import Prefetcher
+from .profiling import log_stats, stage
+from .spill import SpillStore
+
+
+# Total memory the extractors running at the same time may use
+MEM_BUDGET_MB = 1536
+
+# Peak memory of an extractor relative to the size of its input file. Extractors can
+# override it with a MEM_FACTOR class attribute
+DEFAULT_MEM_FACTOR = 3.0
+
+# Memory for input tables read ahead of the running extractor, at most what the budget
+# leaves next to the largest extractor
+PREFETCH_MB = 512
+
+
+def available_cpus() -> int:
+    """Number of CPUs this process may run on (respects CPU affinity, unlike os.cpu_count)."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def estimate_peak_mb(extractor) -> float:
+    """Estimate the peak memory of an extractor from the size of its input file.
+
+    For extractors that stream their input with a memory budget, the budget is the cap.
+    """
+    size_mb = os.path.getsize(extractor._fn) / 2**20
+    peak_mb = size_mb * getattr(extractor, 'MEM_FACTOR', DEFAULT_MEM_FACTOR)
+
+    mem_budget_mb = getattr(extractor, '_mem_budget_mb', None)
+    if mem_budget_mb is not None:
+        peak_mb = min(peak_mb, mem_budget_mb)
+    return peak_mb
+
+
+def input_table(extractor) -> Optional[tuple]:
+    """(file, columns) the extractor reads whole with read_table, None if unknown or streamed.
+
+    Extractors declare the columns with an INPUT_COLUMNS class attribute.
+    """
+    columns = getattr(extractor, 'INPUT_COLUMNS', None)
+    if columns is None or getattr(extractor, '_mem_budget_mb', None) is not None:
+        return None
+    return extractor._fn, list(columns)
+
+
+def _load_transform(extractor) -> pd.DataFrame:
+    with stage(type(extractor).__name__):
+        result = extractor.load_transform()
+
+    # Extractors pruned by a BuildPlan have the columns of their full output, the ones they
+    # did not compute are NaN
+    columns = getattr(extractor, '_columns', None)
+    if columns is not None:
+        result = result.reindex(columns=columns)
+    return result
+
+
+def _keep(result: pd.DataFrame, spill: Optional[SpillStore]) -> pd.DataFrame:
+    return result if spill is None else spill.maybe_spill(result)
+
+
+def _run_serial(extractors: list,
+                estimates: List[float],
+                spill: Optional[SpillStore] = None,
+                prefetch_mb: float = 0) -> List[pd.DataFrame]:
+    # The finished blocks are much smaller than the extractors' peaks, so running the most
+    # memory hungry extractor first, while nothing is held yet, gives the lowest peak
+    order = sorted(range(len(extractors)), key=lambda i: -estimates[i])
+
+    results = [None] * len(extractors)
+    if prefetch_mb <= 0:
+        for i in order:
+            results[i] = _keep(_load_transform(extractors[i]), spill)
+        return results
+
+    # The next extractor's input is read on a thread while the current one computes
+    requests = [input_table(extractors[i]) for i in order]
+    with Prefetcher([r for r in requests if r is not None], mem_budget_mb=prefetch_mb) as prefetch:
+        for i in order:
+            results[i] = _keep(_load_transform(extractors[i]), spill)
+
+    stats = prefetch.stats()
+    log_stats('prefetch', stats)
+    if stats['tables']:
+        print(f"prefetch: {stats['hidden_s']:.1f} s of {stats['read_s']:.1f} s reading hidden, "
+              f"{stats['wait_s']:.1f} s waited")
+    return results
+
+
+def _run_parallel(extractors: list,
+                  estimates: List[float],
+                  n_jobs: int,
+                  mem_budget_mb: float,
+                  spill: Optional[SpillStore] = None) -> List[pd.DataFrame]:
+    pending = sorted(range(len(extractors)), key=lambda i: -estimates[i])
+    running = {}
+    results = [None] * len(extractors)
+
+    with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+        while pending or running:
+            # Admit the largest extractors that still fit in the budget. If nothing is running
+            # the next one is admitted anyway, otherwise it would never run
+            used_mb = sum(estimates[i] for i in running.values())
+            for i in list(pending):
+                if len(running) >= n_jobs:
+                    break
+                if running and used_mb + estimates[i] > mem_budget_mb:
+                    continue
+                running[pool.submit(_load_transform, extractors[i])] = i
+                used_mb += estimates[i]
+                pending.remove(i)
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                results[running.pop(future)] = _keep(future.result(), spill)
+
+    return results
+
+
+def run_extractors(extractors: list,
+                   n_jobs: Optional[int] = None,
+                   mem_budget_mb: float = MEM_BUDGET_MB,
+                   cache: Optional[FeatureCache] = None,
+                   index: Optional[ClientIndex] = None,
+                   spill: Optional[SpillStore] = None,
+                   layout: Optional[dict] = None,
+                   prefetch_mb: float = PREFETCH_MB) -> pd.DataFrame:
+    """Run feature extractors, in parallel when there are several CPUs, and join their output.
+
+    Extractors only run at the same time while the sum of their estimated peak memory
+    (see estimate_peak_mb) stays under the budget. With a single CPU they run one after
+    another, in the order that minimises peak memory, and the input table of the next
+    extractor is read on a background thread while the current one computes (see
+    src.prefetch).
+
+    Args:
+        extractors: Objects with a load_transform method returning a client_id indexed dataframe
+        n_jobs: Number of worker processes, the number of available CPUs if None
+        mem_budget_mb: Memory budget for extractors running at the same time
+        cache: Feature cache, only extractors without a cached output are run if given
+        index: Client registry, if given the outputs are written into its rows (see
+            ClientIndex.assemble) instead of being aligned by pd.concat
+        spill: Spill store, finished outputs (and the assembled matrix) are moved to disk
+            while the process is over its high-water mark
+        layout: If given, the output columns of every extractor are recorded in it, by
+            class name (see src.pruning)
+        prefetch_mb: Memory for input tables read ahead when running serially, capped at
+            what mem_budget_mb leaves next to the largest extractor. 0 disables prefetching
+
+    Returns:
+        features: The outputs of all extractors concatenated along columns, in the order of
+            the extractors
+    """
+    results = [None] * len(extractors)
+    if cache is not None:
+        results = [cache.get(ex) for ex in extractors]
+    to_run = [i for i, res in enumerate(results) if res is None]
+
+    if n_jobs is None:
+        n_jobs = available_cpus()
+    n_jobs = min(n_jobs, len(to_run))
+
+    estimates = [estimate_peak_mb(extractors[i]) for i in to_run]
+    if n_jobs <= 1:
+        prefetch_mb = min(prefetch_mb, mem_budget_mb - max(estimates, default=0))
+        computed = _run_serial([extractors[i] for i in to_run], estimates, spill, prefetch_mb)
+    else:
+        computed = _run_parallel([extractors[i] for i in to_run], estimates, n_jobs, mem_budget_mb, spill)
+
+    for i, res in zip(to_run, computed):
+        results[i] = res
+        if cache is not None:
+            cache.put(extractors[i], res)
+
+    if layout is not None:
+        layout.update({type(ex).__name__: list(res.columns) for ex, res in zip(extractors, results)})
+
+    with stage('assemble'):
+        if index is not None:
+            return index.assemble(results, spill=spill)
+        return pd.concat(results, axis=1)
@@ -1,15 +1,29 @@
 import contextlib
-import matplotlib
-import matplotlib.pyplot as plt
 import numpy as np
-import scipy.stats
-from sklearn.linear_model import LinearRegression
 
+from .diagnostics import binned_stats
 
-matplotlib.style.use('classic')
-plt.rcParams['axes.prop_cycle'] = plt.cycler('color', 'bgrcmyk')
-matplotlib.rcParams['savefig.dpi'] = 60
-matplotlib.rcParams['figure.dpi'] = 60
+
+_style_applied = False
+
+
+def pyplot():
+    """matplotlib.pyplot, imported on first use with our plot style applied.
+
+    Importing matplotlib takes a good part of a second, so it is not done at import time
+    of this module.
+    """
+    global _style_applied
+    import matplotlib
+    import matplotlib.pyplot as plt
+
+    if not _style_applied:
+        matplotlib.style.use('classic')
+        plt.rcParams['axes.prop_cycle'] = plt.cycler('color', 'bgrcmyk')
+        matplotlib.rcParams['savefig.dpi'] = 60
+        matplotlib.rcParams['figure.dpi'] = 60
+        _style_applied = True
+    return plt
 
 
 def get_existing_twin_axis(ax):
@@ -28,6 +42,7 @@ def default_axis(axis=None, figsize=(16, 10), axes_shape=(1, 1),
                  add_grid=True, title=None, xlabel=None, ylabel=None,
                  facecolor=None, facecolor_fig=None, show_lims_without_offset=False, plot_zero_line=False,
                  save_fname=None):
+    plt = pyplot()
     if axis is None:
         fig, axis = plt.subplots(*axes_shape, figsize=figsize)
         if facecolor_fig:
@@ -68,7 +83,8 @@ def default_axis(axis=None, figsize=(16, 10), axes_shape=(1, 1),
             ax.axhline(0, c='k', ls='--')
 
         if show_lims_without_offset:
-            formatter = matplotlib.ticker.ScalarFormatter(useOffset=False)
+            from matplotlib.ticker import ScalarFormatter
+            formatter = ScalarFormatter(useOffset=False)
             ax.yaxis.set_major_formatter(formatter)
             ax.xaxis.set_major_formatter(formatter)
 
@@ -77,33 +93,38 @@ def default_axis(axis=None, figsize=(16, 10), axes_shape=(1, 1),
 
 
 def binned_plot(x_t, y_t, n_bins=101, color="blue", **kwargs):
-    with default_axis(add_twinx_legend=True, **kwargs) as axis:
-        x_t = x_t.copy()
-        y_t = y_t.copy()
-        at_least_one_nan_t = (np.isnan(x_t) | np.isnan(y_t))
-        x_t = x_t[~at_least_one_nan_t]
-        y_t = y_t[~at_least_one_nan_t]
+    plot_binned_stats(binned_stats(x_t, y_t, n_bins), color=color, **kwargs)
 
-        y_mean_T, bin_edges_T, _ = scipy.stats.binned_statistic(x_t, y_t,  statistic="mean", bins=n_bins)
-        bin_edges_T = 0.5 * (bin_edges_T[1:] + bin_edges_T[:-1])
-        y_std_T  = scipy.stats.binned_statistic(x_t, y_t, statistic="std", bins=n_bins)[0]
 
-        y_std_T /= np.sqrt(scipy.stats.binned_statistic(x_t, y_t, statistic="count", bins=n_bins)[0])
+def plot_binned_stats(stats, color="blue", **kwargs):
+    """Binned means with their standard errors, the regression line and the histogram of x.
 
-        clf = LinearRegression()
-        clf.fit(x_t[:, None], y_t)
+    Args:
+        stats: Output of src.diagnostics.binned_stats, None (a constant or empty feature)
+            gives an empty axis with a note
+    """
+    if stats is None:
+        with default_axis(**kwargs) as axis:
+            axis.text(0.5, 0.5, "constant or no valid values, nothing to bin", ha="center", va="center",
+                      transform=axis.transAxes)
+        return
+
+    with default_axis(add_twinx_legend=True, **kwargs) as axis:
+        centers = stats["centers"]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            y_err = stats["std"] / np.sqrt(stats["count"])
 
-        rho = np.corrcoef(x_t, y_t)[0][1]
-        label = "y = %.3f x + %.3f;\n" % (clf.coef_[0],clf.intercept_)
-        label += f"rho = {rho:.3f}; t-stat = {rho * np.sqrt(x_t.size):.2f}"
-        axis.plot(bin_edges_T, clf.intercept_ + clf.coef_[0] * bin_edges_T,
+        label = "y = %.3f x + %.3f;\n" % (stats["slope"], stats["intercept"])
+        label += f"rho = {stats['rho']:.3f}; t-stat = {stats['t_stat']:.2f}"
+        axis.plot(centers, stats["intercept"] + stats["slope"] * centers,
                 color=color, label=label)
 
-        axis.errorbar(bin_edges_T, y_mean_T, y_std_T, fmt="o", color=color)
+        axis.errorbar(centers, stats["mean"], y_err, fmt="o", color=color)
         twin_axis = axis.twinx()
-        twin_axis.hist(x_t, bins=n_bins, histtype="step", color=color,
-                    density=True, log=True, label="mu=%.3f, sigma=%.3f" % (x_t.mean(), x_t.std()))
+        # The histogram of x, from the bin counts
+        twin_axis.hist(centers, bins=stats["edges"], weights=stats["count"], histtype="step", color=color,
+                    density=True, log=True, label="mu=%.3f, sigma=%.3f" % (stats["x_mean"], stats["x_std"]))
         twin_axis.set_ylabel("pdf")
 
         axis.legend(loc="upper left")
-        twin_axis.legend(loc="upper right")
\ No newline at end of file
+        twin_axis.legend(loc="upper right")
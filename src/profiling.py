@@ -0,0 +1,72 @@
+import contextlib
+import json
+import os
+import time
+from typing import Iterator, Optional
+
+
+# Environment variable with the file that stage events are appended to as JSON lines,
+# see scripts/check_budget.py
+STAGE_LOG_ENV = 'STAGE_LOG'
+
+# Stages currently open in this process, rows read by src.data are counted into all of them
+_open_stages = []
+
+
+def rss_mb(pid: Optional[int] = None) -> float:
+    """Current resident memory of a process in MB, 0 if it is gone."""
+    try:
+        with open(f'/proc/{pid or "self"}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except (FileNotFoundError, ProcessLookupError):
+        pass
+    return 0.0
+
+
+def count_rows(n_rows: int):
+    """Add rows read from an input table to the open stages."""
+    for st in _open_stages:
+        st['rows'] += n_rows
+
+
+def _log_event(event: dict):
+    fn = os.environ.get(STAGE_LOG_ENV)
+    if not fn:
+        return
+    # Single short lines opened in append mode, so processes running in parallel do not mix
+    with open(fn, 'a') as f:
+        f.write(json.dumps(event) + '\n')
+
+
+def log_stats(name: str, stats: dict):
+    """Record statistics that are not a stage, e.g. of the prefetcher, to the stage log."""
+    _log_event({'event': 'stats', 'name': name, 'pid': os.getpid(), 'time': time.time(), **stats})
+
+
+@contextlib.contextmanager
+def stage(name: str) -> Iterator[dict]:
+    """Time a stage of the build and record it to the stage log, if one is set.
+
+    Rows read with read_table / iter_table inside the stage are counted, other row counts
+    can be added to the yielded dict.
+
+        with stage('BalanceFtExtractor') as st:
+            features = extractor.load_transform()
+
+    Args:
+        name: Name of the stage, e.g. the extractor class
+
+    Yields:
+        st: The stage record with name, pid, start, rows and (after it ends) seconds
+    """
+    st = {'name': name, 'pid': os.getpid(), 'start': time.time(), 'rows': 0}
+    _open_stages.append(st)
+    _log_event({'event': 'start', **st})
+    try:
+        yield st
+    finally:
+        _open_stages.remove(st)
+        st['seconds'] = time.time() - st['start']
+        _log_event({'event': 'end', **st, 'end': time.time(), 'rss_mb': rss_mb()})
@@ -0,0 +1,120 @@
+"""Build only the features a saved model uses.
+
+A full build records the output columns of every extractor in a layout file. BuildPlan
+combines that layout with the feature importances of a CatBoost model: extractors without
+any used column are skipped, the others keep only the used columns (extractors built on
+AggSpecs only aggregate those). The assembled matrix has the columns of the full build, in
+the same order, columns that were not computed are NaN ('nan' for categorical features).
+
+A feature with zero importance is never used by a split of the model, so its value does
+not change the predictions.
+"""
+import json
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+
+# Output columns of every extractor of the last full build
+LAYOUT_FN = 'feature_layout.json'
+
+
+def save_layout(layout: Dict[str, List[str]], fn: str = LAYOUT_FN):
+    with open(fn, 'w') as f:
+        json.dump(layout, f, indent=1)
+
+
+def load_layout(fn: str = LAYOUT_FN) -> Dict[str, List[str]]:
+    with open(fn) as f:
+        return json.load(f)
+
+
+class SkippedExtractor:
+    """Stands in for an extractor none of whose columns are needed, its block has no rows."""
+    MEM_FACTOR = 0.0
+
+    def __init__(self, extractor, columns: List[str]):
+        self._fn = extractor._fn
+        self._columns = list(columns)
+
+    def load_transform(self):
+        index = pd.Index(np.zeros(0, dtype='int64'), name='client_id')
+        return pd.DataFrame({col: np.zeros(0, dtype='float32') for col in self._columns}, index=index)
+
+
+class BuildPlan:
+    def __init__(self, layout: Dict[str, List[str]], needed, cat_features: List[str] = ()):
+        """
+        Args:
+            layout: Output columns of every extractor, by class name
+            needed: Columns to compute
+            cat_features: Categorical features, skipped ones are filled with 'nan'
+        """
+        self.layout = layout
+        self.needed = set(needed)
+        self.cat_features = list(cat_features)
+
+        columns = {col for cols in layout.values() for col in cols}
+        unknown = self.needed - columns
+        if unknown:
+            raise ValueError(f'Columns not in the layout of the full build: {sorted(unknown)}')
+
+    @classmethod
+    def from_model(cls, model_fn: str, layout_fn: str = LAYOUT_FN, min_importance: float = 0.0):
+        """Plan the columns a saved CatBoost model uses.
+
+        Args:
+            model_fn: Saved model (.cbm)
+            layout_fn: Layout recorded by a full build
+            min_importance: Columns with an importance up to this are skipped. Anything above
+                0 also skips columns the model uses, so predictions change slightly
+        """
+        # Only imported here, a full build does not need catboost
+        from catboost import CatBoost
+
+        model = CatBoost().load_model(model_fn)
+        names = model.feature_names_
+        importances = model.get_feature_importance()
+        needed = [name for name, imp in zip(names, importances) if imp > min_importance]
+        cat_features = [names[i] for i in model.get_cat_feature_indices()]
+        return cls(load_layout(layout_fn), needed, cat_features)
+
+    def skipped(self) -> List[str]:
+        return [col for cols in self.layout.values() for col in cols if col not in self.needed]
+
+    def prune(self, extractors: list) -> list:
+        """Extractors to run instead of the given ones, pass the result to run_extractors.
+
+        Extractors the layout does not know are run in full.
+        """
+        pruned = []
+        for extractor in extractors:
+            columns = self.layout.get(type(extractor).__name__)
+            if columns is None:
+                pruned.append(extractor)
+                continue
+            needed = [col for col in columns if col in self.needed]
+            if not needed:
+                pruned.append(SkippedExtractor(extractor, columns))
+                continue
+            extractor._columns = columns
+            extractor._needed = needed
+            pruned.append(extractor)
+        return pruned
+
+    def finish(self, features: pd.DataFrame) -> pd.DataFrame:
+        """Fill the skipped categorical features of the assembled matrix."""
+        skipped = set(self.skipped())
+        for col in self.cat_features:
+            if col in skipped and col in features:
+                features[col] = 'nan'
+        return features
+
+    def explain(self) -> str:
+        lines = []
+        for name, columns in self.layout.items():
+            n_needed = sum(col in self.needed for col in columns)
+            status = 'skipped' if n_needed == 0 else f'{n_needed}/{len(columns)} columns'
+            lines.append(f'{name}: {status}')
+        return '\n'.join(lines)
@@ -0,0 +1,144 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+
+# Narrowest intended dtype of every column of the input tables described in PROBLEM.md.
+# Integer columns are widened if the values in a file do not fit (see narrow_column),
+# columns that are not listed (free text such as tran_time or tsp_name) keep pandas defaults.
+SCHEMAS = {
+    'balance': {
+        'client_id': 'int32',
+        'prod_cat_nanme': 'category',
+        'prod_group_name': 'category',
+        'crncy_cd': 'int16',
+        'eop_bal_sum_rur': 'float32',
+        'min_bal_sum_rur': 'float32',
+        'max_bal_sum_rur': 'float32',
+        'avg_bal_sum_rur': 'float32',
+        'month_end_dt': 'category',
+    },
+    'aum': {
+        'client_id': 'int32',
+        'month_end_dt': 'category',
+        'product_code': 'category',
+        'balance_rur_amt': 'float32',
+    },
+    'trxn': {
+        'client_id': 'int32',
+        'card_id': 'int32',
+        'tran_amt_rur': 'float32',
+        'mcc_cd': 'int16',
+        'merchant_cd': 'int32',
+        'txn_country': 'category',
+        'txn_city': 'category',
+        'txn_comment_1': 'category',
+        'txn_comment_2': 'category',
+    },
+    'payments': {
+        'client_id': 'int32',
+        'day_dt': 'category',
+        'sum_rur': 'float32',
+        'pmnts_name': 'category',
+    },
+    'com': {
+        'client_id': 'int32',
+        'channel': 'category',
+        'prod': 'category',
+        'agr_flg': 'int8',
+        'otkaz': 'int8',
+        'dumaet': 'int8',
+        'ring_up_flg': 'int16',
+        'not_ring_up_flg': 'int16',
+        'count_comm': 'int16',
+    },
+    'client': {
+        'client_id': 'int32',
+        'gender': 'category',
+        'age': 'int8',
+        'region': 'int32',
+        'city': 'int32',
+        'education': 'category',
+        'citizenship': 'category',
+        'job_type': 'category',
+    },
+    'funnel': {
+        'client_id': 'int32',
+        'sale_flg': 'int8',
+        'sale_amount': 'float32',
+        'contacts': 'int16',
+        'client_segment': 'int16',
+        'region_cd': 'int16',
+        'feature_1': 'int16',
+        **{f'feature_{i}': 'float32' for i in range(2, 11)},
+    },
+    'deals': {
+        'client_id': 'int32',
+        'prod_type_name': 'category',
+        'agrmnt_start_dt': 'category',
+        'agrmnt_close_dt': 'category',
+        'crncy_cd': 'int16',
+        'agrmnt_rate_active': 'float32',
+        'agrmnt_rate_passive': 'float32',
+        'agrmnt_sum_rur': 'float32',
+    },
+    'dict_mcc': {
+        'mcc_cd': 'int16',
+        'brs_mcc_group': 'category',
+        'brs_mcc_subgroup': 'category',
+    },
+}
+
+# Largest integer that float32 represents exactly
+_FLOAT32_MAX_INT = 2 ** 24
+
+
+def table_name(fn: str) -> str:
+    """Name of the table in SCHEMAS that a file holds, e.g. 'data/trxn.csv' -> 'trxn'."""
+    return os.path.splitext(os.path.basename(fn))[0]
+
+
+def narrow_column(values: pd.Series, dtype: str) -> pd.Series:
+    """Cast a column to the schema dtype, widening it if that would lose information.
+
+    Integer columns with missing values become float32 (or float64 if the values are too
+    large to be exact in float32), integers out of range of the dtype stay int64.
+    """
+    if dtype == 'category':
+        return values.astype('category')
+
+    if not pd.api.types.is_numeric_dtype(values):
+        return values
+
+    if dtype.startswith('float'):
+        return values.astype(dtype)
+
+    if values.isna().any():
+        max_abs = np.nanmax(np.abs(values.to_numpy(dtype='float64'))) if values.notna().any() else 0
+        return values.astype('float32' if max_abs < _FLOAT32_MAX_INT else 'float64')
+
+    if not (values.round() == values).all():
+        return values
+
+    info = np.iinfo(dtype)
+    if len(values) and (values.min() < info.min or values.max() > info.max):
+        return values.astype('int64')
+    return values.astype(dtype)
+
+
+def apply_schema(df: pd.DataFrame, table: str) -> pd.DataFrame:
+    """Cast the columns of a table to the compact dtypes from SCHEMAS.
+
+    Args:
+        df: The table, as parsed by pd.read_csv
+        table: Name of the table in SCHEMAS, tables without a schema are returned unchanged
+
+    Returns:
+        df: The table with compact dtypes
+    """
+    schema = SCHEMAS.get(table, {})
+    for col in df.columns:
+        if col in schema:
+            df[col] = narrow_column(df[col], schema[col])
+    return df
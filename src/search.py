@@ -0,0 +1,220 @@
+"""Successive-halving and Hyperband hyperparameter search, scored by profit.
+
+Many configurations are trained with a small number of iterations, the best 1/eta of them
+by mean profit at the best threshold (profit_curve) are trained again with eta times more
+iterations, and so on up to the full budget. Every finished trial is appended to a JSONL
+log, a search started again with the same log skips the trials it already has. Trials are
+only reused by a search on the same pool, split, validation rows and base parameters.
+"""
+import hashlib
+import itertools
+import json
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from catboost import Pool
+
+from .pipeline import available_cpus
+from .training import load_pool, predict_scores, val_rows
+from .utils import profit_curve
+
+
+SEARCH_LOG = 'search_log.jsonl'
+
+# Part of search_id, bumped when trials are trained or scored differently
+TRIAL_VERSION = 2
+
+
+def config_id(params: dict) -> str:
+    return hashlib.sha1(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()[:12]
+
+
+def search_id(model_cls, base_params: dict, pool_path: str, train_idx: np.ndarray, val_idx: np.ndarray,
+              val_df: pd.DataFrame) -> str:
+    """Hash of everything a trial's profit depends on besides its configuration and iterations.
+
+    The pool path holds a hash of the pool's data (see src.training.data_key).
+    """
+    h = hashlib.sha1(json.dumps([TRIAL_VERSION, model_cls.__name__, base_params, os.path.basename(pool_path)],
+                                sort_keys=True, default=str).encode())
+    h.update(np.ascontiguousarray(train_idx, dtype='int64').tobytes())
+    h.update(np.ascontiguousarray(val_idx, dtype='int64').tobytes())
+    h.update(pd.util.hash_pandas_object(val_df, index=False).to_numpy().tobytes())
+    return h.hexdigest()[:12]
+
+
+def sample_configs(space: Dict[str, list], n: int, seed: int = 42) -> List[dict]:
+    """n distinct configurations drawn from a grid, all of them if the grid is smaller.
+
+    Args:
+        space: Values of every parameter, like the grid of CatBoost's grid_search
+        n: Number of configurations
+        seed: Random seed
+    """
+    names = sorted(space)
+    grid = list(itertools.product(*(space[name] for name in names)))
+    rng = np.random.default_rng(seed)
+    picked = rng.permutation(len(grid))[:n]
+    return [dict(zip(names, grid[i])) for i in sorted(picked)]
+
+
+def read_log(fn: str, search: Optional[str] = None) -> Dict[tuple, dict]:
+    """Finished trials of a search log by (config id, iterations).
+
+    Args:
+        fn: Search log
+        search: Only the trials of this search_id, trials of other data, splits or base
+            parameters are not reused
+    """
+    trials = {}
+    if not os.path.exists(fn):
+        return trials
+    with open(fn) as f:
+        for line in f:
+            line = line.strip()
+            # The last line may be cut short if the search was killed while writing it
+            try:
+                trial = json.loads(line)
+            except ValueError:
+                continue
+            if search is not None and trial.get('search_id') != search:
+                continue
+            trials[(trial['config_id'], trial['iterations'])] = trial
+    return trials
+
+
+def _run_trial(model_cls, params: dict, pool_path: str, cat_features: List[str],
+               train_idx: np.ndarray, val_idx: np.ndarray, val_df: pd.DataFrame) -> dict:
+    start = time.time()
+    pool = load_pool(pool_path)
+    model = model_cls(**params)
+    # No eval set: the validation rows only score the trial, they do not pick its best
+    # iteration, so a rung is promoted on predictions that were not tuned on them
+    model.fit(pool.slice(train_idx.tolist()), verbose=False)
+
+    pred = predict_scores(model, Pool(data=val_rows(pool_path, val_idx), cat_features=cat_features))
+    _, _, threshold, profit = profit_curve(pred, val_df)
+    return {
+        'profit': float(profit),
+        'threshold': float(threshold),
+        'seconds': round(time.time() - start, 1),
+    }
+
+
+def successive_halving(model_cls,
+                       base_params: dict,
+                       configs: List[dict],
+                       pool_path: str,
+                       cat_features: List[str],
+                       train_idx: np.ndarray,
+                       val_idx: np.ndarray,
+                       val_df: pd.DataFrame,
+                       min_iterations: int = 100,
+                       max_iterations: int = 1500,
+                       eta: int = 3,
+                       n_jobs: Optional[int] = None,
+                       log_fn: str = SEARCH_LOG,
+                       bracket: int = 0) -> List[dict]:
+    """Train configurations with growing iteration budgets, keeping the best 1/eta of every rung.
+
+    Args:
+        model_cls: CatBoostRegressor or CatBoostClassifier
+        base_params: Parameters shared by all configurations, iterations is set per rung
+        configs: Configurations to search, each updates base_params
+        pool_path: Quantized pool from src.training.quantized_pool
+        cat_features: Categorical feature columns
+        train_idx: Rows of the pool to train on
+        val_idx: Rows of the pool to score
+        val_df: Columns needed by calculate_profit for the val_idx rows, in their order
+        min_iterations: Budget of the first rung
+        max_iterations: Budget of the last rung
+        eta: Only the best 1/eta of a rung are promoted, with eta times the iterations
+        n_jobs: Number of trials trained at once, the number of CPUs if None
+        log_fn: JSONL log of finished trials, trials already in it with the same model class,
+            base_params, pool, split and val_df (see search_id) are not trained again
+        bracket: Written to the log, to tell Hyperband brackets apart
+
+    Returns:
+        trials: The trials of the last rung, best profit first
+    """
+    n_jobs = n_jobs or available_cpus()
+    search = search_id(model_cls, base_params, pool_path, train_idx, val_idx, val_df)
+    done = read_log(log_fn, search)
+
+    survivors = list(configs)
+    iterations = min_iterations
+    rung = 0
+    while True:
+        iterations = min(iterations, max_iterations)
+        tasks = {}
+        trials = []
+        for params in survivors:
+            cid = config_id(params)
+            if (cid, iterations) in done:
+                trials.append(done[(cid, iterations)])
+                continue
+            full = dict(base_params, **params, iterations=iterations)
+            full.setdefault('thread_count', max(available_cpus() // n_jobs, 1))
+            tasks[cid] = (params, full)
+
+        if tasks:
+            with ProcessPoolExecutor(max_workers=n_jobs) as executor, open(log_fn, 'a') as log:
+                futures = {
+                    executor.submit(_run_trial, model_cls, full, pool_path, cat_features,
+                                    train_idx, val_idx, val_df): (cid, params)
+                    for cid, (params, full) in tasks.items()
+                }
+                for future in as_completed(futures):
+                    cid, params = futures[future]
+                    trial = {'search_id': search, 'config_id': cid, 'params': params, 'iterations': iterations,
+                             'rung': rung, 'bracket': bracket, **future.result()}
+                    log.write(json.dumps(trial) + '\n')
+                    log.flush()
+                    trials.append(trial)
+
+        trials.sort(key=lambda t: t['profit'], reverse=True)
+        if iterations >= max_iterations or len(trials) <= 1:
+            return trials
+        survivors = [t['params'] for t in trials[:max(len(trials) // eta, 1)]]
+        iterations *= eta
+        rung += 1
+
+
+def hyperband(model_cls,
+              base_params: dict,
+              space: Dict[str, list],
+              pool_path: str,
+              cat_features: List[str],
+              train_idx: np.ndarray,
+              val_idx: np.ndarray,
+              val_df: pd.DataFrame,
+              min_iterations: int = 100,
+              max_iterations: int = 1500,
+              eta: int = 3,
+              n_jobs: Optional[int] = None,
+              log_fn: str = SEARCH_LOG,
+              seed: int = 42) -> List[dict]:
+    """Successive halving brackets from many configurations on small budgets to few on the full budget.
+
+    Arguments as for successive_halving, with the configurations drawn from space.
+
+    Returns:
+        trials: The final trials of all brackets, best profit first
+    """
+    s_max = int(math.log(max_iterations / min_iterations, eta) + 1e-9)
+    results = []
+    for s in range(s_max, -1, -1):
+        n = int(math.ceil((s_max + 1) / (s + 1) * eta ** s))
+        configs = sample_configs(space, n, seed=seed + s)
+        results += successive_halving(model_cls, base_params, configs, pool_path, cat_features,
+                                      train_idx, val_idx, val_df,
+                                      min_iterations=max_iterations // eta ** s,
+                                      max_iterations=max_iterations, eta=eta, n_jobs=n_jobs,
+                                      log_fn=log_fn, bracket=s)
+    results.sort(key=lambda t: t['profit'], reverse=True)
+    return results
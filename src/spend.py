@@ -0,0 +1,226 @@
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from .data import iter_table, read_table
+
+
+# Transactions in other countries count as spend abroad
+HOME_COUNTRY = 'RUS'
+
+# MCC code of transactions without one
+MISSING_MCC = -1
+
+# Client ids are packed with the MCC code into one int64 key, MCC codes have 4 digits
+_MCC_BITS = 16
+
+
+def _group_keys(keys: np.ndarray, *weights: np.ndarray) -> Tuple[np.ndarray, ...]:
+    """Sum weights over equal keys, returns the unique keys and the sums."""
+    uniques, inverse = np.unique(keys, return_inverse=True)
+    return (uniques,) + tuple(np.bincount(inverse, weights=w, minlength=len(uniques)) for w in weights)
+
+
+def _row_segments(matrix: sp.csr_matrix) -> np.ndarray:
+    """Row of every stored value of a CSR matrix."""
+    return np.repeat(np.arange(matrix.shape[0]), np.diff(matrix.indptr))
+
+
+class ClientMccMatrix:
+    """Spend and number of transactions per client and MCC, as sparse client x MCC matrices.
+
+    A client only uses a few dozen of the hundreds of MCC codes, so CSR matrices hold the
+    whole spend distribution in O(clients * used codes) memory, where a dense pivot would
+    need O(clients * all codes).
+    """
+
+    def __init__(self,
+                 clients: np.ndarray,
+                 mccs: np.ndarray,
+                 spend: sp.csr_matrix,
+                 counts: sp.csr_matrix,
+                 abroad_spend: np.ndarray):
+        """
+        Args:
+            clients: Client id of every row
+            mccs: MCC code of every column, MISSING_MCC for transactions without one
+            spend: Sum of tran_amt_rur per client and MCC
+            counts: Number of transactions per client and MCC
+            abroad_spend: Spend outside HOME_COUNTRY of every client
+        """
+        self.clients = clients
+        self.mccs = mccs
+        self.spend = spend
+        self.counts = counts
+        self.abroad_spend = abroad_spend
+
+    @classmethod
+    def from_table(cls, fn: str, chunksize: Optional[int] = None, home_country: str = HOME_COUNTRY):
+        """Build the matrices in one pass over trxn.csv.
+
+        Args:
+            fn: Path to trxn.csv
+            chunksize: Stream the table in chunks of this many rows, load it whole if None
+            home_country: Transactions in other countries count as abroad
+        """
+        columns = ['client_id', 'tran_amt_rur', 'mcc_cd', 'txn_country']
+        if chunksize is None:
+            chunks = [read_table(fn, columns=columns)]
+        else:
+            chunks = iter_table(fn, columns=columns, chunksize=chunksize)
+
+        # Partial sums per (client, mcc) key, folded whenever they outgrow a chunk
+        keys, spend, counts, abroad = [], [], [], []
+        n_pending = 0
+        for chunk in chunks:
+            client_id = chunk['client_id'].to_numpy(dtype='int64')
+            mcc = chunk['mcc_cd'].fillna(MISSING_MCC).to_numpy(dtype='int64')
+            amount = chunk['tran_amt_rur'].fillna(0).to_numpy(dtype='float64')
+            is_abroad = chunk['txn_country'].notna().to_numpy() & (chunk['txn_country'] != home_country).to_numpy()
+
+            part = _group_keys((client_id << _MCC_BITS) | (mcc - MISSING_MCC),
+                               amount, np.ones(len(chunk)), np.where(is_abroad, amount, 0))
+            for acc, values in zip([keys, spend, counts, abroad], part):
+                acc.append(values)
+            n_pending += len(part[0])
+            del chunk, client_id, mcc, amount, is_abroad
+
+            if chunksize is not None and n_pending > chunksize:
+                keys, spend, counts, abroad = [[a] for a in _group_keys(
+                    np.concatenate(keys), np.concatenate(spend), np.concatenate(counts), np.concatenate(abroad))]
+                n_pending = len(keys[0])
+
+        keys, spend, counts, abroad = _group_keys(
+            np.concatenate(keys) if keys else np.zeros(0, 'int64'),
+            *[np.concatenate(a) if a else np.zeros(0) for a in [spend, counts, abroad]])
+
+        clients, rows = np.unique(keys >> _MCC_BITS, return_inverse=True)
+        mccs, cols = np.unique((keys & (2**_MCC_BITS - 1)) + MISSING_MCC, return_inverse=True)
+        shape = (len(clients), len(mccs))
+        return cls(clients,
+                   mccs,
+                   sp.csr_matrix((spend, (rows, cols)), shape=shape),
+                   sp.csr_matrix((counts.astype('int32'), (rows, cols)), shape=shape),
+                   np.bincount(rows, weights=abroad, minlength=len(clients)))
+
+    def merge(self, other: 'ClientMccMatrix') -> 'ClientMccMatrix':
+        """Sum of two matrices, e.g. of the history so far and of a new month of transactions."""
+        clients = np.union1d(self.clients, other.clients)
+        mccs = np.union1d(self.mccs, other.mccs)
+
+        rows, cols, spend, counts = [], [], [], []
+        for m in (self, other):
+            coo_rows = _row_segments(m.spend)
+            rows.append(np.searchsorted(clients, m.clients)[coo_rows])
+            cols.append(np.searchsorted(mccs, m.mccs)[m.spend.indices])
+            spend.append(m.spend.data)
+            counts.append(m.counts.data)
+        rows, cols = np.concatenate(rows), np.concatenate(cols)
+
+        abroad = np.zeros(len(clients))
+        for m in (self, other):
+            abroad[np.searchsorted(clients, m.clients)] += m.abroad_spend
+
+        # Both matrices are built from the same coordinates, so they keep sharing their structure
+        shape = (len(clients), len(mccs))
+        return ClientMccMatrix(clients,
+                               mccs,
+                               sp.csr_matrix((np.concatenate(spend), (rows, cols)), shape=shape),
+                               sp.csr_matrix((np.concatenate(counts), (rows, cols)), shape=shape),
+                               abroad)
+
+    @property
+    def total_spend(self) -> np.ndarray:
+        return np.asarray(self.spend.sum(axis=1)).ravel()
+
+    @property
+    def total_count(self) -> np.ndarray:
+        return np.asarray(self.counts.sum(axis=1)).ravel()
+
+    def shares(self, matrix: Optional[sp.csr_matrix] = None) -> sp.csr_matrix:
+        """Share of every column in the client's total (spend by default), 0 for clients without spend."""
+        matrix = self.spend if matrix is None else matrix
+        totals = np.asarray(matrix.sum(axis=1)).ravel()
+        with np.errstate(divide='ignore'):
+            inv = np.where(totals != 0, 1 / totals, 0)
+        return sp.csr_matrix(sp.diags(inv) @ matrix)
+
+    def rollup(self, mcc_labels: Dict[int, str], unknown: str = 'unknown') -> Tuple[np.ndarray, sp.csr_matrix]:
+        """Sum the spend of MCC codes with the same label, e.g. brs_mcc_group of dict_mcc.csv.
+
+        Args:
+            mcc_labels: Label of every MCC code
+            unknown: Label of codes that have none
+
+        Returns:
+            (labels, spend): Labels of the columns and client x label spend
+        """
+        mcc_label = np.array([mcc_labels.get(mcc, unknown) for mcc in self.mccs], dtype=object)
+        labels, cols = np.unique(mcc_label.astype('str'), return_inverse=True)
+        indicator = sp.csr_matrix((np.ones(len(self.mccs)), (np.arange(len(self.mccs)), cols)),
+                                  shape=(len(self.mccs), len(labels)))
+        return labels, sp.csr_matrix(self.spend @ indicator)
+
+    def top_k(self, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """The k MCC codes with the highest spend of every client.
+
+        Returns:
+            (mccs, shares): [n_clients, k] arrays of codes and their spend shares, padded with
+                MISSING_MCC and NaN for clients with fewer codes
+        """
+        shares = self.shares()
+        rows = _row_segments(shares)
+
+        # Sort the stored values by client, then by spend descending
+        order = np.lexsort((-shares.data, rows))
+        rank = np.arange(len(order)) - shares.indptr[rows[order]]
+        keep = rank < k
+
+        top_mccs = np.full((shares.shape[0], k), MISSING_MCC, dtype='int64')
+        top_shares = np.full((shares.shape[0], k), np.nan)
+        top_mccs[rows[order][keep], rank[keep]] = self.mccs[shares.indices[order][keep]]
+        top_shares[rows[order][keep], rank[keep]] = shares.data[order][keep]
+        return top_mccs, top_shares
+
+    def entropy(self, matrix: Optional[sp.csr_matrix] = None) -> np.ndarray:
+        """Entropy (in nats) of every client's spend distribution over the columns."""
+        shares = self.shares(matrix)
+        p = shares.data[shares.data > 0]
+        rows = _row_segments(shares)[shares.data > 0]
+        return -np.bincount(rows, weights=p * np.log(p), minlength=shares.shape[0])
+
+    def abroad_share(self) -> np.ndarray:
+        totals = self.total_spend
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(totals != 0, self.abroad_spend / totals, np.nan)
+
+    def frame(self, prefix: str = 'trxn_spend_mcc_') -> pd.DataFrame:
+        """The spend matrix as a client_id indexed frame with sparse columns, one per MCC code."""
+        return pd.DataFrame.sparse.from_spmatrix(
+            self.spend.astype('float32'),
+            index=pd.Index(self.clients, name='client_id'),
+            columns=[f'{prefix}{mcc}' for mcc in self.mccs])
+
+    def save(self, fn: str):
+        """Store the matrices as one compressed .npz block."""
+        np.savez_compressed(fn,
+                            clients=self.clients,
+                            mccs=self.mccs,
+                            indptr=self.spend.indptr,
+                            indices=self.spend.indices,
+                            spend=self.spend.data,
+                            counts=self.counts.data,
+                            abroad_spend=self.abroad_spend)
+
+    @classmethod
+    def load(cls, fn: str):
+        z = np.load(fn)
+        shape = (len(z['clients']), len(z['mccs']))
+        structure = (z['indices'], z['indptr'])
+        return cls(z['clients'],
+                   z['mccs'],
+                   sp.csr_matrix((z['spend'],) + structure, shape=shape),
+                   sp.csr_matrix((z['counts'],) + structure, shape=shape),
+                   z['abroad_spend'])
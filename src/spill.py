@@ -0,0 +1,112 @@
+import os
+import shutil
+import tempfile
+from typing import Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .profiling import rss_mb
+
+
+# Spill files go to a temporary directory in here, the system default if not set
+SPILL_DIR = os.environ.get('SPILL_DIR') or None
+
+# Resident memory above which finished blocks and large arrays are moved to disk
+HIGH_WATER_MB = 1024
+
+
+class SpillStore:
+    """Moves finished feature blocks and large intermediates to memory-mapped files.
+
+    Once the process is over the high-water mark, the float columns of a block are written
+    to a column-major .npy file and the block is replaced by a frame backed by a read-only
+    memmap of that file. Its pages are only read back when the block is used (at assembly)
+    and, being clean file pages, the OS can drop them again under memory pressure.
+
+        with SpillStore(high_water_mb=1024) as spill:
+            features = run_extractors(extractors, index=index, spill=spill)
+            save_features(features, 'final_version.features')
+
+    The files are removed when the store is closed.
+    """
+
+    def __init__(self, high_water_mb: float = HIGH_WATER_MB, directory: Optional[str] = SPILL_DIR):
+        """
+        Args:
+            high_water_mb: Spill once the resident memory is over this, 0 to always spill
+            directory: Where to create the spill directory
+        """
+        self._high_water_mb = high_water_mb
+        self._dir = tempfile.mkdtemp(prefix='spill-', dir=directory)
+        self._n_files = 0
+
+        #: Number of blocks and arrays moved to disk and their size
+        self.n_spilled = 0
+        self.spilled_mb = 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        # Files of memmaps that are still referenced stay readable until they are unmapped
+        shutil.rmtree(self._dir, ignore_errors=True)
+
+    def over_high_water(self, extra_mb: float = 0) -> bool:
+        return rss_mb() + extra_mb > self._high_water_mb
+
+    def _new_path(self) -> str:
+        self._n_files += 1
+        return os.path.join(self._dir, f'{self._n_files}.npy')
+
+    def array(self, shape: Tuple[int, ...], dtype, fill_value=0) -> np.ndarray:
+        """A new filled array, memory-mapped from a spill file if it would go over the high-water mark."""
+        nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        if not self.over_high_water(nbytes / 2**20):
+            return np.full(shape, fill_value, dtype=dtype)
+
+        arr = np.lib.format.open_memmap(self._new_path(), mode='w+', dtype=dtype, shape=shape)
+        arr[...] = fill_value
+        self.n_spilled += 1
+        self.spilled_mb += nbytes / 2**20
+        return arr
+
+    def spill(self, block: pd.DataFrame) -> pd.DataFrame:
+        """Write the float columns of a block to disk and return a frame backed by them.
+
+        Only columns of the most common float dtype are spilled, into one matrix, since a
+        frame can only be built on a single 2D array without copying it. Other columns,
+        usually a few categoricals, stay in memory.
+        """
+        columns = list(block.columns)
+        float_dtypes = [block[col].dtype for col in columns if block[col].dtype.kind == 'f']
+        if not float_dtypes:
+            return block
+        dtype = max(set(float_dtypes), key=float_dtypes.count)
+        spilled = [col for col in columns if block[col].dtype == dtype]
+
+        path = self._new_path()
+        matrix = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=(len(spilled), len(block)))
+        for i, col in enumerate(spilled):
+            matrix[i] = block[col].to_numpy()
+        matrix.flush()
+        del matrix
+        self.n_spilled += 1
+        self.spilled_mb += len(spilled) * len(block) * dtype.itemsize / 2**20
+
+        # The transposed column-major matrix becomes the frame's block without a copy
+        matrix = np.load(path, mmap_mode='r')
+        frame = pd.DataFrame(matrix.T, index=block.index, columns=spilled, copy=False)
+        for loc, col in enumerate(columns):
+            if col not in spilled:
+                frame.insert(loc, col, block[col])
+        return frame
+
+    def maybe_spill(self, block: pd.DataFrame) -> pd.DataFrame:
+        """Spill the block if the process is over the high-water mark."""
+        if self.over_high_water():
+            return self.spill(block)
+        return block
@@ -0,0 +1,257 @@
+"""Synthetic input tables with the columns of PROBLEM.md, for benchmarking without the bank's data.
+
+    python -m src.synthetic bench_data/x1 --clients 10000 --trxn-per-client 50 --months 12
+"""
+import argparse
+import os
+from typing import Iterator
+
+import numpy as np
+import pandas as pd
+
+from .periods import LAST_MONTH
+
+
+# Clients are generated and written in chunks of this size, bounding the generator's memory
+CHUNK_CLIENTS = 20_000
+
+MCC_GROUPS = {
+    'Food': {'Groceries': [5411, 5412, 5441, 5451, 5499], 'Restaurants': [5812, 5813, 5814]},
+    'Transport': {'Public': [4111, 4121, 4131], 'Fuel': [5541, 5542]},
+    'Cash': {'ATM': [6011], 'Transfers': [6012, 6538, 4829]},
+    'Shopping': {'Clothes': [5651, 5691, 5699], 'Electronics': [5732, 5734], 'Other': [5311, 5331, 5999]},
+    'Services': {'Telecom': [4814, 4899], 'Utilities': [4900], 'Health': [5912, 8011, 8099]},
+    'Travel': {'Airlines': [3000, 4511], 'Hotels': [7011], 'Agencies': [4722]},
+}
+MCC_CODES = np.array([mcc for subgroups in MCC_GROUPS.values() for codes in subgroups.values() for mcc in codes])
+
+COUNTRIES = np.array(['RUS', 'TUR', 'ARE', 'DEU', 'USA'])
+PRODUCT_TYPES = np.array(['Cash Loan', 'Credit Card', 'Deposit', 'Current Account', 'Mortgage'])
+PAYMENT_TYPES = np.array(['Salary receipts', 'Pension receipts'])
+
+
+def _month_ends(n_months: int) -> pd.DatetimeIndex:
+    return pd.date_range(end=LAST_MONTH, periods=n_months, freq='M')
+
+
+def _days(n_months: int) -> pd.DatetimeIndex:
+    month_ends = _month_ends(n_months)
+    return pd.date_range(month_ends[0] - pd.offsets.MonthBegin(1), month_ends[-1], freq='D')
+
+
+def _repeat_clients(rng: np.random.Generator, ids: np.ndarray, mean_rows: float) -> np.ndarray:
+    """Client id of every row, each client getting a Poisson number of rows."""
+    return np.repeat(ids, rng.poisson(mean_rows, len(ids)))
+
+
+def _balance(rng, ids, n_months):
+    # Every client has 1-3 accounts with a row per month
+    accounts = np.repeat(ids, rng.integers(1, 4, len(ids)))
+    client_id = np.repeat(accounts, n_months)
+    month = np.tile(_month_ends(n_months).strftime('%Y-%m-%d'), len(accounts))
+    n = len(client_id)
+    avg = rng.lognormal(10, 1.5, n)
+    spread = rng.uniform(0, 0.5, n) * avg
+    # Accounts are not open in every month
+    keep = rng.random(n) < 0.9
+    return pd.DataFrame({
+        'client_id': client_id,
+        'prod_cat_nanme': rng.choice(['Current', 'Deposit', 'Card'], n),
+        'prod_group_name': rng.choice(['Retail', 'Premium'], n, p=[0.9, 0.1]),
+        'crncy_cd': rng.choice([810, 840, 978], n, p=[0.9, 0.06, 0.04]),
+        'eop_bal_sum_rur': (avg + rng.normal(0, 0.1, n) * spread).round(2),
+        'min_bal_sum_rur': (avg - spread).round(2),
+        'max_bal_sum_rur': (avg + spread).round(2),
+        'avg_bal_sum_rur': avg.round(2),
+        'month_end_dt': month,
+    })[keep]
+
+
+def _aum(rng, ids, n_months):
+    products = np.repeat(ids, rng.integers(1, 3, len(ids)))
+    client_id = np.repeat(products, n_months)
+    n = len(client_id)
+    keep = rng.random(n) < 0.9
+    return pd.DataFrame({
+        'client_id': client_id,
+        'month_end_dt': np.tile(_month_ends(n_months).strftime('%Y-%m-%d'), len(products)),
+        'product_code': rng.choice(['Deposit', 'Savings', 'Investment'], n),
+        'balance_rur_amt': rng.lognormal(11, 1.5, n).round(2),
+    })[keep]
+
+
+def _trxn(rng, ids, n_months, trxn_per_client):
+    client_id = _repeat_clients(rng, ids, trxn_per_client)
+    n = len(client_id)
+    days = _days(n_months)
+    tran_time = days[rng.integers(0, len(days), n)] + pd.to_timedelta(rng.integers(0, 86400, n), unit='s')
+    abroad = rng.random(n) < 0.05
+    mcc = pd.array(rng.choice(MCC_CODES, n), dtype='Int64')
+    mcc[rng.random(n) < 0.01] = pd.NA
+    return pd.DataFrame({
+        'client_id': client_id,
+        'card_id': client_id * 10 + rng.integers(0, 3, n),
+        'tran_time': tran_time.strftime('%Y-%m-%d %H:%M:%S'),
+        'tran_amt_rur': rng.lognormal(6.5, 1.3, n).round(2),
+        'mcc_cd': mcc,
+        'merchant_cd': rng.integers(1, 200_000, n),
+        'txn_country': np.where(abroad, rng.choice(COUNTRIES[1:], n), 'RUS'),
+        'txn_city': rng.choice(['Moscow', 'Saint Petersburg', 'Kazan', 'Other'], n),
+        'tsp_name': np.char.add('Merchant ', rng.integers(1, 5000, n).astype('str')),
+        'txn_comment_1': rng.choice(['Purchase', 'Cash withdrawal', 'Transfer'], n, p=[0.85, 0.1, 0.05]),
+        'txn_comment_2': rng.choice(['POS', 'E-commerce', 'ATM'], n),
+    })
+
+
+def _payments(rng, ids, n_months):
+    # Monthly salaries or pensions for about 60% of the clients
+    payers = ids[rng.random(len(ids)) < 0.6]
+    kind = rng.choice(PAYMENT_TYPES, len(payers), p=[0.8, 0.2])
+    client_id = np.repeat(payers, n_months)
+    n = len(client_id)
+    month_start = _month_ends(n_months) - pd.offsets.MonthBegin(1)
+    day = np.tile(month_start, len(payers)) + pd.to_timedelta(rng.integers(0, 28, n), unit='D')
+    amount = np.repeat(rng.lognormal(10.5, 0.6, len(payers)), n_months) * rng.uniform(0.9, 1.1, n)
+    keep = rng.random(n) < 0.9
+    return pd.DataFrame({
+        'client_id': client_id,
+        'day_dt': pd.DatetimeIndex(day).strftime('%Y-%m-%d'),
+        'sum_rur': amount.round(2),
+        'pmnts_name': np.repeat(kind, n_months),
+    })[keep]
+
+
+def _com(rng, ids):
+    client_id = _repeat_clients(rng, ids, 1.5)
+    n = len(client_id)
+    answer = rng.integers(0, 3, n)
+    return pd.DataFrame({
+        'client_id': client_id,
+        'channel': rng.choice(['Call', 'SMS', 'Email'], n),
+        'prod': rng.choice(['Cash Loan', 'Credit Card', 'Deposit'], n, p=[0.5, 0.3, 0.2]),
+        'agr_flg': (answer == 0).astype(int),
+        'otkaz': (answer == 1).astype(int),
+        'dumaet': (answer == 2).astype(int),
+        'ring_up_flg': rng.integers(0, 4, n),
+        'not_ring_up_flg': rng.integers(0, 4, n),
+        'count_comm': rng.integers(1, 6, n),
+    })
+
+
+def _client(rng, ids):
+    n = len(ids)
+    return pd.DataFrame({
+        'client_id': ids,
+        'gender': rng.choice(np.array(['M', 'F', None], dtype=object), n, p=[0.45, 0.5, 0.05]),
+        'age': rng.integers(18, 80, n),
+        'region': rng.integers(0, 80, n),
+        'city': rng.integers(0, 1000, n),
+        'education': rng.choice(np.array(['HIGHER_PROFESSIONAL', 'SECONDARY', 'SCHOOL', None], dtype=object), n),
+        'citizenship': rng.choice(['RUSSIA', 'OTHER'], n, p=[0.98, 0.02]),
+        'job_type': rng.choice(['Full time', 'Part time', 'Retired', 'Unemployed'], n),
+    })
+
+
+def _funnel(rng, ids):
+    n = len(ids)
+    sale = rng.random(n) < 0.12
+    funnel = pd.DataFrame({
+        'client_id': ids,
+        'sale_flg': sale.astype(int),
+        'sale_amount': np.where(sale, rng.lognormal(9.5, 1, n).round(2), np.nan),
+        'contacts': rng.integers(1, 5, n),
+        'client_segment': rng.integers(1, 10, n),
+        'region_cd': rng.integers(0, 80, n),
+        'feature_1': rng.integers(0, 8, n),
+    })
+    for i in range(2, 11):
+        funnel[f'feature_{i}'] = rng.normal(size=n).round(4)
+    return funnel
+
+
+def _deals(rng, ids):
+    client_id = _repeat_clients(rng, ids, 2)
+    n = len(client_id)
+    last_day = pd.Timestamp(LAST_MONTH)
+    start = last_day - pd.to_timedelta(rng.integers(0, 365 * 5, n), unit='D')
+    close = start + pd.to_timedelta(rng.integers(30, 365 * 3, n), unit='D')
+    close = pd.Series(close).where((close <= last_day) & (rng.random(n) < 0.8))
+    return pd.DataFrame({
+        'client_id': client_id,
+        'prod_type_name': rng.choice(PRODUCT_TYPES, n),
+        'agrmnt_start_dt': pd.DatetimeIndex(start).strftime('%Y-%m-%d'),
+        'agrmnt_close_dt': close.dt.strftime('%Y-%m-%d').to_numpy(),
+        'crncy_cd': rng.choice([810, 840], n, p=[0.95, 0.05]),
+        'agrmnt_rate_active': rng.uniform(5, 25, n).round(2),
+        'agrmnt_rate_passive': rng.uniform(0, 8, n).round(2),
+        'agrmnt_sum_rur': rng.lognormal(11, 1.2, n).round(2),
+    })
+
+
+def _dict_mcc() -> pd.DataFrame:
+    rows = [(mcc, group, subgroup)
+            for group, subgroups in MCC_GROUPS.items()
+            for subgroup, codes in subgroups.items()
+            for mcc in codes]
+    return pd.DataFrame(rows, columns=['mcc_cd', 'brs_mcc_group', 'brs_mcc_subgroup'])
+
+
+def _client_chunks(n_clients: int, rng: np.random.Generator) -> Iterator[np.ndarray]:
+    # Sparse, shuffled-looking ids like the real data, not 0..n
+    ids = np.sort(rng.choice(n_clients * 10, n_clients, replace=False)) + 1
+    for start in range(0, n_clients, CHUNK_CLIENTS):
+        yield ids[start:start + CHUNK_CLIENTS]
+
+
+def generate(out_dir: str,
+             n_clients: int = 10_000,
+             trxn_per_client: float = 50,
+             n_months: int = 12,
+             seed: int = 0):
+    """Write all input tables for a synthetic population of clients.
+
+    Args:
+        out_dir: Directory to write the CSV files to, like data/
+        n_clients: Number of clients (rows of funnel.csv and client.csv)
+        trxn_per_client: Mean number of card transactions per client
+        n_months: Months of history, ending at LAST_MONTH
+        seed: Random seed, the same arguments always give the same files
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+
+    tables = {
+        'balance': lambda ids: _balance(rng, ids, n_months),
+        'aum': lambda ids: _aum(rng, ids, n_months),
+        'trxn': lambda ids: _trxn(rng, ids, n_months, trxn_per_client),
+        'payments': lambda ids: _payments(rng, ids, n_months),
+        'com': lambda ids: _com(rng, ids),
+        'client': lambda ids: _client(rng, ids),
+        'funnel': lambda ids: _funnel(rng, ids),
+        'deals': lambda ids: _deals(rng, ids),
+    }
+    files = {name: open(os.path.join(out_dir, f'{name}.csv'), 'w', newline='') for name in tables}
+    try:
+        for i, ids in enumerate(_client_chunks(n_clients, rng)):
+            for name, make in tables.items():
+                make(ids).to_csv(files[name], header=i == 0, index=False)
+    finally:
+        for f in files.values():
+            f.close()
+
+    _dict_mcc().to_csv(os.path.join(out_dir, 'dict_mcc.csv'), index=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write synthetic input tables')
+    parser.add_argument('out_dir')
+    parser.add_argument('--clients', type=int, default=10_000)
+    parser.add_argument('--trxn-per-client', type=float, default=50)
+    parser.add_argument('--months', type=int, default=12)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    generate(args.out_dir, args.clients, args.trxn_per_client, args.months, args.seed)
+
+
+if __name__ == '__main__':
+    main()
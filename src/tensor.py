@@ -0,0 +1,298 @@
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .periods import MISSING_MONTH, month_end_str, quarter_codes
+
+
+# Months the window features use: the 12 months of the m3/m6/m12 windows, plus the month
+# the payments of the last month's last day are rolled into
+WINDOW_MONTHS = 13
+
+
+def nan_mean(arr: np.ndarray, axis: int = 1) -> np.ndarray:
+    """Mean ignoring NaN, NaN where there are no values (without numpy's warning)."""
+    count = (~np.isnan(arr)).sum(axis=axis)
+    total = np.nansum(arr, axis=axis, dtype='float64')
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(count > 0, total / count, np.nan)
+
+
+def nan_std(arr: np.ndarray, axis: int = 1, ddof: int = 1) -> np.ndarray:
+    """Standard deviation ignoring NaN, NaN where there are not more than ddof values."""
+    count = (~np.isnan(arr)).sum(axis=axis)
+    mean = nan_mean(arr, axis=axis)
+    dev = np.nansum((arr - np.expand_dims(mean, axis)) ** 2, axis=axis, dtype='float64')
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(count > ddof, np.sqrt(dev / (count - ddof)), np.nan)
+
+
+def merge_moments(n_a: np.ndarray, mean_a: np.ndarray, m2_a: np.ndarray,
+                  n_b: np.ndarray, mean_b: np.ndarray, m2_b: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Count, mean and sum of squared deviations of two sets of values together (Chan et al.).
+
+    Means of empty sets must be 0, not NaN. The merged mean is NaN where both are empty.
+    """
+    n = n_a + n_b
+    delta = mean_b - mean_a
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(n > 0, (n_a * mean_a + n_b * mean_b) / n, np.nan)
+        m2 = m2_a + m2_b + np.where(n > 0, delta ** 2 * n_a * n_b / n, 0)
+    return n, mean, m2
+
+
+def moments(arr: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Count, mean (0 if empty) and sum of squared deviations of the non NaN values of every row."""
+    n = (~np.isnan(arr)).sum(axis=1)
+    mean = nan_mean(arr)
+    m2 = np.nansum((arr - mean[:, None]) ** 2, axis=1, dtype='float64')
+    return n, np.nan_to_num(mean), m2
+
+
+def window_means(quarter_means: Dict[int, np.ndarray],
+                 n_clients: int,
+                 last_quarter: int = 4) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Average the quarter means over the last 3, 6 and 12 months.
+
+    Args:
+        quarter_means: Per client means of each quarter, as returned by
+            ClientMonthTensor.quarter_means or quarter_row_means
+        n_clients: Number of clients
+        last_quarter: Quarter of the reference month
+
+    Returns:
+        (m3, m6, m12): Mean of the last quarter, of the last two quarters and of all quarters
+    """
+    empty = np.full(n_clients, np.nan)
+
+    def mean_of(quarters):
+        means = [quarter_means[q] for q in quarters if q in quarter_means]
+        return nan_mean(np.column_stack(means)) if means else empty
+
+    m3 = quarter_means.get(last_quarter, empty)
+    m6 = mean_of([last_quarter, last_quarter - 1])
+    m12 = mean_of(list(quarter_means))
+    return m3, m6, m12
+
+
+class ClientMonthTensor:
+    """Per client and month sums of value columns, as dense float32[n_clients, n_months] arrays.
+
+    Each table is scattered once with bincount, the statistics over months are then NumPy
+    reductions along axis 1 instead of MultiIndex groupbys and pivots. Cells without any rows
+    are NaN, cells whose rows are all NaN sum to 0 (like a pandas groupby sum). Rows without
+    a month (MISSING_MONTH) are dropped, like a groupby drops them.
+
+    Without last_month there is one column per month with rows. With last_month the columns
+    are the WINDOW_MONTHS months up to the month after it, and the sums of the months outside
+    are folded into per client moments for the all-history mean and std, like
+    src.incremental.MonthlyState does. A stray date decades away then costs nothing.
+    """
+
+    def __init__(self,
+                 client_ids: np.ndarray,
+                 months: np.ndarray,
+                 values: Dict[str, np.ndarray],
+                 last_month: Optional[int] = None,
+                 window_months: int = WINDOW_MONTHS,
+                 keep_history: bool = False):
+        """
+        Args:
+            client_ids: Client id of every row
+            months: Month code (see src.periods) of every row
+            values: Value columns to sum, by name
+            last_month: Reference month code, limits the columns to the window months
+            window_months: Number of columns with last_month, ending with the month after it
+                (where payments of its last day are rolled into)
+            keep_history: Keep the monthly sums of the months outside the window, for
+                columns_by_month
+        """
+        months = np.asarray(months, dtype='int64')
+        client_ids = np.asarray(client_ids)
+        values = {name: np.asarray(col, dtype='float64') for name, col in values.items()}
+        with_month = months != MISSING_MONTH
+        if not with_month.all():
+            months, client_ids = months[with_month], client_ids[with_month]
+            values = {name: col[with_month] for name, col in values.items()}
+
+        self.clients, rows = np.unique(client_ids, return_inverse=True)
+        n_clients = len(self.clients)
+
+        #: Month code of every column
+        if last_month is None:
+            self.months = np.unique(months)
+        else:
+            self.months = np.arange(last_month - window_months + 2, last_month + 2)
+        n_months = len(self.months)
+
+        in_window = np.isin(months, self.months)
+        outside = None if in_window.all() else ~in_window
+        if outside is not None:
+            self._fold(rows[outside], months[outside], {name: col[outside] for name, col in values.items()},
+                       keep_history)
+            rows, months = rows[in_window], months[in_window]
+            values = {name: col[in_window] for name, col in values.items()}
+        else:
+            self._folded = None
+            self._history = {name: {} for name in values}
+
+        n_cells = n_clients * n_months
+        cells = rows * n_months + np.searchsorted(self.months, months)
+        self.counts = np.bincount(cells, minlength=n_cells).reshape(n_clients, n_months).astype('int32')
+
+        #: Months with at least one row for any client
+        self.observed_months = self.months[self.counts.any(axis=0)]
+
+        missing = self.counts == 0
+        self._sums = {}
+        self._value_counts = {}
+        for name, col in values.items():
+            notna = ~np.isnan(col)
+            sums = np.bincount(cells, weights=np.where(notna, col, 0), minlength=n_cells).reshape(n_clients, n_months)
+            sums = sums.astype('float32')
+            sums[missing] = np.nan
+            self._sums[name] = sums
+            self._value_counts[name] = np.bincount(cells[notna], minlength=n_cells).reshape(n_clients, n_months)
+
+    def _fold(self, rows: np.ndarray, months: np.ndarray, values: Dict[str, np.ndarray], keep_history: bool):
+        """Per client count, mean and sum of squared deviations of the monthly sums outside the columns."""
+        n_clients = len(self.clients)
+        first = months.min()
+        span = int(months.max() - first + 1)
+        keys, cells = np.unique(rows * span + (months - first), return_inverse=True)
+        cell_rows, cell_months = keys // span, keys % span + first
+
+        n = np.bincount(cell_rows, minlength=n_clients)
+        self._folded = {'n': n}
+        self._history = {name: {} for name in values}
+        for name, col in values.items():
+            # Summed like the columns, to float32
+            sums = np.bincount(cells, weights=np.where(np.isnan(col), 0, col)).astype('float32').astype('float64')
+            with np.errstate(invalid='ignore', divide='ignore'):
+                mean = np.nan_to_num(np.bincount(cell_rows, weights=sums, minlength=n_clients) / n)
+            m2 = np.bincount(cell_rows, weights=(sums - mean[cell_rows]) ** 2, minlength=n_clients)
+            self._folded[name] = (mean, m2)
+
+            if keep_history:
+                for month in np.unique(cell_months):
+                    in_month = cell_months == month
+                    history = np.full(n_clients, np.nan, dtype='float32')
+                    history[cell_rows[in_month]] = sums[in_month]
+                    self._history[name][int(month)] = history
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, value_cols: List[str], month_col: str = 'month', **kwargs):
+        return cls(df['client_id'].to_numpy(), df[month_col].to_numpy(),
+                   {col: df[col].to_numpy() for col in value_cols}, **kwargs)
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        """Monthly sums of a value column, NaN for months without rows."""
+        return self._sums[name]
+
+    def month(self, arr: np.ndarray, month: int) -> np.ndarray:
+        """Values of a single month, NaN if the month has no column."""
+        i = np.searchsorted(self.months, month)
+        if i < len(self.months) and self.months[i] == month:
+            return arr[:, i]
+        return np.full(len(self.clients), np.nan, dtype=arr.dtype)
+
+    def quarter_means(self, arr: np.ndarray, quarters: np.ndarray) -> Dict[int, np.ndarray]:
+        """Mean of the monthly values in each quarter.
+
+        Args:
+            arr: Monthly values
+            quarters: Quarter of every month (column)
+
+        Returns:
+            means: Means by quarter, for quarters with at least one observed month
+        """
+        observed = np.isin(self.months, self.observed_months)
+        return {q: nan_mean(arr[:, quarters == q])
+                for q in np.unique(quarters[observed])}
+
+    def quarter_row_means(self, name: str, quarters: np.ndarray) -> Dict[int, np.ndarray]:
+        """Mean of the non missing rows (not of the monthly sums) of a value column in each quarter."""
+        sums = np.nan_to_num(self._sums[name])
+        observed = np.isin(self.months, self.observed_months)
+
+        means = {}
+        for q in np.unique(quarters[observed]):
+            in_q = quarters == q
+            count = self._value_counts[name][:, in_q].sum(axis=1)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                means[q] = np.where(count > 0, sums[:, in_q].sum(axis=1, dtype='float64') / count, np.nan)
+        return means
+
+    # Statistics over months by value column name. The window extractors only use these,
+    # so they also run on the running state of src.incremental.MonthlyState
+
+    def _merged(self, name: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Moments of the monthly sums of the columns merged with those of the folded months."""
+        mean, m2 = self._folded[name]
+        return merge_moments(self._folded['n'], mean, m2, *moments(self._sums[name]))
+
+    def mean(self, name: str) -> np.ndarray:
+        """Mean of the monthly sums over the months with rows."""
+        if self._folded is None:
+            return nan_mean(self._sums[name])
+        return self._merged(name)[1]
+
+    def std(self, name: str) -> np.ndarray:
+        """Standard deviation of the monthly sums over the months with rows."""
+        if self._folded is None:
+            return nan_std(self._sums[name])
+        n, _, m2 = self._merged(name)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(n > 1, np.sqrt(np.maximum(m2, 0) / (n - 1)), np.nan)
+
+    def mean_difference(self, name: str, other: str) -> np.ndarray:
+        """Mean over months of the difference of the monthly sums of two value columns."""
+        diff = self._sums[name] - self._sums[other]
+        if self._folded is None:
+            return nan_mean(diff)
+        # Both columns come from the same rows, so they have values in the same months
+        n_folded = self._folded['n']
+        total = np.nansum(diff, axis=1, dtype='float64') + n_folded * (self._folded[name][0] - self._folded[other][0])
+        n = n_folded + (~np.isnan(diff)).sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(n > 0, total / n, np.nan)
+
+    def last(self, name: str, month: int) -> np.ndarray:
+        """Monthly sum of a single month."""
+        return self.month(self._sums[name], month)
+
+    def windows(self, name: str, last_month: int, row_means: bool = False) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """m3, m6 and m12 averages up to last_month (see window_means).
+
+        Args:
+            name: Value column
+            last_month: Reference month code
+            row_means: Average the rows of each quarter instead of the monthly sums
+        """
+        quarters = quarter_codes(self.months, last_month)
+        if row_means:
+            means = self.quarter_row_means(name, quarters)
+        else:
+            means = self.quarter_means(self._sums[name], quarters)
+        return window_means(means, len(self.clients))
+
+    def columns_by_month(self, name: str, prefix: str, fmt: str = '%Y-%m-%d') -> Dict[str, np.ndarray]:
+        """The monthly sums of a value column, one column per observed month.
+
+        Months outside the columns are only included with keep_history.
+        """
+        by_month = {int(m): self._sums[name][:, np.searchsorted(self.months, m)] for m in self.observed_months}
+        by_month.update(self._history[name])
+        return {f'{prefix}{month_end_str(m, fmt)}': by_month[m] for m in sorted(by_month)}
+
+    def frame(self, columns: Dict[str, np.ndarray]) -> pd.DataFrame:
+        """Put per client arrays together into a client_id indexed dataframe."""
+        index = pd.Index(self.clients, name='client_id')
+        return pd.DataFrame({nm: np.asarray(col, dtype='float32') for nm, col in columns.items()}, index=index)
+
+    def monthly_columns(self, arr: np.ndarray, prefix: str, fmt: str = '%Y-%m-%d',
+                        exclude: tuple = ()) -> Dict[str, np.ndarray]:
+        """One column per observed month, named prefix + the month's last day (like a pivot)."""
+        months = [m for m in self.observed_months if m not in exclude]
+        return {f'{prefix}{month_end_str(m, fmt)}': arr[:, np.searchsorted(self.months, m)] for m in months}
@@ -0,0 +1,184 @@
+"""Quantized pool cache and k-fold training driver for CatBoost models.
+
+The feature matrix is quantized once and saved in CatBoost's quantized format, together
+with its borders. Every fold's model trains on slices of that saved pool, in a process
+pool, instead of re-quantizing pandas data for every fit.
+"""
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from catboost import CatBoostClassifier, Pool
+
+from .feature_matrix import FeatureMatrix, save_features
+from .pipeline import available_cpus
+from .utils import hash_folds
+
+
+POOL_CACHE_DIR = os.environ.get('POOL_CACHE_DIR', '.pool_cache')
+
+
+def data_key(data: pd.DataFrame, label, cat_features: List[str], quantize_params: dict) -> str:
+    """Key of a quantized pool: hash of the data, label, categorical features and quantization."""
+    h = hashlib.sha1(pd.util.hash_pandas_object(data, index=True).to_numpy().tobytes())
+    h.update(json.dumps(list(map(str, data.columns))).encode())
+    if label is not None:
+        h.update(np.ascontiguousarray(label, dtype='float64').tobytes())
+    h.update(json.dumps([sorted(cat_features), sorted(quantize_params.items())], default=str).encode())
+    return h.hexdigest()[:24]
+
+
+def borders_path(pool_path: str) -> str:
+    return os.path.splitext(pool_path)[0] + '.borders.tsv'
+
+
+def data_path(pool_path: str) -> str:
+    return os.path.splitext(pool_path)[0] + '.features'
+
+
+def quantized_pool(data: pd.DataFrame,
+                   label,
+                   cat_features: List[str],
+                   cache_dir: str = POOL_CACHE_DIR,
+                   **quantize_params) -> str:
+    """Quantize a feature matrix once and cache it on disk.
+
+    Args:
+        data: Feature matrix
+        label: Training target, aligned with data
+        cat_features: Categorical feature columns
+        cache_dir: Where quantized pools are stored
+        quantize_params: Passed to Pool.quantize, e.g. border_count
+
+    Returns:
+        pool_path: Path of the quantized pool, load it with load_pool. Its borders (for
+            quantize_like) and the raw data (for predictions, see val_rows) are stored next to it
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    pool_path = os.path.join(cache_dir, data_key(data, label, cat_features, quantize_params) + '.qpool')
+    if os.path.exists(pool_path) and os.path.exists(data_path(pool_path)):
+        return pool_path
+
+    pool = Pool(data=data, label=label, cat_features=cat_features)
+    pool.quantize(**quantize_params)
+
+    # The pool file is written last, so it only exists once everything else is in place
+    tmp_path = pool_path + f'.tmp{os.getpid()}'
+    pool.save_quantization_borders(borders_path(pool_path))
+    save_features(data, data_path(pool_path))
+    pool.save(tmp_path)
+    os.replace(tmp_path, pool_path)
+    return pool_path
+
+
+def load_pool(pool_path: str) -> Pool:
+    return Pool('quantized://' + pool_path)
+
+
+def quantize_like(data: pd.DataFrame, cat_features: List[str], pool_path: str, label=None) -> Pool:
+    """Quantize new data (e.g. a test set) with the borders of a cached pool."""
+    pool = Pool(data=data, label=label, cat_features=cat_features)
+    pool.quantize(input_borders=borders_path(pool_path))
+    return pool
+
+
+def val_rows(pool_path: str, val_idx: np.ndarray) -> pd.DataFrame:
+    """Raw feature rows of a cached pool, read from its memory-mapped copy without loading the rest."""
+    return FeatureMatrix(data_path(pool_path)).take(val_idx)
+
+
+def predict_scores(model, pool: Pool) -> np.ndarray:
+    """Predictions to score or threshold: the positive class probability of classifiers."""
+    if isinstance(model, CatBoostClassifier):
+        return model.predict_proba(pool)[:, 1]
+    return model.predict(pool)
+
+
+def client_folds(client_ids: np.ndarray, n_folds: int = 5, seed: int = 42) -> np.ndarray:
+    """Fold of every row, all rows of a client are in the same fold (see src.utils.hash_folds)."""
+    return hash_folds(client_ids, n_folds, seed)
+
+
+def _fit_fold(model_cls, params: dict, pool_path: str, cat_features: List[str], fold: int,
+              folds: np.ndarray, model_dir: Optional[str]) -> Tuple[int, np.ndarray, dict]:
+    # Every worker maps the same saved pool, the OS shares the file's pages between them
+    pool = load_pool(pool_path)
+    # The next fold picks the best iteration (and stops early), so the scored fold never does
+    fold_ids = np.unique(folds)
+    stop_fold = fold_ids[(np.searchsorted(fold_ids, fold) + 1) % len(fold_ids)]
+    train_idx = np.flatnonzero((folds != fold) & (folds != stop_fold))
+    stop_idx = np.flatnonzero(folds == stop_fold)
+    val_idx = np.flatnonzero(folds == fold)
+
+    model = model_cls(**params)
+    model.fit(pool.slice(train_idx.tolist()), eval_set=pool.slice(stop_idx.tolist()), verbose=False)
+
+    pred = predict_scores(model, Pool(data=val_rows(pool_path, val_idx), cat_features=cat_features))
+
+    if model_dir is not None:
+        os.makedirs(model_dir, exist_ok=True)
+        model.save_model(os.path.join(model_dir, f'fold_{fold}.cbm'))
+
+    info = {
+        'fold': fold,
+        'stop_fold': stop_fold,
+        'n_train': len(train_idx),
+        'n_stop': len(stop_idx),
+        'n_val': len(val_idx),
+        'best_iteration': model.get_best_iteration(),
+        'best_score': model.get_best_score(),
+    }
+    return fold, pred, info
+
+
+def cross_validate(model_cls,
+                   params: dict,
+                   pool_path: str,
+                   cat_features: List[str],
+                   folds: np.ndarray,
+                   n_jobs: Optional[int] = None,
+                   model_dir: Optional[str] = None) -> Tuple[np.ndarray, List[dict]]:
+    """Train a model per fold in parallel processes and collect out-of-fold predictions.
+
+    The model of fold k trains on the folds other than k and k + 1. Fold k + 1 (the first
+    fold for the last one) is its eval set, which picks the best iteration and stops
+    early, so the predictions of fold k are not tuned on its labels.
+
+    Args:
+        model_cls: CatBoostRegressor or CatBoostClassifier
+        params: Model parameters. thread_count defaults to the CPUs split between the workers
+        pool_path: Quantized pool from quantized_pool
+        cat_features: Categorical feature columns
+        folds: Fold of every row, e.g. from client_folds
+        n_jobs: Number of worker processes, one per fold up to the number of CPUs if None
+        model_dir: If given, the fold models are saved there as fold_<k>.cbm
+
+    Returns:
+        (oof, infos): Out-of-fold prediction of every row, and per fold sizes, best
+            iteration and best scores on the eval fold
+    """
+    fold_ids = np.unique(folds)
+    if len(fold_ids) < 3:
+        raise ValueError(f'cross_validate needs at least 3 folds, got {len(fold_ids)}')
+    if n_jobs is None:
+        n_jobs = min(len(fold_ids), available_cpus())
+    params = dict(params)
+    params.setdefault('thread_count', max(available_cpus() // n_jobs, 1))
+
+    oof = np.full(len(folds), np.nan)
+    infos = []
+    args = [(model_cls, params, pool_path, cat_features, fold, folds, model_dir) for fold in fold_ids]
+    if n_jobs <= 1:
+        results = [_fit_fold(*a) for a in args]
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            results = list(pool.map(_fit_fold, *zip(*args)))
+
+    for fold, pred, info in results:
+        oof[folds == fold] = np.asarray(pred).ravel()
+        infos.append(info)
+    return oof, infos
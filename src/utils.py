@@ -29,6 +29,71 @@ def train_val_test_split(
     return train, val, test
 
 
+SPLIT_NAMES = ("train", "val", "test")
+
+
+def splitmix64(x: np.ndarray) -> np.ndarray:
+    """The splitmix64 finalizer, a fast well-mixing hash of 64-bit integers."""
+    x = np.asarray(x).astype("uint64")
+    with np.errstate(over="ignore"):
+        x = x + np.uint64(0x9E3779B97F4A7C15)
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        x = x ^ (x >> np.uint64(31))
+    return x
+
+
+def client_hash(client_ids, seed: int = 0) -> np.ndarray:
+    """A number in [0, 1) for every client id, that only depends on the id and the seed."""
+    ids = np.asarray(client_ids)
+    if ids.dtype.kind not in "iu":
+        ids = pd.util.hash_array(ids.astype(str).astype(object))
+    with np.errstate(over="ignore"):
+        h = splitmix64(ids.astype("uint64") ^ splitmix64(np.uint64(seed)))
+    # The top 53 bits as a double in [0, 1)
+    return (h >> np.uint64(11)).astype("float64") / 2.0 ** 53
+
+
+def hash_split(
+    client_ids, split: Tuple[float, float, float] = (0.8, 0.1, 0.1), seed: int = 0
+) -> np.ndarray:
+    """Assign every row to train (0), val (1) or test (2) by a hash of its client id.
+
+    The assignment of a client does not depend on the other rows, so it is the same for
+    every table and every chunk of a table, and adding clients does not move existing ones.
+
+    Args:
+        client_ids: Client id of every row
+        split: Shares of (train, val, test) - should sum up to 1
+        seed: Seed of the hash, a different seed gives an independent split
+
+    Returns:
+        part: Index into SPLIT_NAMES of every row
+    """
+
+    assert abs(sum(split) - 1) < 1e-9, "The sum of split should be 1"
+
+    bounds = np.cumsum(split)[:-1]
+    return np.searchsorted(bounds, client_hash(client_ids, seed), side="right").astype("int8")
+
+
+def hash_train_val_test_split(
+    df: pd.DataFrame,
+    split: Tuple[float, float, float],
+    key: str = "client_id",
+    seed: int = 0,
+) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """Like train_val_test_split, but by a hash of the client id, see hash_split."""
+
+    part = hash_split(df[key].to_numpy(), split, seed)
+    return df[part == 0], df[part == 1], df[part == 2]
+
+
+def hash_folds(client_ids, n_folds: int = 5, seed: int = 0) -> np.ndarray:
+    """Fold of every row by a hash of its client id, all rows of a client are in one fold."""
+    return np.minimum((client_hash(client_ids, seed) * n_folds).astype("int64"), n_folds - 1)
+
+
 CALL_COST = 400 / 0.1
 
 
@@ -43,7 +108,58 @@ def calculate_profit(df: pd.DataFrame) -> pd.Series:
 def signed_log10_1p(x):
     return np.sign(x) * np.log10(np.abs(x) + 1)
 
+def profit_curve(
+    pred: np.ndarray, df: pd.DataFrame
+) -> Tuple[np.ndarray, np.ndarray, float, float]:
+    """Mean profit of contacting everyone with pred > threshold, for every possible threshold.
+
+    Predictions are sorted once and profits accumulated, so all cut points are evaluated
+    in O(n log n) instead of re-scoring the data for each threshold.
+
+    Args:
+        pred: Model predictions, higher means more likely to be profitable
+        df: Dataframe with the columns needed by calculate_profit, aligned with pred
+
+    Returns:
+        (thresholds, profits, best_threshold, best_profit): Thresholds (descending, the
+            first one selects nobody and the last one everybody), the mean profit per
+            client for each of them, and the threshold with the highest mean profit
+
+    Raises:
+        ValueError: If there are no predictions, or not one per row of df
+    """
+
+    pred = np.asarray(pred, dtype="float64")
+    profit = calculate_profit(df).to_numpy(dtype="float64")
+    n = len(pred)
+    if n == 0 or n != len(profit):
+        raise ValueError(f"profit_curve needs one prediction per row of df, got {n} for {len(profit)} rows")
+
+    order = np.argsort(-pred, kind="stable")
+    pred_sorted = pred[order]
+    profit_top_k = np.concatenate([[0.0], np.cumsum(profit[order])])
+
+    # Cut after the top k predictions, only where the prediction changes
+    k = np.flatnonzero(pred_sorted[:-1] > pred_sorted[1:]) + 1
+    k = np.concatenate([[0], k, [n]])
+
+    thresholds = np.empty(len(k))
+    thresholds[0] = pred_sorted[0]
+    thresholds[1:-1] = 0.5 * (pred_sorted[k[1:-1] - 1] + pred_sorted[k[1:-1]])
+    thresholds[-1] = -np.inf
+
+    profits = profit_top_k[k] / n
+    best = np.argmax(profits)
+
+    return thresholds, profits, thresholds[best], profits[best]
+
+
 class ProfitMetric(object):
+    """CatBoost eval metric - mean target of the samples with approx > threshold."""
+
+    def __init__(self, threshold=0):
+        self.threshold = threshold
+
     def get_final_error(self, error, weight):
         return error / (weight + 1e-38)
 
@@ -51,14 +167,9 @@ class ProfitMetric(object):
         return True
 
     def evaluate(self, approxes, target, weight=None):
-        profit_sum = 0
-        count = 0 
-
-        for i in range(len(target)):
-            count += 1
-
-            count_item = approxes[i] > 0
-            if count_item:
-                profit_sum += target[i]
+        approx = np.asarray(approxes[0])
+        target = np.asarray(target)
+        weight = np.ones(len(target)) if weight is None else np.asarray(weight)
 
-        return profit_sum / count
\ No newline at end of file
+        selected = approx > self.threshold
+        return (weight[selected] * target[selected]).sum(), weight.sum()
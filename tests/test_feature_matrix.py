@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.feature_matrix import FeatureMatrix, save_features
+
+
+def features_frame(n_rows=1000, seed=0):
+    rng = np.random.default_rng(seed)
+    values = rng.normal(size=n_rows).astype('float32')
+    values[rng.random(n_rows) < 0.1] = np.nan
+    region = pd.Categorical(rng.choice(['Moscow', 'Kazan', 'Other'], n_rows))
+    region[rng.random(n_rows) < 0.1] = np.nan
+    city = rng.choice(np.array(['Moscow', 'Kazan', 'nan', None], dtype=object), n_rows)
+    return pd.DataFrame({
+        'balance_m3': values,
+        'region': region,
+        'n_mcc': rng.integers(0, 50, n_rows),
+        'city': city,
+        'is_pensioneer': rng.random(n_rows) < 0.2,
+        'aum_std': rng.lognormal(size=n_rows).astype('float32'),
+    }, index=pd.Index(rng.choice(10**7, n_rows, replace=False), name='client_id'))
+
+
+def test_round_trip(tmp_path):
+    features = features_frame()
+    save_features(features, str(tmp_path / 'x.features'), write_rows=300)
+    data = FeatureMatrix(str(tmp_path / 'x.features'))
+
+    assert data.columns == list(features.columns)
+    assert len(data) == len(features)
+    pd.testing.assert_frame_equal(data.to_frame(), features)
+    pd.testing.assert_frame_equal(data.rows(100, 350), features.iloc[100:350])
+    pd.testing.assert_frame_equal(data.take([5, 999, 0]), features.iloc[[5, 999, 0]])
+    pd.testing.assert_frame_equal(pd.concat(data.iter_blocks(128)), features)
+
+
+def test_large_integers_are_refused(tmp_path):
+    features = pd.DataFrame({'id_like': [1, 2**40]}, index=pd.Index([1, 2], name='client_id'))
+    with pytest.raises(ValueError, match='id_like'):
+        save_features(features, str(tmp_path / 'x.features'))
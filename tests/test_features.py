@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.features import TrxnFtExtractor
+
+
+@pytest.fixture(autouse=True)
+def in_tmp_path(tmp_path, monkeypatch):
+    # The table cache is written to the working directory
+    monkeypatch.chdir(tmp_path)
+
+
+def trxn_rows(n_rows=400, with_missing_mcc=False, seed=0):
+    rng = np.random.default_rng(seed)
+    mcc = pd.array(rng.choice([5411, 5812, 6011, 4829], n_rows), dtype='Int64')
+    if with_missing_mcc:
+        mcc[rng.random(n_rows) < 0.1] = pd.NA
+    trxn = pd.DataFrame({
+        'client_id': rng.integers(1, 40, n_rows),
+        # Whole amounts, so that many clients have several MCCs with the same top sum
+        'tran_amt_rur': rng.integers(1, 4, n_rows).astype('float64') * 100,
+        'mcc_cd': mcc,
+    })
+    # A client whose two MCCs tie, in reverse order of their codes
+    ties = pd.DataFrame({'client_id': [99, 99, 99], 'tran_amt_rur': [300.0, 100.0, 200.0],
+                         'mcc_cd': pd.array([6011, 5411, 5411], dtype='Int64')})
+    return pd.concat([trxn, ties], ignore_index=True)
+
+
+@pytest.mark.parametrize('with_missing_mcc', [False, True])
+def test_chunked_trxn_matches_full_load(with_missing_mcc):
+    trxn_rows(with_missing_mcc=with_missing_mcc).to_csv('trxn.csv', index=False)
+    expected = TrxnFtExtractor('trxn.csv').load_transform()
+
+    # Chunks of 16 rows, so the partial sums are folded many times
+    result = TrxnFtExtractor('trxn.csv', mem_budget_mb=16 * TrxnFtExtractor.ROW_BYTES * 2 / 2**20).load_transform()
+
+    pd.testing.assert_frame_equal(result, expected)
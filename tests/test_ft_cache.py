@@ -0,0 +1,54 @@
+import importlib
+import sys
+
+import pytest
+
+from src.ft_cache import code_version
+
+
+HELPERS = '''
+SCALE = {scale}
+
+
+def scaled(x):
+    return x * SCALE
+
+
+def unrelated(x):
+    return x + {unrelated}
+'''
+
+EXTRACTORS = '''
+from .helpers import scaled
+
+
+class Extractor:
+    def load_transform(self):
+        return scaled(1)
+'''
+
+
+@pytest.fixture
+def write_package(tmp_path, monkeypatch):
+    monkeypatch.syspath_prepend(str(tmp_path))
+    (tmp_path / 'ftpkg').mkdir()
+    (tmp_path / 'ftpkg' / '__init__.py').write_text('')
+    (tmp_path / 'ftpkg' / 'extractors.py').write_text(EXTRACTORS)
+
+    def write(scale=2, unrelated=1):
+        (tmp_path / 'ftpkg' / 'helpers.py').write_text(HELPERS.format(scale=scale, unrelated=unrelated))
+        for name in ['ftpkg', 'ftpkg.helpers', 'ftpkg.extractors']:
+            sys.modules.pop(name, None)
+        importlib.invalidate_caches()
+        return importlib.import_module('ftpkg.extractors').Extractor
+
+    yield write
+    for name in ['ftpkg', 'ftpkg.helpers', 'ftpkg.extractors']:
+        sys.modules.pop(name, None)
+
+
+def test_code_version_follows_only_referenced_code(write_package):
+    version = code_version(write_package())
+
+    assert code_version(write_package(unrelated=10)) == version
+    assert code_version(write_package(scale=30)) != version
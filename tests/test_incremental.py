@@ -0,0 +1,55 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.features import AUMWindowFtExtractor, BalanceWindowFtExtractor, PaymentWindowFtExtractor, TrxnFtExtractor
+from src.incremental import IncrementalFeatures
+from src.synthetic import generate
+
+
+@pytest.fixture(autouse=True)
+def in_tmp_path(tmp_path, monkeypatch):
+    # The table cache is written to the working directory
+    monkeypatch.chdir(tmp_path)
+
+
+DATE_COLUMNS = {'balance': 'month_end_dt', 'aum': 'month_end_dt', 'payments': 'day_dt', 'trxn': 'tran_time'}
+
+
+def split_last_month(data_dir, history_dir, new_dir, first_day='2019-08-01'):
+    """Write the rows before first_day to history_dir and the others to new_dir."""
+    for d in [history_dir, new_dir]:
+        os.makedirs(d)
+    for name, date_col in DATE_COLUMNS.items():
+        table = pd.read_csv(os.path.join(data_dir, f'{name}.csv'))
+        is_new = table[date_col] >= first_day
+        table[~is_new].to_csv(os.path.join(history_dir, f'{name}.csv'), index=False)
+        table[is_new].to_csv(os.path.join(new_dir, f'{name}.csv'), index=False)
+
+
+def test_refresh_with_a_new_month_matches_the_full_build():
+    # More months than the ring, so that the first month drops out on the refresh
+    generate('data', n_clients=200, trxn_per_client=5, n_months=15, seed=2)
+    split_last_month('data', 'history', 'new')
+
+    state = IncrementalFeatures()
+    state.refresh('history')
+    state.refresh('new')
+
+    expected = [
+        BalanceWindowFtExtractor('data/balance.csv').load_transform(),
+        AUMWindowFtExtractor('data/aum.csv').load_transform(),
+        TrxnFtExtractor('data/trxn.csv').load_transform(),
+        PaymentWindowFtExtractor('data/payments.csv').load_transform(),
+    ]
+    for result, block in zip(state.blocks(), expected):
+        assert list(result.columns) == list(block.columns)
+        assert result.index.equals(block.index)
+        for col in block.columns:
+            if block[col].dtype == object:
+                assert (result[col].astype('str') == block[col].astype('str')).all(), col
+            else:
+                np.testing.assert_allclose(result[col].astype('float64'), block[col].astype('float64'),
+                                           rtol=1e-4, atol=1e-2, err_msg=col)
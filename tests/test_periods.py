@@ -0,0 +1,12 @@
+import numpy as np
+
+from src.periods import month_code, quarter_codes
+
+
+def test_quarter_codes_of_old_months_do_not_wrap():
+    last_month = month_code('2019-08-31')
+    months = np.array([last_month - 3 * 130, last_month - 3 * 387, last_month - 3, last_month])
+
+    quarters = quarter_codes(months, last_month)
+
+    np.testing.assert_array_equal(quarters, [4 - 130, 4 - 387, 3, 4])
@@ -0,0 +1,33 @@
+import pandas as pd
+import pytest
+
+from src.data import read_table
+from src.pipeline import run_extractors
+
+
+@pytest.fixture(autouse=True)
+def in_tmp_path(tmp_path, monkeypatch):
+    # The table cache is written to the working directory
+    monkeypatch.chdir(tmp_path)
+
+
+class SumExtractor:
+    def __init__(self, fn, columns):
+        self._fn = fn
+        self.INPUT_COLUMNS = columns
+
+    def load_transform(self):
+        return read_table(self._fn, columns=self.INPUT_COLUMNS).groupby('client_id').sum()
+
+
+def test_prefetched_read_error_is_raised_by_the_extractor():
+    pd.DataFrame({'client_id': [1, 2, 2], 'amount': [1.0, 2.0, 3.0]}).to_csv('table.csv', index=False)
+    # Cached tables check the columns before reading them
+    read_table('table.csv')
+
+    extractors = [SumExtractor('table.csv', ['client_id', 'amount']), SumExtractor('table.csv', ['client_id', 'amout'])]
+    with pytest.raises(ValueError, match='amout'):
+        run_extractors(extractors, n_jobs=1)
+
+    features = run_extractors(extractors[:1], n_jobs=1)
+    assert features['amount'].tolist() == [1.0, 5.0]
@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.data import split_table
+from src.utils import SPLIT_NAMES, hash_folds, hash_split
+
+
+@pytest.fixture(autouse=True)
+def in_tmp_path(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+
+def client_parts(out_dir):
+    """Part of every client in a split directory, checking that no client is in two parts."""
+    parts = pd.concat([pd.read_csv(f'{out_dir}/{part}/balance.csv').assign(part=part) for part in SPLIT_NAMES])
+    by_client = parts.groupby('client_id')['part'].unique()
+    assert (by_client.str.len() == 1).all()
+    return by_client.str[0]
+
+
+def test_split_does_not_depend_on_chunks():
+    rng = np.random.default_rng(0)
+    n_rows = 40_000
+    pd.DataFrame({
+        'client_id': rng.choice(rng.choice(10**7, 8000, replace=False), n_rows),
+        'avg_bal_sum_rur': rng.normal(size=n_rows),
+    }).to_csv('balance.csv', index=False)
+
+    split_table('balance.csv', 'whole', split=(0.7, 0.2, 0.1))
+    split_table('balance.csv', 'chunked', split=(0.7, 0.2, 0.1), chunksize=777)
+
+    whole, chunked = client_parts('whole'), client_parts('chunked')
+    pd.testing.assert_series_equal(chunked, whole)
+    shares = whole.value_counts(normalize=True)
+    np.testing.assert_allclose(shares[list(SPLIT_NAMES)], [0.7, 0.2, 0.1], atol=0.02)
+
+
+def test_assignment_does_not_depend_on_the_other_rows():
+    rng = np.random.default_rng(1)
+    client_ids = rng.integers(0, 10**9, 50_000)
+
+    parts = hash_split(client_ids)
+    folds = hash_folds(client_ids, n_folds=5)
+    chunks = np.array_split(np.arange(len(client_ids)), 13)
+    np.testing.assert_array_equal(np.concatenate([hash_split(client_ids[c]) for c in chunks]), parts)
+    np.testing.assert_array_equal(np.concatenate([hash_folds(client_ids[c], n_folds=5) for c in chunks]), folds)
+
+    np.testing.assert_allclose(np.bincount(parts) / len(parts), [0.8, 0.1, 0.1], atol=0.01)
+    np.testing.assert_allclose(np.bincount(folds) / len(folds), [0.2] * 5, atol=0.01)
@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.features import BalanceWindowFtExtractor, PaymentWindowFtExtractor
+from src.periods import month_code
+from src.tensor import WINDOW_MONTHS, ClientMonthTensor
+
+
+@pytest.fixture(autouse=True)
+def in_tmp_path(tmp_path, monkeypatch):
+    # The table cache is written to the working directory
+    monkeypatch.chdir(tmp_path)
+
+
+def monthly_rows(n_clients=20, months=pd.date_range('2018-09-30', '2019-08-31', freq='M'), seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame([{'client_id': client, 'date': month, 'value': rng.normal(1000, 300)}
+                         for client in range(n_clients) for month in months if rng.random() < 0.8])
+
+
+def test_missing_payment_date_is_dropped():
+    rows = monthly_rows()
+    payments = pd.DataFrame({
+        'client_id': rows['client_id'],
+        'day_dt': rows['date'].dt.strftime('%Y-%m-%d'),
+        'sum_rur': rows['value'],
+        'pmnts_name': 'Pension receipts',
+    })
+    payments.to_csv('payments.csv', index=False)
+    expected = PaymentWindowFtExtractor('payments.csv').load_transform()
+
+    missing = payments.iloc[:1].assign(day_dt='')
+    pd.concat([payments, missing]).to_csv('payments.csv', index=False)
+    result = PaymentWindowFtExtractor('payments.csv').load_transform()
+
+    pd.testing.assert_frame_equal(result, expected)
+
+
+def test_outlier_date_does_not_widen_the_month_axis():
+    rows = monthly_rows()
+    balances = pd.DataFrame({
+        'client_id': rows['client_id'],
+        'month_end_dt': rows['date'].dt.strftime('%Y-%m-%d'),
+        'avg_bal_sum_rur': rows['value'],
+        'max_bal_sum_rur': rows['value'] + 100,
+        'min_bal_sum_rur': rows['value'] - 100,
+    })
+    outlier = balances.iloc[:1].assign(month_end_dt='2000-01-31')
+    pd.concat([balances, outlier]).to_csv('balance.csv', index=False)
+    result = BalanceWindowFtExtractor('balance.csv').load_transform()
+
+    # The outlier month counts into the all-history mean, not into the windows
+    with_outlier = pd.concat([balances, outlier])
+    all_avg = with_outlier.groupby(['client_id', 'month_end_dt'])['avg_bal_sum_rur'].sum().groupby('client_id').mean()
+    np.testing.assert_allclose(result['balance_all_avg'], all_avg.loc[result.index], rtol=1e-5)
+
+    balances.to_csv('balance.csv', index=False)
+    expected = BalanceWindowFtExtractor('balance.csv').load_transform()
+    window_cols = ['balance_last_avg', 'balance_m3', 'balance_diff_m3', 'balance_diff_m6', 'balance_diff_m3_m12']
+    pd.testing.assert_frame_equal(result[window_cols], expected[window_cols])
+
+
+def test_folded_months_match_full_history():
+    rng = np.random.default_rng(1)
+    n_rows = 5000
+    client_ids = rng.integers(0, 100, n_rows)
+    months = month_code('2019-08-31') - rng.integers(0, 40, n_rows)
+    months[:3] = month_code('1990-01-31')
+    values = {'a': rng.normal(size=n_rows), 'b': rng.normal(size=n_rows)}
+
+    full = ClientMonthTensor(client_ids, months, values)
+    window = ClientMonthTensor(client_ids, months, values, last_month=month_code('2019-08-31'), keep_history=True)
+
+    assert len(window.months) == WINDOW_MONTHS
+    np.testing.assert_array_equal(window.clients, full.clients)
+    np.testing.assert_allclose(window.mean('a'), full.mean('a'), rtol=1e-5)
+    np.testing.assert_allclose(window.std('a'), full.std('a'), rtol=1e-4)
+    np.testing.assert_allclose(window.mean_difference('a', 'b'), full.mean_difference('a', 'b'), rtol=1e-4, atol=1e-6)
+
+    expected = full.columns_by_month('a', 'a_')
+    result = window.columns_by_month('a', 'a_')
+    assert list(result) == list(expected)
+    for name in expected:
+        np.testing.assert_array_equal(result[name], expected[name])
@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.utils import ProfitMetric, calculate_profit, profit_curve
+
+
+def funnel_rows(n_rows=200, seed=0):
+    rng = np.random.default_rng(seed)
+    sale = rng.random(n_rows) < 0.3
+    return pd.DataFrame({
+        'sale_flg': sale.astype(int),
+        'sale_amount': np.where(sale, rng.lognormal(9, 1, n_rows), np.nan),
+        'contacts': rng.integers(1, 4, n_rows),
+    })
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_profit_curve_matches_brute_force(seed):
+    df = funnel_rows(seed=seed)
+    rng = np.random.default_rng(seed)
+    # Rounded, so that many predictions tie
+    pred = rng.normal(size=len(df)).round(1)
+    profit = calculate_profit(df).to_numpy()
+
+    def mean_profit(threshold):
+        return profit[pred > threshold].sum() / len(pred)
+
+    thresholds, profits, best_threshold, best_profit = profit_curve(pred, df)
+
+    np.testing.assert_allclose(profits, [mean_profit(t) for t in thresholds])
+    candidates = np.concatenate([np.unique(pred), [-np.inf]])
+    assert best_profit == pytest.approx(max(mean_profit(t) for t in candidates))
+    assert mean_profit(best_threshold) == pytest.approx(best_profit)
+
+
+def test_profit_curve_of_no_predictions():
+    with pytest.raises(ValueError):
+        profit_curve(np.zeros(0), funnel_rows(0))
+
+
+@pytest.mark.parametrize('threshold', [0, 0.5])
+def test_profit_metric_matches_loop(threshold):
+    rng = np.random.default_rng(1)
+    approx = rng.normal(size=300)
+    target = rng.normal(size=300)
+    weight = rng.random(300)
+    metric = ProfitMetric(threshold)
+
+    for w in [None, weight]:
+        ones = np.ones(len(target)) if w is None else w
+        profit_sum, weight_sum = 0.0, 0.0
+        for i in range(len(target)):
+            weight_sum += ones[i]
+            if approx[i] > threshold:
+                profit_sum += ones[i] * target[i]
+
+        error, total = metric.evaluate([approx], target, w)
+        assert metric.get_final_error(error, total) == pytest.approx(profit_sum / weight_sum)